@@ -0,0 +1,92 @@
+import re
+
+from latency_histogram import LatencyHistogram
+
+'''
+Parses the output of ApacheBench (ab) locally.
+
+ab's stdout and its -e percentile table are fetched together in a single
+remote command (see get_ab_command) and split apart here, instead of
+grepping each metric out of output.txt with a separate remote command.
+The per-request times from -g are folded into a LatencyHistogram, so
+percentiles can be computed over the requests of several runs at once.
+'''
+
+RESULTS_SEPARATOR = '==== THROTTLEBOT AB PERCENTILES ===='
+REQUESTS_SEPARATOR = '==== THROTTLEBOT AB REQUEST TIMES ===='
+
+rps_pattern = re.compile(r'^Requests per second:\s+([\d.]+)', re.MULTILINE)
+time_per_request_pattern = re.compile(r'^Time per request:\s+([\d.]+)', re.MULTILINE)
+failed_requests_pattern = re.compile(r'^Failed requests:\s+(\d+)', re.MULTILINE)
+served_within_pattern = re.compile(r'^\s*(\d+)%\s+(\d+)', re.MULTILINE)
+
+# Wraps an ab command (which must use -e results_file and -g requests_file) so that
+# running it also prints the percentile table and the total time of every request
+def get_ab_command(benchmark_cmd, results_file='results_file', requests_file='requests_file'):
+    return '{} > output.txt; cat output.txt; echo "{}"; cat {}; echo "{}"; cut -f5 {}'.format(
+        benchmark_cmd, RESULTS_SEPARATOR, results_file, REQUESTS_SEPARATOR, requests_file)
+
+# Returns the list of (percentage served, time in ms) rows of an ab -e file
+def parse_percentile_file(percentile_text):
+    curve = []
+    for line in percentile_text.splitlines():
+        fields = line.strip().split(',')
+        if len(fields) != 2:
+            continue
+        try:
+            curve.append((float(fields[0]), float(fields[1])))
+        except ValueError:
+            # Header row
+            continue
+    return curve
+
+# Percentage of requests served within acceptable_ms, as read off the curve
+def get_percent_within(curve, acceptable_ms):
+    for percentage, time_ms in curve:
+        if time_ms > acceptable_ms:
+            return percentage
+    return 100.0
+
+# Builds a histogram from the ttime column of an ab -g file
+def parse_request_times(request_times_text):
+    histogram = LatencyHistogram()
+    for line in request_times_text.splitlines():
+        try:
+            histogram.record(float(line))
+        except ValueError:
+            # Header row
+            continue
+    return histogram
+
+# Parses the combined output of a command built with get_ab_command
+# Returns a dict with rps, time_per_request (ms, mean across concurrent requests),
+# failed_requests, latency_<p> for every row of ab's "served within" table,
+# latency_curve, the full list of (percentage, ms) points from -e,
+# and histogram, a LatencyHistogram of every request (None without -g)
+def parse_ab_output(combined_output):
+    request_times_text = None
+    if REQUESTS_SEPARATOR in combined_output:
+        combined_output, request_times_text = combined_output.split(REQUESTS_SEPARATOR, 1)
+    if RESULTS_SEPARATOR in combined_output:
+        ab_stdout, percentile_text = combined_output.split(RESULTS_SEPARATOR, 1)
+    else:
+        ab_stdout, percentile_text = combined_output, ''
+
+    results = {}
+    match = rps_pattern.search(ab_stdout)
+    results['rps'] = float(match.group(1)) if match else 0
+    match = time_per_request_pattern.search(ab_stdout)
+    results['time_per_request'] = float(match.group(1)) if match else 0
+    match = failed_requests_pattern.search(ab_stdout)
+    results['failed_requests'] = int(match.group(1)) if match else 0
+
+    for percentage, time_ms in served_within_pattern.findall(ab_stdout):
+        results['latency_{}'.format(percentage)] = float(time_ms)
+
+    results['latency_curve'] = parse_percentile_file(percentile_text)
+    results['histogram'] = None
+    if request_times_text is not None:
+        histogram = parse_request_times(request_times_text)
+        if histogram.count > 0:
+            results['histogram'] = histogram
+    return results
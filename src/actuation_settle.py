@@ -0,0 +1,60 @@
+import threading
+import time
+
+'''
+Waits for a throttle to take effect before Throttlebot measures.
+
+After a change is issued, the actuated state (cgroup files, OVS interface
+settings) is read back until it matches the requested value or a deadline
+passes. The observed settle latencies are kept per resource so they can
+be reported at the end of a run.
+'''
+
+# Maximum time in seconds to wait for a change to become visible
+SETTLE_TIMEOUT = 5.0
+
+# Time in seconds between two readbacks
+SETTLE_POLL_INTERVAL = 0.05
+
+# resource -> {'count', 'total', 'max', 'timeouts'}
+settle_stats = {}
+stats_lock = threading.Lock()
+
+def _record_settle(resource, latency, timed_out):
+    with stats_lock:
+        if resource not in settle_stats:
+            settle_stats[resource] = {'count': 0, 'total': 0.0, 'max': 0.0, 'timeouts': 0}
+        stats = settle_stats[resource]
+        stats['count'] += 1
+        stats['total'] += latency
+        stats['max'] = max(stats['max'], latency)
+        if timed_out:
+            stats['timeouts'] += 1
+
+# Polls read_state() until it returns expected_state
+# Returns the settle latency in seconds, or None if the deadline passed
+def wait_for_settle(resource, read_state, expected_state, timeout=SETTLE_TIMEOUT, poll_interval=SETTLE_POLL_INTERVAL):
+    start_time = time.time()
+    while True:
+        observed_state = read_state()
+        latency = time.time() - start_time
+        if observed_state == expected_state:
+            _record_settle(resource, latency, False)
+            return latency
+        if latency > timeout:
+            print 'WARNING: {} did not settle after {}s: expected {}, observed {}'.format(resource, timeout, expected_state, observed_state)
+            _record_settle(resource, latency, True)
+            return None
+        time.sleep(poll_interval)
+
+# Returns resource -> {'count', 'mean', 'max', 'timeouts'} for all changes so far
+def get_settle_stats():
+    summary = {}
+    with stats_lock:
+        for resource in settle_stats:
+            stats = settle_stats[resource]
+            summary[resource] = {'count': stats['count'],
+                                 'mean': stats['total'] / stats['count'],
+                                 'max': stats['max'],
+                                 'timeouts': stats['timeouts']}
+    return summary
@@ -0,0 +1,53 @@
+import threading
+
+'''
+Authoritative record of the allocation that was last applied to every
+(container, resource), so that actuations which would not change
+anything are skipped instead of being sent to the machines.
+
+The record is seeded with the instances whose limits, read from the
+machines, already are their allocation (run_throttlebot.seed_allocation_cache),
+and updated after every successful provisioning. Entries must be invalidated when a
+container is restarted, since its real allocation is then unknown.
+'''
+
+# (vm_ip, container_id, resource) -> allocation last applied
+applied_allocations = {}
+cache_lock = threading.Lock()
+
+# requests: provisioning requests checked against the cache
+# skipped: requests where every instance already had the allocation
+# instances_skipped / instances_applied: per-instance breakdown
+cache_stats = {'requests': 0, 'skipped': 0, 'instances_skipped': 0, 'instances_applied': 0}
+
+# Returns the instances of mr whose applied allocation differs from new_allocation
+def get_instances_to_change(mr, new_allocation):
+    with cache_lock:
+        changed_instances = [(vm_ip, container_id) for vm_ip,container_id in mr.instances
+                             if applied_allocations.get((vm_ip, container_id, mr.resource)) != float(new_allocation)]
+        cache_stats['requests'] += 1
+        cache_stats['instances_skipped'] += len(mr.instances) - len(changed_instances)
+        cache_stats['instances_applied'] += len(changed_instances)
+        if len(changed_instances) == 0:
+            cache_stats['skipped'] += 1
+    return changed_instances
+
+def record_applied_allocation(instances, resource, new_allocation):
+    with cache_lock:
+        for vm_ip,container_id in instances:
+            applied_allocations[(vm_ip, container_id, resource)] = float(new_allocation)
+
+# Forgets the applied allocations of the given (vm_ip, container_id) instances, or of all if None
+def invalidate_applied_allocations(instances=None):
+    with cache_lock:
+        if instances is None:
+            applied_allocations.clear()
+            return
+        instances = set(instances)
+        for key in list(applied_allocations.keys()):
+            if (key[0], key[1]) in instances:
+                del applied_allocations[key]
+
+def get_cache_stats():
+    with cache_lock:
+        return dict(cache_stats)
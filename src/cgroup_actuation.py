@@ -0,0 +1,181 @@
+import threading
+
+from actuation_settle import wait_for_settle
+
+'''
+Sets CPU limits by writing the container's cgroup files directly
+(cpu.cfs_quota_us/cpu.cfs_period_us and cpuset.cpus on cgroup v1,
+cpu.max and cpuset.cpus on the unified v2 hierarchy) instead of going
+through the Docker daemon with docker update.
+
+The cgroup directories of each container are discovered once and cached.
+All containers of a VM are changed in a single remote invocation; a
+container whose cgroup could not be found, or whose write fails, falls
+back to docker update within the same invocation. Every change is read
+back until it is visible before returning.
+'''
+
+# Period used when the quota is reset (docker's default)
+DEFAULT_CPU_PERIOD = 100000
+
+DISCOVERY_SCRIPT = '''if [ -f /sys/fs/cgroup/cgroup.controllers ]; then v=2; else v=1; fi
+for id in {container_ids}; do
+  if [ $v = 2 ]; then
+    cpu=$(ls -d /sys/fs/cgroup/system.slice/docker-$id*.scope /sys/fs/cgroup/docker/$id* 2>/dev/null | head -n 1)
+    cpuset=$cpu
+  else
+    cpu=$(ls -d /sys/fs/cgroup/cpu/docker/$id* /sys/fs/cgroup/cpu,cpuacct/docker/$id* /sys/fs/cgroup/cpu/system.slice/docker-$id*.scope 2>/dev/null | head -n 1)
+    cpuset=$(ls -d /sys/fs/cgroup/cpuset/docker/$id* /sys/fs/cgroup/cpuset/system.slice/docker-$id*.scope 2>/dev/null | head -n 1)
+  fi
+  echo "$id|$v|$cpu|$cpuset"
+done'''
+
+# container_id -> {'version': 1 or 2, 'cpu': dir or None, 'cpuset': dir or None}
+cgroup_path_cache = {}
+cache_lock = threading.Lock()
+
+# Finds the cgroup directories of the containers in one remote command
+# Only containers missing from the cache are looked up
+def discover_cgroup_paths(ssh_client, container_ids):
+    with cache_lock:
+        unknown_ids = [container_id for container_id in container_ids if container_id not in cgroup_path_cache]
+    if len(unknown_ids) != 0:
+        discovery_cmd = DISCOVERY_SCRIPT.format(container_ids=' '.join(unknown_ids))
+        _, stdout, _ = ssh_client.exec_command(discovery_cmd)
+        discovered = {}
+        for line in stdout.read().splitlines():
+            fields = line.strip().split('|')
+            if len(fields) != 4:
+                continue
+            container_id, version, cpu_dir, cpuset_dir = fields
+            discovered[container_id] = {'version': int(version),
+                                        'cpu': cpu_dir or None,
+                                        'cpuset': cpuset_dir or None}
+        with cache_lock:
+            for container_id in unknown_ids:
+                # Remember failed lookups too, these containers use docker update
+                cgroup_path_cache[container_id] = discovered.get(container_id, {'version': None, 'cpu': None, 'cpuset': None})
+
+    with cache_lock:
+        return dict((container_id, cgroup_path_cache[container_id]) for container_id in container_ids)
+
+# Adds already discovered cgroup directories (container_id -> paths, see above) to the cache
+def seed_cgroup_paths(container_to_paths):
+    with cache_lock:
+        cgroup_path_cache.update(container_to_paths)
+
+# Forgets the cached cgroup directories (of all containers if None)
+# Must be called when containers are restarted
+def invalidate_cgroup_paths(container_ids=None):
+    with cache_lock:
+        if container_ids is None:
+            cgroup_path_cache.clear()
+        else:
+            for container_id in container_ids:
+                cgroup_path_cache.pop(container_id, None)
+
+def _write_cmd(value, path):
+    return 'echo "{}" | sudo tee {} > /dev/null'.format(value, path)
+
+def _with_fallback(direct_cmds, fallback_cmd):
+    if len(direct_cmds) == 0:
+        return fallback_cmd
+    return '{{ {}; }} 2>/dev/null || {}'.format(' && '.join(direct_cmds), fallback_cmd)
+
+def _cpu_quota_cmd(paths, container_id, cpu_period, cpu_quota):
+    fallback_cmd = 'docker update --cpu-period={} --cpu-quota={} {}'.format(cpu_period, cpu_quota, container_id)
+    if cpu_quota < 0:
+        fallback_cmd = 'docker update --cpu-quota=-1 {}'.format(container_id)
+
+    cpu_dir = paths['cpu']
+    if cpu_dir is None:
+        return _with_fallback([], fallback_cmd)
+    if paths['version'] == 2:
+        quota_str = 'max' if cpu_quota < 0 else cpu_quota
+        return _with_fallback([_write_cmd('{} {}'.format(quota_str, cpu_period), cpu_dir + '/cpu.max')], fallback_cmd)
+    # The quota is lifted first so that a shorter period is never rejected
+    return _with_fallback([_write_cmd(-1, cpu_dir + '/cpu.cfs_quota_us'),
+                           _write_cmd(cpu_period, cpu_dir + '/cpu.cfs_period_us'),
+                           _write_cmd(cpu_quota, cpu_dir + '/cpu.cfs_quota_us')], fallback_cmd)
+
+def _cpu_cores_cmd(paths, container_id, cpus):
+    fallback_cmd = 'docker update --cpuset-cpus={} --cpuset-mems=0 {}'.format(cpus, container_id)
+    cpuset_dir = paths['cpuset']
+    if cpuset_dir is None:
+        return _with_fallback([], fallback_cmd)
+    direct_cmds = [_write_cmd(cpus, cpuset_dir + '/cpuset.cpus')]
+    if paths['version'] == 1:
+        direct_cmds.insert(0, _write_cmd(0, cpuset_dir + '/cpuset.mems'))
+    return _with_fallback(direct_cmds, fallback_cmd)
+
+def _run_batch(ssh_client, cmds):
+    batch_cmd = '\n'.join(cmds)
+    _, stdout, stderr = ssh_client.exec_command(batch_cmd)
+    stdout.read()
+    err = stderr.read()
+    if err:
+        print 'Error execing {}: {}'.format(batch_cmd, err)
+
+# Expands a cpuset string such as '0-2,4' to the set of cores it names
+def parse_cpuset(cpus):
+    cores = set()
+    for cpu_range in cpus.strip().split(','):
+        if cpu_range == '':
+            continue
+        bounds = cpu_range.split('-')
+        cores.update(range(int(bounds[0]), int(bounds[-1]) + 1))
+    return frozenset(cores)
+
+def _cpu_limits_read_cmd(paths, container_id):
+    if paths['cpu'] is None or paths['cpuset'] is None:
+        return 'echo "{} $(docker inspect --format \'{{{{.HostConfig.CpuQuota}}}} {{{{.HostConfig.CpusetCpus}}}}\' {})"'.format(container_id, container_id)
+    if paths['version'] == 2:
+        return 'echo "{} $(cut -d \' \' -f1 {}/cpu.max) $(cat {}/cpuset.cpus)"'.format(container_id, paths['cpu'], paths['cpuset'])
+    return 'echo "{} $(cat {}/cpu.cfs_quota_us) $(cat {}/cpuset.cpus)"'.format(container_id, paths['cpu'], paths['cpuset'])
+
+# Reads back the CPU limits of several containers in one remote invocation
+# Returns container_id -> (quota in microseconds or -1 if unlimited, frozenset of cores)
+def read_cpu_limits_batch(ssh_client, container_ids):
+    all_paths = discover_cgroup_paths(ssh_client, container_ids)
+    read_cmd = '\n'.join(_cpu_limits_read_cmd(all_paths[container_id], container_id) for container_id in container_ids)
+    _, stdout, _ = ssh_client.exec_command(read_cmd)
+
+    cpu_limits = {}
+    for line in stdout.read().splitlines():
+        fields = line.split()
+        if len(fields) < 2:
+            continue
+        quota = -1 if fields[1] == 'max' or int(fields[1]) <= 0 else int(fields[1])
+        cores = parse_cpuset(fields[2]) if len(fields) > 2 else frozenset()
+        cpu_limits[fields[0]] = (quota, cores)
+    return cpu_limits
+
+# Sets the CPU quota of every container on the VM of ssh_client
+# container_to_quota maps container_id -> quota in microseconds per cpu_period (-1 to reset)
+def set_cpu_quota_batch(ssh_client, container_to_quota, cpu_period):
+    container_ids = list(container_to_quota.keys())
+    all_paths = discover_cgroup_paths(ssh_client, container_ids)
+    cmds = [_cpu_quota_cmd(all_paths[container_id], container_id, cpu_period, container_to_quota[container_id])
+            for container_id in container_ids]
+    _run_batch(ssh_client, cmds)
+
+    expected_quotas = dict((container_id, max(container_to_quota[container_id], -1)) for container_id in container_ids)
+    def read_quotas():
+        cpu_limits = read_cpu_limits_batch(ssh_client, container_ids)
+        return dict((container_id, cpu_limits.get(container_id, (None, None))[0]) for container_id in container_ids)
+    wait_for_settle('CPU-QUOTA', read_quotas, expected_quotas)
+
+# Pins cores for every container on the VM of ssh_client
+# container_to_cpus maps container_id -> cpuset string such as '0-3'
+def set_cpu_cores_batch(ssh_client, container_to_cpus):
+    container_ids = list(container_to_cpus.keys())
+    all_paths = discover_cgroup_paths(ssh_client, container_ids)
+    cmds = [_cpu_cores_cmd(all_paths[container_id], container_id, container_to_cpus[container_id])
+            for container_id in container_ids]
+    _run_batch(ssh_client, cmds)
+
+    expected_cores = dict((container_id, parse_cpuset(container_to_cpus[container_id])) for container_id in container_ids)
+    def read_cores():
+        cpu_limits = read_cpu_limits_batch(ssh_client, container_ids)
+        return dict((container_id, cpu_limits.get(container_id, (None, None))[1]) for container_id in container_ids)
+    wait_for_settle('CPU-CORE', read_cores, expected_cores)
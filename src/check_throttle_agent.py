@@ -0,0 +1,146 @@
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from remote_execution import AgentClient, AgentError
+from throttle_agent import sign_payload
+
+'''
+Checks throttle_agent.py end to end, without root and without touching the
+cgroups of the machine.
+
+The agent is started on the loopback interface with a temporary cgroup v1
+hierarchy holding one fake container. AgentClient sets the CPU quota, cores
+and blkio limits of that container, which are read back from the cgroup
+files. Batches signed with the wrong token, replayed batches and invalid
+container IDs must be rejected.
+
+$ python check_throttle_agent.py
+'''
+
+CONTAINER_ID = '0123456789ab' + 'c' * 52
+
+# Files of the fake container and their initial contents, per v1 controller
+CGROUP_FILES = {
+    'cpu': {'cpu.cfs_quota_us': '-1', 'cpu.cfs_period_us': '100000'},
+    'cpuset': {'cpuset.cpus': '0-3'},
+    'blkio': {'blkio.throttle.read_bps_device': '', 'blkio.throttle.write_bps_device': ''},
+}
+
+# Seconds to wait for the agent to listen
+STARTUP_TIMEOUT = 10
+
+def make_cgroup_root():
+    cgroup_root = tempfile.mkdtemp(prefix='throttle_agent_cgroup')
+    for controller in CGROUP_FILES:
+        container_dir = os.path.join(cgroup_root, controller, 'docker', CONTAINER_ID)
+        os.makedirs(container_dir)
+        for file_name in CGROUP_FILES[controller]:
+            with open(os.path.join(container_dir, file_name), 'w') as f:
+                f.write(CGROUP_FILES[controller][file_name])
+    return cgroup_root
+
+def read_cgroup_file(cgroup_root, controller, file_name):
+    with open(os.path.join(cgroup_root, controller, 'docker', CONTAINER_ID, file_name)) as f:
+        return f.read().strip()
+
+def get_free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+def connect(port, token):
+    deadline = time.time() + STARTUP_TIMEOUT
+    while True:
+        try:
+            return AgentClient('127.0.0.1', port, token, timeout=STARTUP_TIMEOUT)
+        except socket.error:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.1)
+
+def expect_error(fn, description):
+    try:
+        fn()
+    except AgentError as e:
+        print 'OK: {} rejected ({})'.format(description, e)
+        return
+    raise AssertionError('{} was accepted'.format(description))
+
+def check_limits(client, cgroup_root):
+    short_id = CONTAINER_ID[:12]
+    client.request_checked([{'op': 'ping'}])
+
+    client.request_checked([{'op': 'set_cpu_quota', 'container_id': short_id, 'period': 1000000, 'quota': 500000},
+                            {'op': 'set_cpu_cores', 'container_id': short_id, 'cpus': '0-1'},
+                            {'op': 'set_blkio', 'container_id': short_id, 'bps': 1000}])
+    assert read_cgroup_file(cgroup_root, 'cpu', 'cpu.cfs_quota_us') == '500000'
+    assert read_cgroup_file(cgroup_root, 'cpu', 'cpu.cfs_period_us') == '1000000'
+    assert read_cgroup_file(cgroup_root, 'cpuset', 'cpuset.cpus') == '0-1'
+    assert read_cgroup_file(cgroup_root, 'blkio', 'blkio.throttle.read_bps_device') == '202:0 1000'
+    assert read_cgroup_file(cgroup_root, 'blkio', 'blkio.throttle.write_bps_device') == '202:0 1000'
+    print 'OK: CPU quota, cores and blkio limits written'
+
+    client.request_checked([{'op': 'reset_cpu_quota', 'container_id': short_id}])
+    assert read_cgroup_file(cgroup_root, 'cpu', 'cpu.cfs_quota_us') == '-1'
+    print 'OK: CPU quota reset'
+
+    expect_error(lambda: client.request_checked([{'op': 'set_blkio', 'container_id': '../{}'.format(short_id), 'bps': 1}]),
+                 'Invalid container id')
+    expect_error(lambda: client.request_checked([{'op': 'exec', 'cmd': 'true'}]), 'Unknown op')
+
+# Sends the same signed batch twice on a raw connection, the second must be refused
+def check_replay(port, token):
+    sock = socket.create_connection(('127.0.0.1', port), STARTUP_TIMEOUT)
+    sock_file = sock.makefile('rb')
+    try:
+        nonce = json.loads(sock_file.readline().decode('utf-8'))['nonce']
+        payload = json.dumps({'seq': 1, 'requests': [{'op': 'ping'}]})
+        batch = (json.dumps({'payload': payload, 'mac': sign_payload(token, nonce, payload)}) + '\n').encode('utf-8')
+        responses = []
+        for attempt in range(2):
+            sock.sendall(batch)
+            responses.append(json.loads(sock_file.readline().decode('utf-8')))
+        assert 'results' in responses[0], responses[0]
+        assert responses[1].get('error') == 'Replayed batch', responses[1]
+        print 'OK: Replayed batch rejected'
+    finally:
+        sock_file.close()
+        sock.close()
+
+def main():
+    token = os.urandom(16).encode('hex')
+    port = get_free_port()
+    cgroup_root = make_cgroup_root()
+    agent_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'throttle_agent.py')
+    agent = subprocess.Popen([sys.executable, agent_path, '--host', '127.0.0.1', '--port', str(port),
+                              '--token', token, '--cgroup_root', cgroup_root])
+    try:
+        client = connect(port, token)
+        try:
+            check_limits(client, cgroup_root)
+        finally:
+            client.close()
+
+        wrong_client = AgentClient('127.0.0.1', port, token + 'x', timeout=STARTUP_TIMEOUT)
+        try:
+            expect_error(lambda: wrong_client.request([{'op': 'ping'}]), 'Batch signed with the wrong token')
+        finally:
+            wrong_client.close()
+
+        check_replay(port, token)
+    finally:
+        agent.terminate()
+        agent.wait()
+        shutil.rmtree(cgroup_root)
+    print 'Throttle agent check passed'
+
+if __name__ == "__main__":
+    main()
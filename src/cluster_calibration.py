@@ -0,0 +1,167 @@
+import threading
+
+import remote_execution as remote_exec
+import redis_resource as resource_datastore
+from cluster_information import get_instance_specs
+
+'''
+Measures the resource capacity of every VM with short micro-benchmarks.
+
+Capacities are expressed in the units of MR allocations: CPU-QUOTA in
+percent of a core, CPU-CORE in cores, DISK in bytes/sec and NET in
+bits/sec. Each VM runs its benchmarks in a single remote invocation and
+all VMs are benchmarked concurrently:
+
+CPU: a fixed amount of hashing on one core, then on every core at once.
+     The ratio of the two durations is the number of cores that really
+     run in parallel, which is lower than nproc on throttled or burstable VMs.
+DISK: a direct (uncached) write then read of a scratch file. The slower
+      of the two sets the capacity, as blkio throttles both to one rate.
+NET: an iperf3 transfer to the next VM of the cluster. When iperf3 is
+     not available, the link speed of the default interface is used, and
+     failing that the instance specs of machine_type.
+
+Results are kept in Redis with a fingerprint of the VM's hardware (CPU
+model, cores, memory, disks and network interfaces). VMs whose fingerprint
+did not change are not benchmarked again.
+'''
+
+# Sizes of the benchmarks, small enough for the calibration to take a few seconds
+CPU_WORK_BYTES = 200000000
+DISK_WORK_MB = 256
+NET_SECONDS = 2
+
+# Printed as fingerprint|<md5 of the hardware description>
+FINGERPRINT_CMD = ('echo "fingerprint|$({ nproc --all; grep -m1 "model name" /proc/cpuinfo; grep MemTotal /proc/meminfo; '
+                   'lsblk -dno NAME,SIZE,ROTA; ls /sys/class/net; } 2>/dev/null | md5sum | cut -d" " -f1)"')
+
+# Timings are printed as <benchmark>|<start>|<end>, in seconds since the epoch
+# Runs after FINGERPRINT_CMD, so that the fingerprint matches the measured hardware
+BENCHMARK_CMD = '\n'.join([
+    'cores=$(nproc --all); echo "cores|$cores"',
+    'cpu_work() {{ head -c {cpu_bytes} /dev/zero | md5sum > /dev/null; }}',
+    's=$(date +%s.%N); cpu_work; echo "cpu_single|$s|$(date +%s.%N)"',
+    's=$(date +%s.%N); for i in $(seq $cores); do cpu_work & done; wait; echo "cpu_parallel|$s|$(date +%s.%N)"',
+    'f=$(mktemp -p /var/tmp)',
+    's=$(date +%s.%N); dd if=/dev/zero of=$f bs=1M count={disk_mb} oflag=direct 2>/dev/null; echo "disk_write|$s|$(date +%s.%N)"',
+    's=$(date +%s.%N); dd if=$f of=/dev/null bs=1M iflag=direct 2>/dev/null; echo "disk_read|$s|$(date +%s.%N)"',
+    'rm -f $f',
+    'echo "link_speed|$(cat /sys/class/net/$(ip route show default | awk \'{{print $5; exit}}\')/speed 2>/dev/null)"'])
+
+# Measures the throughput to peer in Mbits/sec, printed as net|<Mbits/sec>
+NET_BENCHMARK_CMD = ('echo "net|$(iperf3 -c {peer} -t {seconds} -f m 2>/dev/null | grep receiver | '
+                     'grep -o "[0-9.]* Mbits/sec" | cut -d" " -f1)"')
+
+# Serves a single iperf3 transfer in the background
+IPERF_SERVER_CMD = 'iperf3 -s -1 -D > /dev/null 2>&1'
+
+# Parses the key|value... lines printed by the commands above
+def parse_benchmark_output(output):
+    fields = {}
+    for line in output.splitlines():
+        line = line.strip().split('|')
+        if len(line) > 1:
+            fields[line[0]] = line[1:]
+    return fields
+
+def get_duration(fields, benchmark):
+    start, end = fields[benchmark]
+    return max(float(end) - float(start), 1e-6)
+
+def parse_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+# Converts the benchmark output of a VM into {resource -> capacity}
+# fallback_specs (see get_instance_specs) is used when the network could not be measured
+def compute_capacity(fields, fallback_specs):
+    cores = int(fields['cores'][0])
+    effective_cores = min(cores, cores * get_duration(fields, 'cpu_single') / get_duration(fields, 'cpu_parallel'))
+
+    disk_bytes = DISK_WORK_MB * 1024 * 1024
+    disk_duration = max(get_duration(fields, 'disk_write'), get_duration(fields, 'disk_read'))
+
+    net_mbps = None
+    if 'net' in fields:
+        net_mbps = parse_float(fields['net'][0])
+    if not net_mbps and 'link_speed' in fields:
+        net_mbps = parse_float(fields['link_speed'][0])
+    if not net_mbps or net_mbps < 0:
+        net_mbps = fallback_specs.get('NET', 0)
+    if net_mbps == 0:
+        print 'WARNING: The network capacity could not be measured, NET MRs cannot be improved'
+
+    return {'CPU-CORE': cores,
+            'CPU-QUOTA': round(effective_cores * 100),
+            'DISK': int(disk_bytes / disk_duration),
+            'NET': int(net_mbps * 10 ** 6)}
+
+def run_on_vms(vm_ip_to_cmd):
+    vm_to_output = {}
+    results_lock = threading.Lock()
+    def run_task(vm_ip, cmd):
+        _, stdout, _ = remote_exec.get_client(vm_ip).exec_command(cmd)
+        output = stdout.read()
+        with results_lock:
+            vm_to_output[vm_ip] = output
+
+    task_errors = remote_exec.execute_per_host(dict((vm_ip, [vm_ip_to_cmd[vm_ip]]) for vm_ip in vm_ip_to_cmd), run_task)
+    for vm_ip,_ in task_errors:
+        print 'ERROR: Calibration of VM {} failed: {}'.format(vm_ip, task_errors[(vm_ip, vm_ip_to_cmd[vm_ip])])
+    if len(task_errors) > 0:
+        raise task_errors.values()[0]
+    return vm_to_output
+
+# Benchmarks vm_ips concurrently, each VM measuring the network to the next VM of all_vms
+# Returns {vm_ip -> (fingerprint, {resource -> capacity})}
+def benchmark_vms(vm_ips, all_vms, fallback_specs):
+    benchmark_cmd = FINGERPRINT_CMD + '\n' + BENCHMARK_CMD.format(cpu_bytes=CPU_WORK_BYTES, disk_mb=DISK_WORK_MB)
+    vm_to_cmd = dict((vm_ip, benchmark_cmd) for vm_ip in vm_ips)
+
+    if len(all_vms) > 1:
+        vm_to_peer = dict((vm_ip, all_vms[(all_vms.index(vm_ip) + 1) % len(all_vms)]) for vm_ip in vm_ips)
+        run_on_vms(dict((peer, IPERF_SERVER_CMD) for peer in vm_to_peer.values()))
+        for vm_ip in vm_ips:
+            vm_to_cmd[vm_ip] += '\n' + NET_BENCHMARK_CMD.format(peer=vm_to_peer[vm_ip], seconds=NET_SECONDS)
+
+    vm_to_calibration = {}
+    for vm_ip, output in run_on_vms(vm_to_cmd).items():
+        fields = parse_benchmark_output(output)
+        vm_to_calibration[vm_ip] = (fields['fingerprint'][0], compute_capacity(fields, fallback_specs))
+    return vm_to_calibration
+
+# Returns {vm_ip -> {resource -> capacity}} for every VM of vm_ips,
+# only benchmarking the VMs never calibrated or whose hardware changed since
+def calibrate_cluster(redis_db, vm_ips, machine_type):
+    vm_ips = list(vm_ips)
+    vm_to_fingerprint = dict((vm_ip, parse_benchmark_output(output)['fingerprint'][0])
+                             for vm_ip, output in run_on_vms(dict((vm_ip, FINGERPRINT_CMD) for vm_ip in vm_ips)).items())
+    stored_calibrations = resource_datastore.read_machine_calibrations(redis_db, vm_ips)
+
+    vm_to_capacity = {}
+    vms_to_benchmark = []
+    for vm_ip in vm_ips:
+        fingerprint, capacity = stored_calibrations[vm_ip]
+        if fingerprint == vm_to_fingerprint[vm_ip]:
+            vm_to_capacity[vm_ip] = capacity
+        else:
+            vms_to_benchmark.append(vm_ip)
+
+    print 'Calibrating {} VMs, reusing the calibration of {}'.format(len(vms_to_benchmark), len(vm_ips) - len(vms_to_benchmark))
+    if len(vms_to_benchmark) > 0:
+        # The instance specs give the network in Mbits/sec
+        fallback_specs = {}
+        if machine_type is not None:
+            fallback_specs = get_instance_specs(machine_type)
+        benchmarked = benchmark_vms(vms_to_benchmark, vm_ips, fallback_specs)
+
+        pipe = redis_db.pipeline()
+        for vm_ip in vms_to_benchmark:
+            fingerprint, capacity = benchmarked[vm_ip]
+            print 'Calibrated {}: {}'.format(vm_ip, capacity)
+            resource_datastore.write_machine_calibration(pipe, vm_ip, fingerprint, capacity)
+            vm_to_capacity[vm_ip] = capacity
+        pipe.execute()
+    return vm_to_capacity
@@ -0,0 +1,110 @@
+import json
+import threading
+
+import remote_execution as remote_exec
+import cgroup_actuation
+import container_information
+
+'''
+Discovers the containers running on every VM of the cluster.
+
+All VMs are queried concurrently, and each VM answers a single remote
+invocation that lists its containers (docker ps in JSON), resolves their
+network endpoints with one batched docker inspect, and finds their cgroup
+directories. The name, image, IDs, veth interface and cgroup paths of a
+container are joined by container ID, instead of zipping the outputs of
+separate commands and assuming they line up.
+
+The veth and cgroup path caches used when actuating are seeded from the
+discovered containers, so they are not looked up again container by container.
+'''
+
+# Prefixes the lines of the batched docker inspect
+INSPECT_PREFIX = 'inspect|'
+
+# Lines are, in any order: one JSON object per container (docker ps),
+# inspect|<full id>|<endpoint ids> per container, and <id>|<version>|<cpu dir>|<cpuset dir>
+# per container (cgroup_actuation.DISCOVERY_SCRIPT)
+DISCOVERY_CMD = '\n'.join([
+    "docker ps --no-trunc --format '{{json .}}'",
+    "docker ps -q --no-trunc | xargs -r docker inspect --format '" + INSPECT_PREFIX +
+    "{{.Id}}|{{range .NetworkSettings.Networks}}{{.EndpointID}} {{end}}'",
+    cgroup_actuation.DISCOVERY_SCRIPT.format(container_ids='$(docker ps -q)')])
+
+# Container IDs used throughout Throttlebot are the short IDs shown by docker ps
+SHORT_ID_LENGTH = 12
+
+# OVS interface names are the first 15 characters of the endpoint id
+VETH_LENGTH = 15
+
+# Parses the output of DISCOVERY_CMD
+# Returns a list of container dicts with id, full_id, names, image, veth (or None)
+# and cgroup (as cgroup_actuation.discover_cgroup_paths returns it, or None)
+def parse_discovery_output(output):
+    containers = []
+    full_id_to_veth = {}
+    short_id_to_cgroup = {}
+    for line in output.splitlines():
+        line = line.strip()
+        if line.startswith('{'):
+            container = json.loads(line)
+            full_id = str(container['ID'])
+            containers.append({'id': full_id[:SHORT_ID_LENGTH],
+                               'full_id': full_id,
+                               'names': str(container.get('Names', '')).split(','),
+                               'image': str(container['Image'])})
+        elif line.startswith(INSPECT_PREFIX):
+            full_id, endpoint_ids = line[len(INSPECT_PREFIX):].split('|', 1)
+            endpoint_ids = endpoint_ids.split()
+            if len(endpoint_ids) > 0:
+                full_id_to_veth[full_id] = endpoint_ids[0][:VETH_LENGTH]
+        else:
+            fields = line.split('|')
+            if len(fields) != 4:
+                continue
+            container_id, version, cpu_dir, cpuset_dir = fields
+            short_id_to_cgroup[container_id[:SHORT_ID_LENGTH]] = {'version': int(version),
+                                                                 'cpu': cpu_dir or None,
+                                                                 'cpuset': cpuset_dir or None}
+
+    for container in containers:
+        container['veth'] = full_id_to_veth.get(container['full_id'])
+        container['cgroup'] = short_id_to_cgroup.get(container['id'])
+    return containers
+
+def discover_vm(vm_ip):
+    ssh_client = remote_exec.get_client(vm_ip)
+    _, stdout, _ = ssh_client.exec_command(DISCOVERY_CMD)
+    return parse_discovery_output(stdout.read())
+
+# Seeds the veth and cgroup path caches with the discovered containers
+def seed_caches(vm_to_containers):
+    container_to_veth = {}
+    container_to_cgroup = {}
+    for vm_ip in vm_to_containers:
+        for container in vm_to_containers[vm_ip]:
+            if container['veth'] is not None:
+                container_to_veth[container['id']] = container['veth']
+            if container['cgroup'] is not None:
+                container_to_cgroup[container['id']] = container['cgroup']
+    container_information.seed_container_veths(container_to_veth)
+    cgroup_actuation.seed_cgroup_paths(container_to_cgroup)
+
+# Discovers the containers of all vm_ips concurrently
+# Returns {vm_ip -> [container dict]} (see parse_discovery_output)
+def discover_cluster(vm_ips):
+    vm_to_containers = {}
+    results_lock = threading.Lock()
+    def discover_task(vm_ip, task):
+        containers = discover_vm(vm_ip)
+        with results_lock:
+            vm_to_containers[vm_ip] = containers
+
+    task_errors = remote_exec.execute_per_host(dict((vm_ip, [None]) for vm_ip in vm_ips), discover_task)
+    for vm_ip,_ in task_errors:
+        print 'ERROR: Discovery of VM {} failed: {}'.format(vm_ip, task_errors[(vm_ip, None)])
+    if len(task_errors) > 0:
+        raise task_errors.values()[0]
+
+    seed_caches(vm_to_containers)
+    return vm_to_containers
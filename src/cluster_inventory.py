@@ -0,0 +1,207 @@
+import json
+import re
+import threading
+import time
+from subprocess import Popen, PIPE
+
+import remote_execution as remote_exec
+from cluster_discovery import discover_cluster
+
+'''
+Inventory of the cluster: its VMs, the services running on them, and the
+containers of each VM.
+
+A provider lists the VMs and services of the cluster, either from a static
+inventory file, from the local Quilt daemon (quilt ps), or from the
+simulated cluster. The containers of the VMs are found with one concurrent
+discovery pass (see cluster_discovery.py).
+
+Everything is cached for ttl seconds, so the many callers that ask for the
+VMs, services or placements of the cluster share one lookup instead of each
+running quilt ps or docker ps again. Containers are cached per VM, so a
+lookup over hundreds of VMs only discovers the VMs that are missing or expired.
+'''
+
+# Containers that are part of the Quilt deployment rather than the application
+SERVICE_BLACKLIST = ['quilt/ovs', 'google/cadvisor:v0.24.1', 'quay.io/coreos/etcd:v3.0.2', 'mchang6137/quilt:latest']
+
+QUILT_PS_CMD = ['quilt', 'ps']
+IP_PATTERN = re.compile(r'\b\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}\b')
+
+DEFAULT_TTL = 60
+
+class StaticInventory:
+    '''
+    Reads the VMs and services from a JSON file, e.g.
+    {"vms": ["10.0.0.1", "10.0.0.2"], "services": ["nginx:1.10"]}
+    Without "services", the services are those found on the VMs.
+    '''
+    def __init__(self, inventory_file):
+        self.inventory_file = inventory_file
+
+    def get_vms(self):
+        with open(self.inventory_file) as f:
+            return [str(vm_ip) for vm_ip in json.load(f)['vms']]
+
+    def get_services(self, vm_to_containers):
+        with open(self.inventory_file) as f:
+            inventory = json.load(f)
+        if 'services' in inventory:
+            return [str(service) for service in inventory['services']]
+        return get_container_images(vm_to_containers)
+
+class QuiltInventory:
+    '''
+    Reads the VMs from the machine table of quilt ps, and the services from the containers of the VMs
+    '''
+    def get_vms(self):
+        p = Popen(QUILT_PS_CMD, stdout=PIPE)
+        return parse_quilt_machines(p.stdout.read())
+
+    def get_services(self, vm_to_containers):
+        return get_container_images(vm_to_containers)
+
+class SimulatedInventory:
+    def __init__(self, simulated_cluster):
+        self.simulated_cluster = simulated_cluster
+
+    def get_vms(self):
+        return list(self.simulated_cluster.vm_ips)
+
+    def get_services(self, vm_to_containers):
+        return self.simulated_cluster.get_services()
+
+# Returns the public IPs of the Worker machines of the machine table of quilt ps
+# Masters run no application containers; the container table that follows is ignored
+def parse_quilt_machines(output):
+    vm_ips = []
+    role_column = None
+    for line in output.splitlines():
+        if line.startswith('CONTAINER'):
+            break
+        fields = line.split()
+        if 'ROLE' in fields:
+            role_column = fields.index('ROLE')
+            continue
+        if role_column is None or len(fields) <= role_column or fields[role_column] != 'Worker':
+            continue
+        m = IP_PATTERN.search(line)
+        if m:
+            vm_ips.append(m.group(0))
+    return vm_ips
+
+# Returns the images of the application containers, in a stable order
+def get_container_images(vm_to_containers):
+    images = set()
+    for vm_ip in vm_to_containers:
+        for container in vm_to_containers[vm_ip]:
+            images.add(container['image'])
+    return sorted(image for image in images if image not in SERVICE_BLACKLIST)
+
+class ClusterInventory:
+    '''
+    Caches what provider reports about the cluster for ttl seconds
+    '''
+    def __init__(self, provider, ttl=DEFAULT_TTL):
+        self.provider = provider
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # (load time, value) of the VM and service lists, None when not loaded
+        self.vms = None
+        self.services = None
+        # vm_ip -> (load time, [container dict])
+        self.vm_to_containers = {}
+        self.stats = {'hits': 0, 'vm_loads': 0, 'service_loads': 0, 'vms_discovered': 0}
+
+    def is_fresh(self, entry):
+        return entry is not None and time.time() - entry[0] < self.ttl
+
+    def get_vms(self):
+        with self.lock:
+            if self.is_fresh(self.vms):
+                self.stats['hits'] += 1
+            else:
+                self.vms = (time.time(), self.provider.get_vms())
+                self.stats['vm_loads'] += 1
+            return list(self.vms[1])
+
+    def get_services(self):
+        vm_to_containers = self.get_vm_to_containers(self.get_vms())
+        with self.lock:
+            if self.is_fresh(self.services):
+                self.stats['hits'] += 1
+            else:
+                self.services = (time.time(), self.provider.get_services(vm_to_containers))
+                self.stats['service_loads'] += 1
+            return list(self.services[1])
+
+    # Returns {vm_ip -> [container dict]} for vm_ips (see cluster_discovery.parse_discovery_output)
+    # Only the VMs whose containers are missing or expired are discovered
+    def get_vm_to_containers(self, vm_ips):
+        with self.lock:
+            stale_vms = [vm_ip for vm_ip in vm_ips if not self.is_fresh(self.vm_to_containers.get(vm_ip))]
+            if len(stale_vms) > 0:
+                load_time = time.time()
+                discovered = discover_cluster(stale_vms)
+                for vm_ip in stale_vms:
+                    self.vm_to_containers[vm_ip] = (load_time, discovered[vm_ip])
+                self.stats['vms_discovered'] += len(stale_vms)
+            if len(stale_vms) < len(vm_ips):
+                self.stats['hits'] += 1
+            return dict((vm_ip, self.vm_to_containers[vm_ip][1]) for vm_ip in vm_ips)
+
+    # Forgets the containers of vm_ips (of every VM if None), e.g. after containers restart there
+    # The VM and service lists are forgotten as well
+    def invalidate(self, vm_ips=None):
+        with self.lock:
+            self.vms = None
+            self.services = None
+            if vm_ips is None:
+                self.vm_to_containers.clear()
+            else:
+                for vm_ip in vm_ips:
+                    self.vm_to_containers.pop(vm_ip, None)
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+# The inventory used by cluster_information, chosen by set_inventory
+inventory = {'inventory': None}
+inventory_lock = threading.Lock()
+
+# Selects where the VMs and services are read from: 'quilt', 'static' (inventory_file) or 'simulated'
+# The simulated remote backend always uses the simulated cluster
+def set_inventory(name, inventory_file=None, ttl=DEFAULT_TTL):
+    if name not in ['quilt', 'static', 'simulated']:
+        raise ValueError('Unknown inventory {}'.format(name))
+    simulated_cluster = remote_exec.get_simulated_cluster()
+    if name == 'simulated' or simulated_cluster is not None:
+        if simulated_cluster is None:
+            raise ValueError('The simulated inventory requires the simulated remote backend')
+        provider = SimulatedInventory(simulated_cluster)
+    elif name == 'static':
+        if inventory_file is None:
+            raise ValueError('The static inventory requires an inventory file')
+        provider = StaticInventory(inventory_file)
+    else:
+        provider = QuiltInventory()
+    with inventory_lock:
+        inventory['inventory'] = ClusterInventory(provider, ttl)
+
+# Returns the current inventory, reading from Quilt (or the simulated cluster) if none was selected
+def get_inventory():
+    with inventory_lock:
+        current_inventory = inventory['inventory']
+    if current_inventory is None:
+        set_inventory('quilt')
+        with inventory_lock:
+            current_inventory = inventory['inventory']
+    return current_inventory
+
+# Forgets the cached containers of vm_ips, if an inventory is in use
+def invalidate_inventory(vm_ips=None):
+    with inventory_lock:
+        current_inventory = inventory['inventory']
+    if current_inventory is not None:
+        current_inventory.invalidate(vm_ips)
@@ -1,20 +1,27 @@
+import threading
+
 from remote_execution import *
 
+# container_id -> OVS interface name, seeded by cluster_discovery
+veth_cache = {}
+veth_cache_lock = threading.Lock()
+
 #Returns potential interface names in the format of interfaces
+# The IDs of all containers are read with a single docker ps
 def get_container_id(ssh_client, full_id=False, append_c=True):
-    all_names = get_container_names(ssh_client)
+    _, stdout, _ = ssh_client.exec_command('docker ps --no-trunc --format="{{.ID}} {{.Names}}"')
     all_ids = []
-    for name in all_names:
-        cmd = 'docker inspect --format=\"{{{{.Id}}}}\" {}'.format(name)
-
+    for line in stdout.read().splitlines():
+        container_id, name = line.split(' ', 1)
+        if name == 'minion':
+            continue
         if full_id is False:
-            #First 13 characters because of interface naming
-            cmd += '| awk \'{{print substr($0,0,13)}}\''
-        _, stdout, _ = ssh_client.exec_command(cmd)
+            #First 12 characters because of interface naming
+            container_id = container_id[:12]
         if append_c:
-            all_ids.append(stdout.read()[:-1] + '_c')
+            all_ids.append(container_id + '_c')
         else:
-            all_ids.append(stdout.read()[:-1])
+            all_ids.append(container_id)
     return all_ids
 
 def get_container_names(ssh_client, only_running=True):
@@ -36,9 +43,35 @@ def get_container_info(ssh_client, command, only_running=True):
     results = stdout.read().splitlines()
     return results
 
+# Interfaces are cached with either backend, as the utilization sampler maps them back to containers
 def get_container_veth(ssh_client, container_id):
+    with veth_cache_lock:
+        if container_id in veth_cache:
+            return veth_cache[container_id]
+    if is_agent_client(ssh_client):
+        interface_name = str(ssh_client.request_checked([{'op': 'resolve_veth', 'container_id': container_id}])[0]['interface'])
+        with veth_cache_lock:
+            veth_cache[container_id] = interface_name
+        return interface_name
     get_interface_cmd = "docker inspect {} | grep EndpointID".format(container_id)
     _,stdout,stderr = ssh_client.exec_command(get_interface_cmd)
     lines = stdout.readlines()[1]
     interface_name = str(lines).split('\"')[3][:15]
+    with veth_cache_lock:
+        veth_cache[container_id] = interface_name
     return interface_name
+
+# Adds already discovered interfaces (container_id -> interface name) to the cache
+def seed_container_veths(container_to_veth):
+    with veth_cache_lock:
+        veth_cache.update(container_to_veth)
+
+# Forgets the cached interfaces (of all containers if None)
+# Must be called when containers are restarted
+def invalidate_container_veths(container_ids=None):
+    with veth_cache_lock:
+        if container_ids is None:
+            veth_cache.clear()
+        else:
+            for container_id in container_ids:
+                veth_cache.pop(container_id, None)
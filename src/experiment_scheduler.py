@@ -0,0 +1,86 @@
+import threading
+
+from contextlib import contextmanager
+from multiprocessing.dummy import Pool as ThreadPool
+
+'''
+Runs the stress experiments of independent MRs at the same time.
+
+Two experiments may run concurrently when they stress MRs of different
+applications and touch disjoint sets of VMs: the instances of the MR,
+the VMs of every service of the application measuring it, since the
+workload goes through all of them, plus the application's frontend and
+request generators. Every experiment holds the locks of all of its VMs while it runs, so
+two experiments never touch the same host even if the batches are wrong.
+'''
+
+# vm_ip -> lock held by the experiment currently using that VM
+vm_locks = {}
+vm_locks_lock = threading.Lock()
+
+def get_vm_lock(vm_ip):
+    with vm_locks_lock:
+        if vm_ip not in vm_locks:
+            vm_locks[vm_ip] = threading.Lock()
+        return vm_locks[vm_ip]
+
+# Holds the locks of all vm_ips, acquired in a fixed order to avoid deadlocks
+@contextmanager
+def lock_vms(vm_ips):
+    locks = [get_vm_lock(vm_ip) for vm_ip in sorted(set(vm_ips))]
+    for lock in locks:
+        lock.acquire()
+    try:
+        yield
+    finally:
+        for lock in reversed(locks):
+            lock.release()
+
+# Returns the VMs touched by stressing mr and measuring it with app_workload_config
+# app_vms are the VMs of the services of mr's application
+def get_experiment_vms(mr, app_workload_config, app_vms):
+    experiment_vms = set(vm_ip for vm_ip,_ in mr.instances)
+    experiment_vms.update(app_vms)
+    experiment_vms.update(app_workload_config['frontend'])
+    experiment_vms.update(app_workload_config['request_generator'])
+    return experiment_vms
+
+# Splits mr_list into batches of MRs that can be stressed at the same time
+# mr_to_app maps every MR to the application measuring it,
+# app_to_workload maps every application to its workload configuration,
+# app_to_vms maps every application to the VMs of its services
+# Within a batch, every MR belongs to a different application and no two MRs share a VM
+def schedule_concurrent_batches(mr_list, mr_to_app, app_to_workload, app_to_vms):
+    # [(VMs in use, applications in use, [MR])]
+    batches = []
+    for mr in mr_list:
+        app = mr_to_app[mr]
+        experiment_vms = get_experiment_vms(mr, app_to_workload[app], app_to_vms[app])
+        for batch_vms,batch_apps,batch_mrs in batches:
+            if app not in batch_apps and batch_vms.isdisjoint(experiment_vms):
+                batch_vms.update(experiment_vms)
+                batch_apps.add(app)
+                batch_mrs.append(mr)
+                break
+        else:
+            batches.append((set(experiment_vms), set([app]), [mr]))
+    return [batch_mrs for _,_,batch_mrs in batches]
+
+# Runs experiment_fn(mr) for every MR of a batch concurrently, each while holding its VM locks
+# Returns {mr -> result of experiment_fn}, raising the first exception if any experiment failed
+def run_concurrent_batch(batch, mr_to_app, app_to_workload, app_to_vms, experiment_fn):
+    def run_experiment(mr):
+        app = mr_to_app[mr]
+        with lock_vms(get_experiment_vms(mr, app_to_workload[app], app_to_vms[app])):
+            return experiment_fn(mr)
+
+    if len(batch) == 1:
+        return {batch[0]: run_experiment(batch[0])}
+
+    pool = ThreadPool(len(batch))
+    try:
+        results = pool.map(run_experiment, batch)
+    finally:
+        pool.close()
+        pool.join()
+    return dict(zip(batch, results))
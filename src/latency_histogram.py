@@ -0,0 +1,147 @@
+import math
+import struct
+
+'''
+HDR-style latency histogram with log-linear buckets.
+
+Values are recorded in microseconds. Each power-of-two range is split into
+SUB_BUCKET_HALF linear buckets, so any recorded value is reproduced within
+1 / SUB_BUCKET_HALF (about 1.6%) of its true value, with a number of
+buckets that grows only logarithmically with the largest latency.
+
+Kept compatible with both Python 2 and 3 because load_generator_py3.py
+ships it to the request generator.
+'''
+
+# Layout of encode(): version, count, total_us, min_us, max_us, number of buckets,
+# followed by one (bucket index, count) pair per non-empty bucket
+ENCODING_VERSION = 1
+HEADER_FORMAT = '<BQQQQH'
+BUCKET_FORMAT = '<HQ'
+
+SUB_BUCKET_BITS = 7
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+SUB_BUCKET_HALF = SUB_BUCKET_COUNT // 2
+
+def _bit_length(value):
+    return len(bin(value)) - 2
+
+def bucket_index(value_us):
+    value_us = max(int(value_us), 0)
+    if value_us < SUB_BUCKET_COUNT:
+        return value_us
+    shift = _bit_length(value_us) - SUB_BUCKET_BITS
+    return shift * SUB_BUCKET_HALF + (value_us >> shift)
+
+# Smallest value (in microseconds) that falls into bucket index
+def bucket_lower_bound(index):
+    if index < SUB_BUCKET_COUNT:
+        return index
+    shift = index // SUB_BUCKET_HALF - 1
+    return (index - shift * SUB_BUCKET_HALF) << shift
+
+def bucket_upper_bound(index):
+    return bucket_lower_bound(index + 1) - 1
+
+class LatencyHistogram:
+    def __init__(self):
+        # bucket index -> number of values
+        self.counts = {}
+        self.count = 0
+        self.total_us = 0
+        self.min_us = None
+        self.max_us = None
+
+    def record(self, latency_ms, count=1):
+        value_us = max(int(round(latency_ms * 1000.0)), 0)
+        index = bucket_index(value_us)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.count += count
+        self.total_us += value_us * count
+        if self.min_us is None or value_us < self.min_us:
+            self.min_us = value_us
+        if self.max_us is None or value_us > self.max_us:
+            self.max_us = value_us
+
+    # Adds all values of other into this histogram
+    def merge(self, other):
+        for index in other.counts:
+            self.counts[index] = self.counts.get(index, 0) + other.counts[index]
+        self.count += other.count
+        self.total_us += other.total_us
+        if other.min_us is not None and (self.min_us is None or other.min_us < self.min_us):
+            self.min_us = other.min_us
+        if other.max_us is not None and (self.max_us is None or other.max_us > self.max_us):
+            self.max_us = other.max_us
+        return self
+
+    # Latency in ms below which percent of the recorded values fall
+    def percentile(self, percent):
+        if self.count == 0:
+            return 0.0
+        # Nearest-rank definition
+        target = max(1, int(math.ceil(percent * self.count / 100.0 - 1e-9)))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                value_us = (bucket_lower_bound(index) + bucket_upper_bound(index)) / 2.0
+                value_us = min(max(value_us, self.min_us), self.max_us)
+                return value_us / 1000.0
+        return self.max_us / 1000.0
+
+    def mean(self):
+        if self.count == 0:
+            return 0.0
+        return self.total_us / 1000.0 / self.count
+
+    def to_dict(self):
+        return {'counts': sorted([index, self.counts[index]] for index in self.counts),
+                'count': self.count,
+                'total_us': self.total_us,
+                'min_us': self.min_us,
+                'max_us': self.max_us}
+
+    @classmethod
+    def from_dict(cls, histogram_dict):
+        histogram = cls()
+        for index, count in histogram_dict['counts']:
+            histogram.counts[int(index)] = int(count)
+        histogram.count = int(histogram_dict['count'])
+        histogram.total_us = int(histogram_dict['total_us'])
+        histogram.min_us = histogram_dict['min_us']
+        histogram.max_us = histogram_dict['max_us']
+        return histogram
+
+    # Compact binary form, bounded by the number of buckets rather than the number of values
+    def encode(self):
+        header = struct.pack(HEADER_FORMAT, ENCODING_VERSION, self.count, self.total_us,
+                             self.min_us or 0, self.max_us or 0, len(self.counts))
+        buckets = [struct.pack(BUCKET_FORMAT, index, self.counts[index]) for index in sorted(self.counts)]
+        return header + b''.join(buckets)
+
+    @classmethod
+    def decode(cls, data):
+        header_size = struct.calcsize(HEADER_FORMAT)
+        bucket_size = struct.calcsize(BUCKET_FORMAT)
+        version, count, total_us, min_us, max_us, num_buckets = struct.unpack(HEADER_FORMAT, data[:header_size])
+        if version != ENCODING_VERSION:
+            raise ValueError('Unknown histogram encoding version {}'.format(version))
+        histogram = cls()
+        for bucket in range(num_buckets):
+            offset = header_size + bucket * bucket_size
+            index, bucket_count = struct.unpack(BUCKET_FORMAT, data[offset:offset + bucket_size])
+            histogram.counts[index] = bucket_count
+        histogram.count = count
+        histogram.total_us = total_us
+        if count > 0:
+            histogram.min_us = min_us
+            histogram.max_us = max_us
+        return histogram
+
+# Returns a new histogram holding the values of all the given histograms
+def merge_histograms(histograms):
+    merged = LatencyHistogram()
+    for histogram in histograms:
+        merged.merge(histogram)
+    return merged
@@ -0,0 +1,186 @@
+import argparse
+import asyncio
+import json
+import sys
+import time
+from urllib.parse import urlsplit
+
+from latency_histogram import LatencyHistogram
+
+'''
+Open-loop HTTP load generator, meant to run on the request_generator host
+with Python 3 (it is uploaded together with latency_histogram.py).
+
+Requests are issued at a constant rate regardless of how fast responses
+come back. Latency is measured from the time a request was scheduled to
+be sent, not from when a connection became free, so queueing behind slow
+responses is counted (no coordinated omission). Connections are HTTP/1.1
+keep-alive and drawn from a bounded pool. A connection is only reused if
+the server kept it open, and a request whose reused connection turns out
+to be closed is retried once on a fresh connection.
+
+Prints a JSON summary containing an HDR-style latency histogram to stdout.
+'''
+
+# The server closed a kept-alive connection before answering, so the request may be resent
+class StaleConnectionError(ConnectionError):
+    pass
+
+class HTTPConnection:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def ensure_open(self):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader, self.writer = None, None
+
+    # Sends raw_request, retrying once on a fresh connection if a reused one was closed by the server
+    async def request(self, raw_request):
+        try:
+            return await self.send(raw_request)
+        except StaleConnectionError:
+            self.close()
+            return await self.send(raw_request)
+
+    async def send(self, raw_request):
+        reused = self.writer is not None
+        await self.ensure_open()
+        try:
+            self.writer.write(raw_request)
+            await self.writer.drain()
+            status_line = await self.reader.readline()
+        except (ConnectionError, OSError) as e:
+            self.close()
+            if reused:
+                raise StaleConnectionError(str(e))
+            raise
+        if not status_line:
+            self.close()
+            if reused:
+                raise StaleConnectionError('Connection closed by server')
+            raise ConnectionError('Connection closed by server')
+        version, status = status_line.split()[:2]
+        status = int(status)
+
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                chunk_size = int((await self.reader.readline()).split(b';')[0], 16)
+                await self.reader.readexactly(chunk_size + 2)
+                if chunk_size == 0:
+                    break
+        elif 'content-length' in headers:
+            await self.reader.readexactly(int(headers['content-length']))
+        else:
+            await self.reader.read()
+            self.close()
+
+        # HTTP/1.0 connections close after the response unless the server asks to keep them
+        connection = headers.get('connection', '').lower()
+        if connection == 'close' or (version == b'HTTP/1.0' and connection != 'keep-alive'):
+            self.close()
+        return status
+
+def build_request(method, url, body, headers):
+    parts = urlsplit(url)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    lines = ['{} {} HTTP/1.1'.format(method, path),
+             'Host: {}'.format(parts.netloc),
+             'Connection: keep-alive']
+    lines += headers
+    if body:
+        lines.append('Content-Length: {}'.format(len(body)))
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+async def run_load(url, rate, duration, connections, method, body, headers, timeout, warmup):
+    parts = urlsplit(url)
+    port = parts.port or 80
+    raw_request = build_request(method, url, body, headers)
+
+    pool = asyncio.Queue()
+    for _ in range(connections):
+        pool.put_nowait(HTTPConnection(parts.hostname, port))
+
+    histogram = LatencyHistogram()
+    summary = {'sent': 0, 'completed': 0, 'errors': 0, 'non_2xx': 0}
+
+    async def send_one(intended_time, measured):
+        connection = await pool.get()
+        try:
+            status = await asyncio.wait_for(connection.request(raw_request), timeout)
+            latency_ms = (time.monotonic() - intended_time) * 1000.0
+            if measured:
+                histogram.record(latency_ms)
+                summary['completed'] += 1
+                if status < 200 or status >= 300:
+                    summary['non_2xx'] += 1
+        except Exception:
+            connection.close()
+            if measured:
+                summary['errors'] += 1
+        finally:
+            pool.put_nowait(connection)
+
+    interval = 1.0 / rate
+    total_requests = int((warmup + duration) * rate)
+    warmup_requests = int(warmup * rate)
+    start_time = time.monotonic()
+    tasks = []
+    for request_number in range(total_requests):
+        intended_time = start_time + request_number * interval
+        delay = intended_time - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        measured = request_number >= warmup_requests
+        if measured:
+            summary['sent'] += 1
+        tasks.append(asyncio.ensure_future(send_one(intended_time, measured)))
+    await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - start_time - warmup
+
+    while not pool.empty():
+        pool.get_nowait().close()
+
+    summary['duration'] = elapsed
+    summary['achieved_rps'] = summary['completed'] / elapsed if elapsed > 0 else 0
+    summary['histogram'] = histogram.to_dict()
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("url", help="Target URL, e.g. http://10.0.0.1/api/todos")
+    parser.add_argument("--rate", type=float, default=100, help="Requests per second to issue")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of measured load")
+    parser.add_argument("--warmup", type=float, default=1, help="Seconds of unmeasured load before measuring")
+    parser.add_argument("--connections", type=int, default=32, help="Size of the keep-alive connection pool")
+    parser.add_argument("--method", default='GET')
+    parser.add_argument("--body_file", help="File whose contents are sent as the request body")
+    parser.add_argument("--header", action='append', default=[], help="Extra header, e.g. 'Content-Type: application/json'")
+    parser.add_argument("--timeout", type=float, default=30, help="Seconds before a request counts as an error")
+    args = parser.parse_args()
+
+    body = b''
+    if args.body_file:
+        with open(args.body_file, 'rb') as f:
+            body = f.read()
+
+    summary = asyncio.run(run_load(args.url, args.rate, args.duration, args.connections,
+                                   args.method, body, args.header, args.timeout, args.warmup))
+    json.dump(summary, sys.stdout)
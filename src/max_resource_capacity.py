@@ -2,21 +2,14 @@
 from weighting_conversions import *
 from remote_execution import *
 from container_information import *
+import redis_resource as resource_datastore
 
-def get_container_network_capacity(ssh_client, container_id):
-    # Get the max capacity of the interface
-    container_to_capacity = {}
-    cmd = 'cat /sys/class/net/{}/speed'.format(container_id)
-    _, stdout, _ = ssh_client.exec_command(cmd)
-
-    # This is tricky! It will vary by machine. Ignoring the prior command because its a theoretical guarantee and usage will depend on whether it is happening on the cloud or not
-    # http://stackoverflow.com/questions/18507405/ec2-instance-typess-exact-network-performance
-    # Units here are Megabits/sec
-    # TODO: Currently using m4.large
-    max_capacity = 566
-    container_to_capacity[container_id] = float(max_capacity)
-
-    return container_to_capacity
+# Returns the network capacity of vm_ip in bits/sec, as calibrated by Throttlebot (see cluster_calibration.py)
+def get_machine_network_capacity(redis_db, vm_ip):
+    machine_cap = resource_datastore.read_machine_capacity(redis_db, vm_ip)
+    if 'NET' not in machine_cap:
+        raise ValueError('No calibrated network capacity for {}'.format(vm_ip))
+    return machine_cap['NET']
 
 def get_num_cores(ssh_client):
     num_cores_cmd = 'nproc --all'
@@ -32,14 +25,9 @@ def get_cpu_capabilities(ssh_client):
     clock_speed_hertz = float(stdout.read()) * 1000000 #Converting from MHz to Hz
     return clock_speed_hertz
 
-#Returns bandwidth in bytes/sec
-def get_network_capabilities(ssh_client, container_id, stress_level):
-    #hardcoding because we're pressed on time!
-    container_to_capacity = get_container_network_capacity(ssh_client, container_id)
-    container_to_network_bandwidth = weighting_to_bandwidth(ssh_client, stress_level, container_to_capacity)
-    #Convert from MB/sec
-    container_to_network_bandwidth.update((container, bandwidth*1000000) for container, bandwidth in container_to_network_bandwidth.items())
-    return container_to_network_bandwidth
+# Returns the bandwidth in bits/sec that a container of vm_ip gets at stress_level
+def get_network_capabilities(redis_db, vm_ip, stress_level):
+    return weighting_to_net_bandwidth(stress_level, get_machine_network_capacity(redis_db, vm_ip))
 
 def get_disk_capabilities(ssh_client, stress_level):
     return weighting_to_disk_access_rate(stress_level)
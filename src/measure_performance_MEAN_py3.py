@@ -9,10 +9,11 @@ import datetime
 import numpy
 import time
 import subprocess
-import paramiko
 import csv
 from multiprocessing.dummy import Pool as ThreadPool
 
+from remote_execution import get_client, ssh_exec
+
 REST_URL = '/api/todos'
 
 REMOTE_POST_SCRIPT = "remote_make_post.py"
@@ -43,18 +44,6 @@ def POST_to_website(website_ip, num_iterations, num_threads=4, remote=False, ssh
         all_request_times = pool.map(make_single_POST, requests)
     return all_request_times
 
-def ssh_exec(ssh_client, cmd):
-    _, _, stderr = ssh_client.exec_command(cmd)
-    err = stderr.read()
-    if err:
-        print ("Error execing {}: {}".format(cmd, err))
-
-def get_client(ip):
-    client = paramiko.SSHClient()
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    client.connect(ip, username="quilt", password="")
-    return client
-
 def make_single_POST(website_ip):
     url = 'http://' + website_ip + REST_URL
     current_date = datetime.datetime.now()
@@ -2,20 +2,29 @@
 import paramiko
 from remote_execution import *
 from container_information import *
+from utilization_sampler import read_vm_utilization
 
 # Gets all resource utilizations for JUST the container in the machine specified in ssh_client
-# Perhaps we need to collect the information for the other machines also?
+# All counters are read in a single remote invocation (see utilization_sampler.py),
+# which samples them continuously when sample_utilization is set
 # Keep track of the total amount of utilization for a resource at a certain point in time
 def get_all_throttled_utilizations(ssh_client, container_id):
+    # The network counters are found through the container's interface
+    get_container_veth(ssh_client, container_id)
+    container_utilization = read_vm_utilization(ssh_client).get(container_id, {})
     utilization_dict = {}
-    utilization_dict['cpu'] = get_throttled_cpu_amount(ssh_client, container_id)
-    utilization_dict['disk'] = get_disk_eater_utilization(ssh_client, container_id)
-    utilization_dict['network_outbound'], utilization_dict['network_inbound'] = get_network_utilization(ssh_client, container_id)
+    utilization_dict['cpu'] = container_utilization.get('cpu_throttled_ns', 0)
+    utilization_dict['disk'] = container_utilization.get('disk_bytes', 0)
+    utilization_dict['network_outbound'] = container_utilization.get('net_out_bytes', 0)
+    utilization_dict['network_inbound'] = container_utilization.get('net_in_bytes', 0)
     return utilization_dict
 
 
 #Get the throttled amount in nanoseconds
 def get_throttled_cpu_amount(ssh_client, container_id):
+    if is_agent_client(ssh_client):
+        stats = ssh_client.request_checked([{'op': 'read_cgroup_stats', 'container_id': container_id}])[0]
+        return stats['cpu_throttled_ns']
 
     throttle_file_cmd = 'cat /sys/fs/cgroup/cpu/docker/{}/cpu.stat | grep throttled_time | awk {{\'print $2\'}}'.format(container_id)
     _, throttle_time, _ = ssh_client.exec_command(throttle_file_cmd)
@@ -24,15 +33,15 @@ def get_throttled_cpu_amount(ssh_client, container_id):
 
     return total_throttle_time
 
-#Gets the inbound and outbound number of bytes sent from the container interface
+#Gets the outbound and inbound number of bytes of the container interface
+# The counters are read on the host side of the interface, where received bytes were sent by the container
 def get_network_utilization(ssh_client, container_id):
+    outbound_container_utilization = 0
+    inbound_container_utilization = 0
     network_file = '/proc/net/dev'
-    # Does this work? Exception will be caught in the event of no interface?
-    _,stdout,_ = ssh_client.exec_command('cat {} | grep {} | awk {{\'print $2, $10\'}}'.format(network_file, container_id))
-    try:
-            network_list = stdout.read().strip('\n').split(' ')
-    except:
-        pass
+    interface_name = get_container_veth(ssh_client, container_id)
+    _,stdout,_ = ssh_client.exec_command('cat {} | grep {}: | awk {{\'sub(":", " "); print $2, $10\'}}'.format(network_file, interface_name))
+    network_list = stdout.read().strip('\n').split(' ')
     if len(network_list) == 2:
         send_bytes = int(network_list[0])
         rcv_bytes = int(network_list[1])
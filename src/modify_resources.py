@@ -12,6 +12,9 @@ from remote_execution import *
 from measure_utilization import *
 from container_information import *
 from max_resource_capacity import *
+from cgroup_actuation import *
+from actuation_settle import *
+from cluster_inventory import get_inventory
 
 
 quilt_machines = ("quilt", "ps")
@@ -25,14 +28,16 @@ container_blacklist = ['ovn-controller', 'minion', 'ovs-vswitchd', 'ovsdb-server
 # Conversion factor from unit KEY to KiB
 CONVERSION = {"KiB": 1, "MiB": 2**10, "GiB": 2**20}
 
-# This is changed manually
-MAX_NETWORK_BANDWIDTH = 600
-
 '''Stressing the Network'''
 # Container_to_bandwidth maps Docker container id to the bandwidth that container should be throttled to.
 # Assumes that the container specified by container id is located in the machine for ssh_client
 # Bandwidth units: bps
 def set_egress_network_bandwidth(ssh_client, container_id, bandwidth):
+    if is_agent_client(ssh_client):
+        ssh_client.request_checked([{'op': 'set_net_bandwidth', 'container_id': container_id, 'kbps': int(bandwidth / (10 ** 3))}])
+        print 'SUCCESS: Network stress of container id {} stressed to {}'.format(container_id, bandwidth)
+        return 1
+
     interface_name = get_container_veth(ssh_client, container_id)
 
     # Execute the command within OVS
@@ -53,10 +58,16 @@ def set_egress_network_bandwidth(ssh_client, container_id, bandwidth):
         print 'ERROR MESSAGE: {}'.format(err_val_rate)
         raise SystemError('Network Set Error')
     else:
+        wait_for_settle('NET', lambda: read_ovs_policing_rate(ssh_client, interface_name), int(bandwidth_kbps))
         print 'SUCCESS: Network stress of container id {} stressed to {}'.format(container_id, bandwidth)
         return 1
 
 def reset_egress_network_bandwidth(ssh_client, container_id):
+    if is_agent_client(ssh_client):
+        ssh_client.request_checked([{'op': 'reset_net_bandwidth', 'container_id': container_id}])
+        print 'SUCCESS: Network stress of container id {} removed'.format(container_id)
+        return 1
+
     interface_name = get_container_veth(ssh_client, container_id)
 
     ovs_policy_cmd = 'ovs-vsctl set interface {} ingress_policing_rate={}'.format(interface_name, 0)
@@ -69,9 +80,19 @@ def reset_egress_network_bandwidth(ssh_client, container_id):
         print 'ERROR MESSAGE: {}'.format(err_val_rate)
         raise SystemError('Network Set Error')
     else:
+        wait_for_settle('NET', lambda: read_ovs_policing_rate(ssh_client, interface_name), 0)
         print 'SUCCESS: Network stress of container id {} removed'.format(container_id)
         return 1
 
+# Returns the policing rate (kbps, 0 if unlimited) currently set on an OVS interface
+def read_ovs_policing_rate(ssh_client, interface_name):
+    get_rate_cmd = 'docker exec ovs-vswitchd ovs-vsctl get interface {} ingress_policing_rate'.format(interface_name)
+    _, stdout, _ = ssh_client.exec_command(get_rate_cmd)
+    try:
+        return int(stdout.read().strip())
+    except ValueError:
+        return None
+
 # Unused
 # Removes all network manipulations for container_id (or ALL machines if specified) in the Quilt Environment
 def remove_all_network_manipulation(ssh_client, container_id, remove_all_machines=False):
@@ -105,20 +126,24 @@ def set_cpu_quota(ssh_client, container_id, cpu_period, cpu_quota_percent):
     print 'CPU Quota: {}'.format(cpu_quota)
 
     throttled_containers = []
-    
-    update_command = 'docker update --cpu-period={} --cpu-quota={} {}'.format(cpu_period, cpu_quota, container_id)
-    print update_command
-    ssh_exec(ssh_client, update_command)
+
+    if is_agent_client(ssh_client):
+        ssh_client.request_checked([{'op': 'set_cpu_quota', 'container_id': container_id, 'period': cpu_period, 'quota': cpu_quota}])
+        throttled_containers.append(container_id)
+        return throttled_containers
+
+    set_cpu_quota_batch(ssh_client, {container_id: cpu_quota}, cpu_period)
     throttled_containers.append(container_id)
 
     return throttled_containers
 
 def reset_cpu_quota(ssh_client, container_id):
-    # Reset only seems to work when both period and quota are high (and equal of course)
-    update_command = 'docker update --cpu-quota=-1 {}'.format(container_id)
+    if is_agent_client(ssh_client):
+        ssh_client.request_checked([{'op': 'reset_cpu_quota', 'container_id': container_id}])
+        return
+
     print 'reset_cpu_quota'
-    print update_command
-    ssh_exec(ssh_client, update_command)
+    set_cpu_quota_batch(ssh_client, {container_id: -1}, DEFAULT_CPU_PERIOD)
 
 
 # Pins the selected cores to the container (will reset any CPU quotas)
@@ -126,24 +151,59 @@ def reset_cpu_quota(ssh_client, container_id):
 def set_cpu_cores(ssh_client, container_id, cores):
     cores = int(cores) - 1
     core_cmd = '0-{}'.format(cores)
-    set_cores_cmd = 'docker update --cpuset-cpus={} --cpuset-mems=0 {}'.format(core_cmd, container_id)
-    ssh_exec(ssh_client, set_cores_cmd)
+    if is_agent_client(ssh_client):
+        ssh_client.request_checked([{'op': 'set_cpu_cores', 'container_id': container_id, 'cpus': core_cmd}])
+        print '{} Cores pinned to container {}'.format(core_cmd, container_id)
+        return
+    set_cpu_cores_batch(ssh_client, {container_id: core_cmd})
     print '{} Cores pinned to container {}'.format(core_cmd, container_id)
 
 
 # Resetting pinned cpu_cores (container will have access to all cores)
 def reset_cpu_cores(ssh_client, container_id):
+    if is_agent_client(ssh_client):
+        ssh_client.request_checked([{'op': 'reset_cpu_cores', 'container_id': container_id}])
+        print 'Reset container {}\'s core restraints'.format(container_id)
+        return
+
     cores = get_num_cores(ssh_client) - 1
     core_cmd = '0-{}'.format(cores)
-    rst_cores_cmd = 'docker update --cpuset-cpus={} --cpuset-mems=0 {}'.format(core_cmd, container_id)
-    ssh_exec(ssh_client, rst_cores_cmd)
+    set_cpu_cores_batch(ssh_client, {container_id: core_cmd})
     print 'Reset container {}\'s core restraints'.format(container_id)
 
+# Sets the same CPU quota percentage on several containers of one machine
+# in a single remote invocation
+def set_cpu_quota_containers(ssh_client, container_ids, cpu_period, cpu_quota_percent):
+    cpu_quota = int((cpu_quota_percent/100.0) * cpu_period)
+    if is_agent_client(ssh_client):
+        ssh_client.request_checked([{'op': 'set_cpu_quota', 'container_id': container_id, 'period': cpu_period, 'quota': cpu_quota}
+                                    for container_id in container_ids])
+        return
+    set_cpu_quota_batch(ssh_client, dict((container_id, cpu_quota) for container_id in container_ids), cpu_period)
+
+# Pins the same number of cores on several containers of one machine
+# in a single remote invocation
+def set_cpu_cores_containers(ssh_client, container_ids, cores):
+    core_cmd = '0-{}'.format(int(cores) - 1)
+    if is_agent_client(ssh_client):
+        ssh_client.request_checked([{'op': 'set_cpu_cores', 'container_id': container_id, 'cpus': core_cmd}
+                                    for container_id in container_ids])
+        return
+    set_cpu_cores_batch(ssh_client, dict((container_id, core_cmd) for container_id in container_ids))
+
 '''Stressing the Disk Read/write throughput'''
 # Positive value to set a maximum for both disk write and disk read
 # 0 to reset the value
 # Units are in MB/s
 def change_container_blkio(ssh_client, container_id, disk_bandwidth):
+    # Allocations read back from Redis are floats, but blkio only accepts whole bytes/sec
+    disk_bandwidth = int(disk_bandwidth)
+
+    # The agent writes the cgroup files synchronously
+    if is_agent_client(ssh_client):
+        ssh_client.request_checked([{'op': 'set_blkio', 'container_id': container_id, 'bps': disk_bandwidth}])
+        return
+
     # Set Read and Write Conditions in real-time using cgroups
     # Assumes the other containers default to write to device major number 252 (minor number arbitrary)
     # Check for 202 or 252 for major device number
@@ -156,8 +216,41 @@ def change_container_blkio(ssh_client, container_id, disk_bandwidth):
     ssh_exec(ssh_client, set_cgroup_write_rate_cmd)
     ssh_exec(ssh_client, set_cgroup_read_rate_cmd)
 
-    # Sleep 1 seconds since the current queue must be emptied before this can be fulfilled
-    sleep(1)
+    # Wait until both limits are visible in the cgroup instead of sleeping for a fixed time
+    wait_for_settle('DISK', lambda: read_blkio_limits(ssh_client, container_id), (disk_bandwidth, disk_bandwidth))
+
+# Returns the (read, write) bps limits of device 202:0 for a container, 0 if unlimited
+def read_blkio_limits(ssh_client, container_id):
+    read_limits_cmd = 'for f in read write; do echo $f $(grep \'^202:0 \' /sys/fs/cgroup/blkio/docker/{}*/blkio.throttle.${{f}}_bps_device | cut -d \' \' -f2); done'.format(container_id)
+    _, stdout, _ = ssh_client.exec_command(read_limits_cmd)
+    limits = {'read': 0, 'write': 0}
+    for line in stdout.read().splitlines():
+        fields = line.split()
+        if len(fields) == 2 and fields[0] in limits:
+            limits[fields[0]] = int(fields[1])
+    return (limits['read'], limits['write'])
+
+# Returns the containers among container_ids (on the VM of ssh_client) whose current limit
+# of resource is already the one that provisioning them to allocation would set
+# Allocations are in the units of set_mr_provision
+def get_containers_provisioned_to(ssh_client, resource, container_ids, allocation):
+    if resource in ['CPU-CORE', 'CPU-QUOTA']:
+        cpu_limits = read_cpu_limits_batch(ssh_client, container_ids)
+        if resource == 'CPU-CORE':
+            expected_cores = parse_cpuset('0-{}'.format(int(allocation) - 1))
+            return [container_id for container_id in container_ids
+                    if container_id in cpu_limits and cpu_limits[container_id][1] == expected_cores]
+        # Quotas are always set with a period of 1 second
+        expected_quota = int((allocation/100.0) * 1000000)
+        return [container_id for container_id in container_ids
+                if container_id in cpu_limits and cpu_limits[container_id][0] == expected_quota]
+    elif resource == 'DISK':
+        return [container_id for container_id in container_ids
+                if read_blkio_limits(ssh_client, container_id) == (int(allocation), int(allocation))]
+    elif resource == 'NET':
+        return [container_id for container_id in container_ids
+                if read_ovs_policing_rate(ssh_client, get_container_veth(ssh_client, container_id)) == int(allocation / (10 ** 3))]
+    return []
 
 '''Helper functions that are used for various reasons'''
 
@@ -195,15 +288,7 @@ def check_valid_ip(vm_ip):
         sys.exit("There is no VM with public IP {}".format(vm_ip))
 
 def get_all_machines():
-    all_machines = []
-    p = Popen(quilt_machines, stdout=PIPE)
-    lines = p.stdout.read().splitlines()
-    for line in lines:
-        m  = re.search(ip_pattern, line)
-        if m:
-            m = m.group(0)
-            all_machines.append(m)
-    return set(all_machines)
+    return set(get_inventory().get_vms())
 
 # LEGACY
 def initialize_machine(ssh_client):
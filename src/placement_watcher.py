@@ -0,0 +1,173 @@
+import json
+import threading
+
+import remote_execution as remote_exec
+import redis_client as tbot_datastore
+import allocation_cache
+import cgroup_actuation
+import container_information
+import cluster_inventory
+
+'''
+Keeps the service locations in Redis up to date as containers stop and start.
+
+Every VM's Docker event log is read incrementally: each poll asks the VM for
+the container events since the previous poll, using the VM's own clock, so
+no event is lost between polls and no full rescan of the cluster is needed.
+A container of a managed service that dies is removed from its service's
+locations, and a container that starts is added. Either way, the cached
+veth, cgroup paths and applied allocations of the container are invalidated,
+as are the containers of its VM in the cluster inventory.
+
+Events are applied when sync() is called, which run_throttlebot does before
+it picks MRs and before every experiment, so actuation never uses a location
+that was already known to be dead. The first sync only records where the
+event logs start; reconcile() then compares one full discovery of the VMs
+with the service locations, catching up on what changed before that.
+'''
+
+CONTAINER_EVENTS = ['start', 'die', 'destroy']
+
+# The VM prints the container events since {since}, one JSON object per line,
+# followed by the time up to which events were read
+EVENTS_CMD = ('now=$(date +%s.%N); docker events --since {since} --until $now --filter type=container ' +
+              ' '.join('--filter event={}'.format(event) for event in CONTAINER_EVENTS) +
+              ' --format \'{{{{json .}}}}\'; echo "until|$now"')
+
+UNTIL_PREFIX = 'until|'
+
+# Container IDs are kept in their short form, as shown by docker ps
+SHORT_ID_LENGTH = 12
+
+class DockerEventSource:
+    '''
+    Reads the Docker container events of one VM, remembering how far it has read
+    '''
+    def __init__(self, vm_ip):
+        self.vm_ip = vm_ip
+        # VM time (seconds since the epoch) up to which events were read, None before the first poll
+        self.since = None
+
+    # Returns the events since the previous poll, oldest first
+    # The first poll only records the current time of the VM
+    def poll(self):
+        since = '$now' if self.since is None else self.since
+        ssh_client = remote_exec.get_client(self.vm_ip)
+        _, stdout, _ = ssh_client.exec_command(EVENTS_CMD.format(since=since))
+        events = []
+        for line in stdout.read().splitlines():
+            line = line.strip()
+            if line.startswith(UNTIL_PREFIX):
+                self.since = line[len(UNTIL_PREFIX):]
+            elif line.startswith('{'):
+                events.append(json.loads(line))
+        return sorted(events, key=lambda event: event.get('timeNano', 0))
+
+class PlacementWatcher:
+    '''
+    Applies the container events of vm_ips to the service locations in redis_db.
+    on_start(service, location) and on_stop(service, location) are called after a
+    location of a managed service was added or removed.
+    '''
+    def __init__(self, redis_db, vm_ips, on_start=None, on_stop=None, event_source=DockerEventSource):
+        self.redis_db = redis_db
+        self.sources = dict((vm_ip, event_source(vm_ip)) for vm_ip in vm_ips)
+        self.on_start = on_start
+        self.on_stop = on_stop
+        self.lock = threading.Lock()
+        self.stats = {'polls': 0, 'events': 0, 'added': 0, 'removed': 0}
+
+    # Polls every VM concurrently and applies their events
+    # A VM whose poll fails is polled again from the same point on the next sync
+    # Returns the number of events applied
+    def sync(self):
+        with self.lock:
+            vm_to_events = {}
+            results_lock = threading.Lock()
+            def poll_task(vm_ip, task):
+                events = self.sources[vm_ip].poll()
+                with results_lock:
+                    vm_to_events[vm_ip] = events
+
+            task_errors = remote_exec.execute_per_host(dict((vm_ip, [None]) for vm_ip in self.sources), poll_task)
+            for vm_ip,_ in task_errors:
+                print 'WARNING: Reading the container events of {} failed: {}'.format(vm_ip, task_errors[(vm_ip, None)])
+
+            self.stats['polls'] += 1
+            num_events = 0
+            for vm_ip in vm_to_events:
+                for event in vm_to_events[vm_ip]:
+                    self.apply_event(vm_ip, event)
+                    num_events += 1
+            return num_events
+
+    # Compares the containers found on every VM with the service locations in redis_db,
+    # adding and removing locations as their events would have
+    # Should follow the first sync, so that later changes are read from the event logs
+    # Returns the number of locations added or removed
+    def reconcile(self):
+        with self.lock:
+            vm_ips = list(self.sources)
+            cluster_inventory.invalidate_inventory(vm_ips)
+            vm_to_containers = cluster_inventory.get_inventory().get_vm_to_containers(vm_ips)
+            num_changes = 0
+            for service in tbot_datastore.read_services(self.redis_db):
+                found = set((vm_ip, container['id']) for vm_ip in vm_ips
+                            for container in vm_to_containers[vm_ip] if container['image'] == service)
+                stored = set(tbot_datastore.get_service_locations(self.redis_db, service))
+                for location in sorted(found - stored):
+                    self.invalidate_container(location)
+                    num_changes += self.add_location(service, location)
+                for location in sorted(stored - found):
+                    self.invalidate_container(location)
+                    num_changes += self.remove_location(service, location)
+            return num_changes
+
+    def apply_event(self, vm_ip, event):
+        action = event.get('Action', event.get('status'))
+        container_id = str(event['id'][:SHORT_ID_LENGTH])
+        location = (vm_ip, container_id)
+        self.stats['events'] += 1
+
+        # Whatever happened, what was cached about the container no longer holds
+        self.invalidate_container(location)
+        cluster_inventory.invalidate_inventory([vm_ip])
+
+        service = str(event.get('Actor', {}).get('Attributes', {}).get('image', event.get('from', '')))
+        if service not in tbot_datastore.read_services(self.redis_db):
+            return
+
+        if action == 'start':
+            self.add_location(service, location)
+        elif action in ['die', 'destroy']:
+            self.remove_location(service, location)
+
+    def invalidate_container(self, location):
+        _,container_id = location
+        container_information.invalidate_container_veths([container_id])
+        cgroup_actuation.invalidate_cgroup_paths([container_id])
+        allocation_cache.invalidate_applied_allocations([location])
+
+    # Both return 1 if the locations of service changed, 0 if they already were up to date
+    def add_location(self, service, location):
+        if location in tbot_datastore.get_service_locations(self.redis_db, service):
+            return 0
+        print 'Container {} of {} started on {}'.format(location[1], service, location[0])
+        tbot_datastore.write_service_locations(self.redis_db, service, [location])
+        self.stats['added'] += 1
+        if self.on_start is not None:
+            self.on_start(service, location)
+        return 1
+
+    def remove_location(self, service, location):
+        if not tbot_datastore.remove_service_location(self.redis_db, service, location):
+            return 0
+        print 'Container {} of {} stopped on {}'.format(location[1], service, location[0])
+        self.stats['removed'] += 1
+        if self.on_stop is not None:
+            self.on_stop(service, location)
+        return 1
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
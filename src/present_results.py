@@ -7,6 +7,7 @@ import datetime
 import os
 
 from remote_execution import *
+from result_encoding import encode_values_text, decode_values_text
 from matplotlib.backends.backend_pdf import PdfPages
 
 def read_from_file(data_file, resume_boolean):
@@ -21,7 +22,7 @@ def read_from_file(data_file, resume_boolean):
             metric = row['metric']
             stress_level = row['increment']
             resource = row['resource']
-            results = row['data_points']
+            results = decode_values_text(row['data_points'])
 
             if service not in cpu:
                 cpu[service] = {}
@@ -37,14 +38,12 @@ def read_from_file(data_file, resume_boolean):
                     disk[service][stress_level] = {}
                     network[service][stress_level] = {}
 
-                int_list_results = [float(numb) for numb in results[1:-1].split(',')]
-
                 if resource == 'cpu':
-                    cpu[service][stress_level][metric] = int_list_results
+                    cpu[service][stress_level][metric] = results
                 elif resource == 'disk':
-                    disk[service][stress_level][metric] = int_list_results
+                    disk[service][stress_level][metric] = results
                 elif resource == 'network':
-                    network[service][stress_level][metric] = int_list_results
+                    network[service][stress_level][metric] = results
             else:
                 if metric not in cpu[service]:
                     cpu[service][metric] = {}
@@ -147,19 +146,19 @@ def append_results_to_file(cpu, disk, network, resources, increments, experiment
                         writer.writerow({'service': service, 'metric': metric,
                                          'increment': increment_key, 'resource': 'cpu',
                                          'mean': numpy.mean(results_cpu), 'stddev': numpy.std(results_cpu),
-                                         'data_points': results_cpu})
+                                         'data_points': encode_values_text(results_cpu)})
                     if 'DISK' in resources:
                         results_disk = disk[service][increment_key][metric]
                         writer.writerow({'service': service, 'metric': metric,
                                          'increment': increment_key, 'resource': 'disk',
                                          'mean': numpy.mean(results_disk), 'stddev': numpy.std(results_disk),
-                                         'data_points': results_disk})
+                                         'data_points': encode_values_text(results_disk)})
                     if 'NET' in resources:
                         results_network = network[service][increment_key][metric]
                         writer.writerow({'service': service, 'metric': metric,
                                          'increment': increment_key, 'resource': 'network',
                                          'mean': numpy.mean(results_network), 'stddev': numpy.std(results_network),
-                                         'data_points': results_network})
+                                         'data_points': encode_values_text(results_network)})
 
     return OUTPUT_DIRECTORY + output_file_name
 
@@ -195,17 +194,17 @@ def plot_results(data_file, resources, experiment_type, iterations, should_save,
                 box_array_network = []
                 axis_labels = []
 
-                baseline_results = numpy.mean(ast.literal_eval(data[metric]['0']))
+                baseline_results = numpy.mean(data[metric]['0'])
                 print 'baseline results is {}'.format(baseline_results)
 
                 for increment_key in sorted(data[metric].iterkeys()):
                     # Iterate through different metrics
                     if 'CPU' in resources:
-                        results_cpu = ast.literal_eval(cpu[service][container][metric][increment_key])
+                        results_cpu = cpu[service][container][metric][increment_key]
                     if 'DISK' in resources:
-                        results_disk = ast.literal_eval(disk[service][container][metric][increment_key])
+                        results_disk = disk[service][container][metric][increment_key]
                     if 'NET' in resources:
-                        results_network = ast.literal_eval(network[service][container][metric][increment_key])
+                        results_network = network[service][container][metric][increment_key]
 
                     # results_cpu = [result - baseline_results for result in results_cpu]
                     # results_disk = [result - baseline_results for result in results_disk]
@@ -1,6 +1,10 @@
+import json
+import threading
 import redis.client
 
 from mr import MR
+from latency_histogram import LatencyHistogram, merge_histograms
+from result_encoding import encode_values, encode_value, decode_values
 
 '''
 A Throttlebot abstraction over Redis that allows Throttlebot to write experiment results and make queries to the Throttle Data store
@@ -17,8 +21,7 @@ def generate_hash_key(experiment_iteration_count, mr, perf_metric):
 # Inverts the calculation done from generate_hash_key()
 def generate_mr_from_hashkey(redis_db, hashkey):
     _,service_name,resource,_ = hashkey.split(',')
-    deployments = read_service_locations(redis_db, service_name)
-    return MR(service_name, resource, deployments)
+    return generate_mr(redis_db, service_name, resource)
     
 def generate_ordered_performance_key(experiment_iteration_count, perf_metric, stress_percent):
     return '{},{},{}'.format(experiment_iteration_count, perf_metric, stress_percent)
@@ -30,21 +33,66 @@ def write_redis_results(redis_db, mr, increment_to_result, experiment_iteration_
     print 'Writing Results to Redis'
     print 'HashName: {}'.format(hash_name)
 
+    # All stress weights are written in a single transaction
+    pipe = redis_db.pipeline()
+    # Positions of the result hsets among the replies of the pipeline
+    result_positions = []
     for stress_weight in increment_to_result:
         experiment_results = increment_to_result[stress_weight][perf_metric]
-        new_value_created = redis_db.hset(hash_name, stress_weight, experiment_results)
+        result_positions.append(len(pipe))
+        pipe.hset(hash_name, stress_weight, encode_values(experiment_results))
 
-        # This function should never be overwriting a previous value
-        if new_value_created == 1:
-            continue
-        else:
-            print 'WARNING: Throttlebot should not be overwriting an old value'
+        # All trials are kept as one merged histogram, whose size does not grow with the number of requests
+        histograms = [histogram for histogram in increment_to_result[stress_weight].get('histograms', []) if histogram is not None]
+        if len(histograms) > 0:
+            pipe.hset(generate_histogram_key(hash_name), stress_weight, merge_histograms(histograms).encode())
 
-# Returns a dict of all the experiment results for a certain MR
+    replies = pipe.execute()
+    new_values_created = [replies[position] for position in result_positions]
+
+    # This function should never be overwriting a previous value
+    if 0 in new_values_created:
+        print 'WARNING: Throttlebot should not be overwriting an old value'
+
+def generate_histogram_key(result_hash_name):
+    return '{},histogram'.format(result_hash_name)
+
+# Returns a dict of stress weight -> LatencyHistogram merged over all trials for a certain MR
+# Empty if the workload does not report histograms
+def read_redis_histograms(redis_db, experiment_iteration_count, mr, perf_metric):
+    hash_name = generate_histogram_key(generate_hash_key(experiment_iteration_count, mr, perf_metric))
+    encoded_histograms = redis_db.hgetall(hash_name)
+    return dict((stress_weight, LatencyHistogram.decode(encoded_histograms[stress_weight])) for stress_weight in encoded_histograms)
+
+# Returns a dict of stress weight -> list of experiment results for a certain MR
 def read_redis_result(redis_db, experiment_iteration_count, mr, perf_metric):
     print 'Reading results from Redis'
     hash_name = generate_hash_key(experiment_iteration_count, mr, perf_metric)
-    return redis_db.hgetall(hash_name)
+    encoded_results = redis_db.hgetall(hash_name)
+    return dict((stress_weight, decode_values(encoded_results[stress_weight])) for stress_weight in encoded_results)
+
+# Records how many trials the experiment of an MR at stress_weight needed (see adaptive_trials)
+def write_trial_count(redis_db, experiment_iteration_count, mr, perf_metric, stress_weight, num_trials):
+    hash_name = '{},trials'.format(generate_hash_key(experiment_iteration_count, mr, perf_metric))
+    redis_db.hset(hash_name, stress_weight, num_trials)
+
+# Returns a dict of stress weight -> number of trials run for a certain MR
+def read_trial_counts(redis_db, experiment_iteration_count, mr, perf_metric):
+    hash_name = '{},trials'.format(generate_hash_key(experiment_iteration_count, mr, perf_metric))
+    trial_counts = redis_db.hgetall(hash_name)
+    return dict((stress_weight, int(trial_counts[stress_weight])) for stress_weight in trial_counts)
+
+# Records the resources the instances of mr consumed during its experiment at stress_weight
+# utilization maps a counter (see utilization_sampler.FIELDS) to the amount consumed
+def write_experiment_utilization(redis_db, experiment_iteration_count, mr, perf_metric, stress_weight, utilization):
+    hash_name = '{},utilization,{}'.format(generate_hash_key(experiment_iteration_count, mr, perf_metric), stress_weight)
+    redis_db.hmset(hash_name, utilization)
+
+# Returns the utilization written by write_experiment_utilization, empty if none was
+def read_experiment_utilization(redis_db, experiment_iteration_count, mr, perf_metric, stress_weight):
+    hash_name = '{},utilization,{}'.format(generate_hash_key(experiment_iteration_count, mr, perf_metric), stress_weight)
+    utilization = redis_db.hgetall(hash_name)
+    return dict((field, float(utilization[field])) for field in utilization)
 
 # Writes scored result of the experiment to Redis
 # Maps the ordered performance times to the correct MR experiment
@@ -56,6 +104,31 @@ def write_redis_ranking(redis_db, experiment_iteration_count, perf_metric, mean_
     mr_key = generate_hash_key(experiment_iteration_count, mr, perf_metric)
     redis_db.zadd(sorted_set_name, mean_result, mr_key)
 
+def generate_group_key(experiment_iteration_count, mr_group, perf_metric):
+    return ';'.join(generate_hash_key(experiment_iteration_count, mr, perf_metric) for mr in mr_group)
+
+# Records the resources the instances of a group of MRs consumed while stressed together (GROUP stress policy)
+# A group of one MR is recorded as write_experiment_utilization would
+def write_group_utilization(redis_db, experiment_iteration_count, mr_group, perf_metric, stress_weight, utilization):
+    hash_name = '{},utilization,{}'.format(generate_group_key(experiment_iteration_count, mr_group, perf_metric), stress_weight)
+    redis_db.hmset(hash_name, utilization)
+
+# Writes the result of stressing a group of MRs together (GROUP stress policy)
+# Groups are ranked separately from single MRs, so get_top_n_mimr only returns single MRs
+def write_redis_group_ranking(redis_db, experiment_iteration_count, perf_metric, mean_result, mr_group, stress_weight):
+    sorted_set_name = '{},group'.format(generate_ordered_performance_key(experiment_iteration_count, perf_metric, stress_weight))
+    print 'Writing group of {} MRs to the Redis Ranking {}'.format(len(mr_group), sorted_set_name)
+    redis_db.zadd(sorted_set_name, mean_result, generate_group_key(experiment_iteration_count, mr_group, perf_metric))
+
+# Returns a list of ([MR], score) for all groups stressed in an iteration, ordered from lowest to highest score
+def read_redis_group_ranking(redis_db, experiment_iteration_count, perf_metric, stress_weight):
+    sorted_set_name = '{},group'.format(generate_ordered_performance_key(experiment_iteration_count, perf_metric, stress_weight))
+    group_score_list = []
+    for group_key,score in redis_db.zrange(sorted_set_name, 0, -1, withscores=True):
+        mr_group = [generate_mr_from_hashkey(redis_db, mr_hash) for mr_hash in group_key.split(';')]
+        group_score_list.append((mr_group, score))
+    return group_score_list
+
 # Redis sets are ordered from lowest score to the highest score
 # A metric where lower is better would have get_lowest parameter set to True
 def get_top_n_mimr(redis_db, experiment_iteration_count, perf_metric, stress_weight, optimize_for_lowest=True, num_results_returned=1):
@@ -81,23 +154,65 @@ def get_top_n_mimr(redis_db, experiment_iteration_count, perf_metric, stress_wei
 
     return mr_object_score_list
 
+'''
+Sensitivity of each MR to stressing, kept across iterations by the UCB stress policy.
+A sensitivity is the degradation of the performance metric caused by the largest
+stress weight, as a fraction of the baseline performance.
+'''
+
+def generate_sensitivity_key(mr):
+    return 'sensitivity,{},{}'.format(mr.service_name, mr.resource)
+
+def write_mr_sensitivity(redis_db, mr, sensitivity):
+    sensitivity_key = generate_sensitivity_key(mr)
+    pipe = redis_db.pipeline()
+    pipe.hincrby(sensitivity_key, 'count', 1)
+    pipe.hincrbyfloat(sensitivity_key, 'total', sensitivity)
+    pipe.hincrbyfloat(sensitivity_key, 'total_sq', sensitivity ** 2)
+    pipe.execute()
+
+# Returns a dict of MR -> (number of measurements, sum of sensitivities, sum of squared sensitivities)
+def read_mr_sensitivities(redis_db, mr_list):
+    mr_list = list(mr_list)
+    pipe = redis_db.pipeline(transaction=False)
+    for mr in mr_list:
+        pipe.hgetall(generate_sensitivity_key(mr))
+    mr_to_sensitivity = {}
+    for mr,stats in zip(mr_list, pipe.execute()):
+        mr_to_sensitivity[mr] = (int(stats.get('count', 0)), float(stats.get('total', 0)), float(stats.get('total_sq', 0)))
+    return mr_to_sensitivity
+
+# Forgets the sensitivity of an MR, e.g. after its allocation changed
+def reset_mr_sensitivity(redis_db, mr):
+    redis_db.delete(generate_sensitivity_key(mr))
+
 # After each iteration of Throttlebot, write a summary, essentially a record of what Throttlebot did
 # perf_gain should be the performance gain over the baseline
 # action_taken should be the amount of performance improvement given to the MIMR  in the form of +x, where x is a raw amount added to the MR
 # Currently assuming that there is only a single metric that a user would care about
 def write_summary_redis(redis_db, experiment_iteration_count, mimr, perf_gain, action_taken):
     hash_name = '{}summary'.format(experiment_iteration_count)
-    redis_db.hset(hash_name, 'mimr', mimr.to_string())
-    redis_db.hset(hash_name, 'perf_improvement', perf_gain)
-    redis_db.hset(hash_name, 'action_taken', action_taken)
+    redis_db.hmset(hash_name, {'mimr': mimr.to_string(),
+                               'perf_improvement': encode_value(perf_gain),
+                               'action_taken': encode_value(action_taken)})
     print 'Summary of Iteration {} written to redis'.format(experiment_iteration_count)
 
 def read_summary_redis(redis_db, experiment_iteration_count):
     hash_name = '{}summary'.format(experiment_iteration_count)
-    mimr = redis_db.hget(hash_name, 'mimr')
-    perf_improvement = redis_db.hget(hash_name, 'perf_improvement')
-    action_taken = redis_db.hget(hash_name, 'action_taken')
-    return mimr, action_taken, perf_improvement
+    mimr, perf_improvement, action_taken = redis_db.hmget(hash_name, ['mimr', 'perf_improvement', 'action_taken'])
+    return mimr, decode_values(action_taken), decode_values(perf_improvement)
+
+# Bulk counterpart of read_summary_redis: {iteration -> (mimr, action_taken, perf_improvement)}
+def read_summaries(redis_db, experiment_iteration_counts):
+    experiment_iteration_counts = list(experiment_iteration_counts)
+    pipe = redis_db.pipeline(transaction=False)
+    for experiment_iteration_count in experiment_iteration_counts:
+        pipe.hmget('{}summary'.format(experiment_iteration_count), ['mimr', 'perf_improvement', 'action_taken'])
+    iteration_to_summary = {}
+    for experiment_iteration_count,summary in zip(experiment_iteration_counts, pipe.execute()):
+        mimr, perf_improvement, action_taken = summary
+        iteration_to_summary[experiment_iteration_count] = (mimr, decode_values(action_taken), decode_values(perf_improvement))
+    return iteration_to_summary
 
 '''
 This index is a mapping of a particular service (which is assumed to be
@@ -109,15 +224,23 @@ service on it
 
 '''
 
+# Set of all services with locations in Redis
+SERVICES_KEY = 'services'
+
 # identifier_tuple is a list of tuples of (IP address, docker_container_id)
 # Note that we use the docker_container_id to distinguish it from the
 # Quilt container id, which is different
 def write_service_locations(redis_db, service, identifier_tuple):
     service_ip_key = '{}_ip'.format(service)
     service_docker_key = '{}_id'.format(service)
+    # Both lists are pushed in one transaction so that they always line up
+    pipe = redis_db.pipeline()
+    pipe.sadd(SERVICES_KEY, service)
     for location in identifier_tuple:
-        redis_db.lpush(service_ip_key, location[0])
-        redis_db.lpush(service_docker_key, location[1])
+        pipe.lpush(service_ip_key, location[0])
+        pipe.lpush(service_docker_key, location[1])
+    pipe.execute()
+    invalidate_placement_index([service])
 
 def read_service_locations(redis_db, service):
     service_ip_key = '{}_ip'.format(service)
@@ -126,3 +249,180 @@ def read_service_locations(redis_db, service):
     docker_list = redis_db.lrange(service_docker_key, 0, -1)
 
     return zip(ip_list, docker_list)
+
+# KEYS: the IP list and the docker id list of a service
+# ARGV: the IP address and docker_container_id of the location to remove
+# Removes the location from both lists at the same position, returns 1 if it was found
+REMOVE_LOCATION_SCRIPT = """
+local ip_list = redis.call('LRANGE', KEYS[1], 0, -1)
+local docker_list = redis.call('LRANGE', KEYS[2], 0, -1)
+for i = 1, #ip_list do
+    if ip_list[i] == ARGV[1] and docker_list[i] == ARGV[2] then
+        redis.call('LSET', KEYS[1], i - 1, '__removed__')
+        redis.call('LSET', KEYS[2], i - 1, '__removed__')
+        redis.call('LREM', KEYS[1], 1, '__removed__')
+        redis.call('LREM', KEYS[2], 1, '__removed__')
+        return 1
+    end
+end
+return 0
+"""
+
+# Removes one (IP address, docker_container_id) location of a service, keeping both lists aligned
+# Returns True if the location was found
+def remove_service_location(redis_db, service, location):
+    service_ip_key = '{}_ip'.format(service)
+    service_docker_key = '{}_id'.format(service)
+    removed = redis_db.eval(REMOVE_LOCATION_SCRIPT, 2, service_ip_key, service_docker_key, location[0], location[1])
+    invalidate_placement_index([service])
+    return removed == 1
+
+# Returns the set of services written with write_service_locations
+def read_services(redis_db):
+    return redis_db.smembers(SERVICES_KEY)
+
+# Bulk counterpart of read_service_locations for every service written with
+# write_service_locations: {service -> [(IP address, docker_container_id)]} in two round trips
+def read_all_service_locations(redis_db):
+    services = list(redis_db.smembers(SERVICES_KEY))
+    pipe = redis_db.pipeline(transaction=False)
+    for service in services:
+        pipe.lrange('{}_ip'.format(service), 0, -1)
+        pipe.lrange('{}_id'.format(service), 0, -1)
+    replies = pipe.execute()
+    service_to_locations = {}
+    for position,service in enumerate(services):
+        ip_list,docker_list = replies[2 * position], replies[2 * position + 1]
+        service_to_locations[service] = zip(ip_list, docker_list)
+    return service_to_locations
+
+'''
+In-process placement index of service -> [(IP address, docker_container_id)].
+MR objects are rebuilt from the index instead of reading the two location
+lists of their service from Redis each time. The index is loaded with one
+bulk read on first use and must be invalidated whenever service locations
+change behind this module's back (write_service_locations invalidates the
+services it writes, a flushed Redis needs invalidate_placement_index()).
+'''
+
+# service -> [(IP address, docker_container_id)], valid while placement_index_state['loaded']
+placement_index = {}
+placement_index_state = {'loaded': False}
+placement_index_lock = threading.Lock()
+
+def load_placement_index(redis_db):
+    service_to_locations = read_all_service_locations(redis_db)
+    with placement_index_lock:
+        placement_index.clear()
+        placement_index.update(service_to_locations)
+        placement_index_state['loaded'] = True
+
+# Returns the locations of service, loading the index if it is not loaded yet
+def get_service_locations(redis_db, service):
+    if not placement_index_state['loaded']:
+        load_placement_index(redis_db)
+    with placement_index_lock:
+        locations = placement_index.get(service)
+    if locations is None:
+        # Services written before the set of services was kept in Redis
+        locations = read_service_locations(redis_db, service)
+        with placement_index_lock:
+            placement_index[service] = locations
+    return list(locations)
+
+# Forgets the locations of the given services, or the whole index if None
+def invalidate_placement_index(services=None):
+    with placement_index_lock:
+        if services is None:
+            placement_index.clear()
+            placement_index_state['loaded'] = False
+            return
+        for service in services:
+            placement_index.pop(service, None)
+
+# Builds the MR of a service's resource with the service's current locations
+def generate_mr(redis_db, service_name, resource):
+    return MR(service_name, resource, get_service_locations(redis_db, service_name))
+
+'''
+Checkpoint of a run, so that run_throttlebot.py --resume can continue after a failure.
+Allocations, machine consumption, rankings and summaries are already in Redis;
+the checkpoint adds the loop state of run(): the iteration, the baselines, the MRs
+chosen for the iteration, the stress weights each MR has completed, and the MIMR
+once it has been improved.
+'''
+
+# Experiment results are stored as JSON, with histograms in their dict form
+def serialize_experiment_results(experiment_results):
+    serializable_results = dict(experiment_results)
+    if 'histograms' in serializable_results:
+        serializable_results['histograms'] = [histogram.to_dict() if histogram is not None else None
+                                              for histogram in serializable_results['histograms']]
+    return json.dumps(serializable_results)
+
+def deserialize_experiment_results(serialized_results):
+    experiment_results = json.loads(serialized_results)
+    if 'histograms' in experiment_results:
+        experiment_results['histograms'] = [LatencyHistogram.from_dict(histogram) if histogram is not None else None
+                                            for histogram in experiment_results['histograms']]
+    return experiment_results
+
+# baselines maps a name (an application, or '' without applications) to its baseline results
+def write_iteration_checkpoint(redis_db, experiment_iteration_count, baselines):
+    serialized_baselines = dict((name, serialize_experiment_results(baselines[name])) for name in baselines)
+    redis_db.hmset('checkpoint', {'experiment_count': experiment_iteration_count,
+                                  'baselines': json.dumps(serialized_baselines)})
+
+# Returns (iteration, baselines) of the last checkpoint, or (None, None) if there is none
+def read_iteration_checkpoint(redis_db):
+    checkpoint = redis_db.hgetall('checkpoint')
+    if 'experiment_count' not in checkpoint:
+        return None, None
+    serialized_baselines = json.loads(checkpoint['baselines'])
+    baselines = dict((name, deserialize_experiment_results(serialized_baselines[name])) for name in serialized_baselines)
+    return int(checkpoint['experiment_count']), baselines
+
+# Records the MRs chosen to be stressed in an iteration
+def write_stress_plan(redis_db, experiment_iteration_count, mr_list):
+    redis_db.set('checkpoint,{},plan'.format(experiment_iteration_count), json.dumps([mr.to_string() for mr in mr_list]))
+
+# Returns the MRs chosen to be stressed in an iteration, or None if they were not chosen yet
+def read_stress_plan(redis_db, experiment_iteration_count):
+    plan = redis_db.get('checkpoint,{},plan'.format(experiment_iteration_count))
+    if plan is None:
+        return None
+    mr_list = []
+    for mr_string in json.loads(plan):
+        service_name,resource = mr_string.split(',')
+        mr_list.append(generate_mr(redis_db, service_name, resource))
+    return mr_list
+
+def write_partial_result(redis_db, experiment_iteration_count, mr, stress_weight, experiment_results):
+    hash_name = 'checkpoint,{},{},partial'.format(experiment_iteration_count, mr.to_string())
+    redis_db.hset(hash_name, stress_weight, serialize_experiment_results(experiment_results))
+
+# Returns {stress_weight -> experiment results} for the stress weights an MR completed in an iteration
+def read_partial_results(redis_db, experiment_iteration_count, mr):
+    hash_name = 'checkpoint,{},{},partial'.format(experiment_iteration_count, mr.to_string())
+    partial_results = redis_db.hgetall(hash_name)
+    return dict((int(stress_weight), deserialize_experiment_results(partial_results[stress_weight])) for stress_weight in partial_results)
+
+def mark_mr_completed(redis_db, experiment_iteration_count, mr):
+    redis_db.sadd('checkpoint,{},completed'.format(experiment_iteration_count), mr.to_string())
+
+# Returns the set of MR strings (see MR.to_string) completed in an iteration
+def read_completed_mrs(redis_db, experiment_iteration_count):
+    return redis_db.smembers('checkpoint,{},completed'.format(experiment_iteration_count))
+
+def write_improvement_checkpoint(redis_db, experiment_iteration_count, mimr, action_taken):
+    redis_db.hmset('checkpoint,{},improvement'.format(experiment_iteration_count),
+                   {'mimr': mimr.to_string(), 'action_taken': action_taken})
+
+# Returns (MIMR, action taken) if the MIMR of an iteration was already improved, else (None, None)
+def read_improvement_checkpoint(redis_db, experiment_iteration_count):
+    improvement = redis_db.hgetall('checkpoint,{},improvement'.format(experiment_iteration_count))
+    if 'mimr' not in improvement:
+        return None, None
+    service_name,resource = improvement['mimr'].split(',')
+    mimr = generate_mr(redis_db, service_name, resource)
+    return mimr, float(improvement['action_taken'])
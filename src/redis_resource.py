@@ -15,8 +15,7 @@ def get_all_mrs(redis_db):
     mr_object_list = []
     for mr in mr_list:
         service_name,resource = mr.split(',')
-        deployments = tbot_datastore.read_service_locations(redis_db, service_name)
-        mr_object_list.append(MR(service_name, resource, deployments))
+        mr_object_list.append(tbot_datastore.generate_mr(redis_db, service_name, resource))
     return mr_object_list
 
 '''
@@ -47,8 +46,7 @@ def read_all_mr_alloc(redis_db):
     mr_allocation_list = {}
     for mr in mr_to_score:
         service_name,resource = mr.split(',')
-        deployments = tbot_datastore.read_service_locations(redis_db, service_name)
-        mr_object = MR(service_name, resource, deployments)
+        mr_object = tbot_datastore.generate_mr(redis_db, service_name, resource)
         mr_allocation_list[mr_object] = mr_to_score[mr]
         
     return mr_allocation_list
@@ -62,10 +60,18 @@ capacity to the full amount
 
 # machine_cap is a dict that stores the machine's maximum capacity
 # machine_util is a tuple that stores the machine's current usage level
+# The write functions also accept a pipeline, to group the updates of several machines
 def write_machine_consumption(redis_db, machine_ip, machine_util):
     name = '{}machine_consumption'.format(machine_ip)
-    for key in machine_util:
-        redis_db.hset(name, key, machine_util[key])
+    redis_db.hmset(name, machine_util)
+
+# Adds the increments of {machine_ip -> amount} to the consumption of resource, in one transaction
+def increment_machine_consumption(redis_db, machine_ip_to_increment, resource):
+    pipe = redis_db.pipeline()
+    for machine_ip in machine_ip_to_increment:
+        name = '{}machine_consumption'.format(machine_ip)
+        pipe.hincrbyfloat(name, resource, machine_ip_to_increment[machine_ip])
+    pipe.execute()
 
 def read_machine_consumption(redis_db, machine_ip):
     machine_util = {}
@@ -76,10 +82,20 @@ def read_machine_consumption(redis_db, machine_ip):
         machine_consumption[resource] = float(machine_consumption[resource])
     return machine_consumption
 
+# Bulk counterpart of read_machine_consumption: {machine_ip -> consumption} in a single round trip
+def read_machine_consumptions(redis_db, machine_ips):
+    machine_ips = list(machine_ips)
+    pipe = redis_db.pipeline()
+    for machine_ip in machine_ips:
+        pipe.hgetall('{}machine_consumption'.format(machine_ip))
+    machine_to_consumption = {}
+    for machine_ip,machine_consumption in zip(machine_ips, pipe.execute()):
+        machine_to_consumption[machine_ip] = dict((resource, float(machine_consumption[resource])) for resource in machine_consumption)
+    return machine_to_consumption
+
 def write_machine_capacity(redis_db, machine_ip, machine_cap):
     name = '{}machine_capacity'.format(machine_ip)
-    for key in machine_cap:
-        redis_db.hset(name, key, machine_cap[key])
+    redis_db.hmset(name, machine_cap)
 
 def read_machine_capacity(redis_db, machine_ip):
     machine_cap = {}
@@ -90,6 +106,105 @@ def read_machine_capacity(redis_db, machine_ip):
         machine_capacity[resource] = float(machine_capacity[resource])
     return machine_capacity
 
+# Bulk counterpart of read_machine_capacity: {machine_ip -> capacity} in a single round trip
+def read_machine_capacities(redis_db, machine_ips):
+    machine_ips = list(machine_ips)
+    pipe = redis_db.pipeline()
+    for machine_ip in machine_ips:
+        pipe.hgetall('{}machine_capacity'.format(machine_ip))
+    machine_to_capacity = {}
+    for machine_ip,machine_capacity in zip(machine_ips, pipe.execute()):
+        machine_to_capacity[machine_ip] = dict((resource, float(machine_capacity[resource])) for resource in machine_capacity)
+    return machine_to_capacity
+
+# Measured capacities of a machine (see cluster_calibration.py), kept with the
+# fingerprint of the hardware they were measured on
+def write_machine_calibration(redis_db, machine_ip, fingerprint, machine_cap):
+    name = '{}machine_calibration'.format(machine_ip)
+    calibration = dict(machine_cap)
+    calibration['fingerprint'] = fingerprint
+    redis_db.delete(name)
+    redis_db.hmset(name, calibration)
+
+# Returns {machine_ip -> (fingerprint, capacity)} in a single round trip
+# Machines never calibrated have no fingerprint and an empty capacity
+def read_machine_calibrations(redis_db, machine_ips):
+    machine_ips = list(machine_ips)
+    pipe = redis_db.pipeline()
+    for machine_ip in machine_ips:
+        pipe.hgetall('{}machine_calibration'.format(machine_ip))
+    machine_to_calibration = {}
+    for machine_ip,calibration in zip(machine_ips, pipe.execute()):
+        fingerprint = calibration.pop('fingerprint', None)
+        machine_to_calibration[machine_ip] = (fingerprint, dict((resource, float(calibration[resource])) for resource in calibration))
+    return machine_to_calibration
 
-    
+'''
+Admission of a resource change on the machines of an MR. The capacity check
+and the consumption update run together as one server-side script, so two
+Throttlebot processes sharing a Redis can never both claim the same spare
+capacity, and the whole admission costs a single round trip.
+'''
+
+# KEYS: the consumption hashes of n machines, followed by their capacity hashes
+# ARGV: the resource, followed by the increment of each of the n machines
+# Returns 0 once every consumption was incremented, or the 1-based position of
+# the first machine without enough capacity, in which case nothing is changed
+RESERVE_CONSUMPTION_SCRIPT = """
+local num_machines = #KEYS / 2
+local resource = ARGV[1]
+for i = 1, num_machines do
+    local consumption = tonumber(redis.call('HGET', KEYS[i], resource) or '0')
+    local capacity = tonumber(redis.call('HGET', KEYS[num_machines + i], resource))
+    if capacity == nil or consumption + tonumber(ARGV[i + 1]) > capacity then
+        return i
+    end
+end
+for i = 1, num_machines do
+    redis.call('HINCRBYFLOAT', KEYS[i], resource, ARGV[i + 1])
+end
+return 0
+"""
+
+# Atomically adds the increments of {machine_ip -> amount} to the consumption of resource
+# if no machine would exceed its capacity
+# Returns None if the change was reserved, otherwise the IP of a machine that cannot fit it
+def reserve_machine_consumption(redis_db, machine_ip_to_increment, resource):
+    machine_ips = list(machine_ip_to_increment)
+    if len(machine_ips) == 0:
+        return None
+    keys = ['{}machine_consumption'.format(machine_ip) for machine_ip in machine_ips] + \
+           ['{}machine_capacity'.format(machine_ip) for machine_ip in machine_ips]
+    args = [resource] + [machine_ip_to_increment[machine_ip] for machine_ip in machine_ips]
+    failing_position = redis_db.eval(RESERVE_CONSUMPTION_SCRIPT, len(keys), *(keys + args))
+    if failing_position == 0:
+        return None
+    return machine_ips[failing_position - 1]
+
+'''
+Instances whose allocation is not counted in the consumption of their machine,
+because their container started on a machine without the capacity for it.
+They are kept in Redis, so that a resumed run neither releases nor reconciles
+consumption that was never reserved.
+'''
+
+UNRESERVED_INSTANCES_KEY = 'unreserved_instances'
+
+def generate_unreserved_instance_key(mr, location):
+    vm_ip,container_id = location
+    return '{}|{}|{}'.format(generate_mr_key(mr.service_name, mr.resource), vm_ip, container_id)
+
+def add_unreserved_instance(redis_db, mr, location):
+    redis_db.sadd(UNRESERVED_INSTANCES_KEY, generate_unreserved_instance_key(mr, location))
+
+# Returns True if the instance was unreserved, in which case it no longer is
+def remove_unreserved_instance(redis_db, mr, location):
+    return redis_db.srem(UNRESERVED_INSTANCES_KEY, generate_unreserved_instance_key(mr, location)) == 1
 
+# Returns a set of (MR key, (vm_ip, container_id))
+def read_unreserved_instances(redis_db):
+    unreserved_instances = set()
+    for instance_key in redis_db.smembers(UNRESERVED_INSTANCES_KEY):
+        mr_key,vm_ip,container_id = instance_key.split('|')
+        unreserved_instances.add((mr_key, (vm_ip, container_id)))
+    return unreserved_instances
@@ -1,11 +1,316 @@
+import hashlib
+import hmac
+import json
+import socket
+import threading
+
 import paramiko
 
-def get_client(ip):
+'''
+Remote execution on the VMs of the cluster.
+
+One connection per VM is kept alive and shared by all callers, so that
+Throttlebot does not pay for a new handshake on every command. Connections
+are reused until close_all_clients is called, and replaced when they drop.
+
+The backend is selected with set_remote_backend:
+ssh       -- paramiko SSH clients (default)
+agent     -- a long-lived socket to throttle_agent.py running on each VM
+simulated -- an in-process SimulatedCluster (see simulated_cluster.py)
+'''
+
+SSH_USERNAME = 'quilt'
+SSH_PASSWORD = ''
+
+# Interval in seconds at which keep-alive packets are sent on idle connections
+SSH_KEEPALIVE_INTERVAL = 30
+
+# Maximum number of commands in flight across all VMs during a fan-out
+MAX_INFLIGHT_COMMANDS = 16
+
+def _open_ssh_client(ip):
     client = paramiko.SSHClient()
     client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    client.connect(ip, username="quilt", password="")
+    client.connect(ip, username=SSH_USERNAME, password=SSH_PASSWORD)
+    client.get_transport().set_keepalive(SSH_KEEPALIVE_INTERVAL)
     return client
 
+'''Agent backend'''
+
+class AgentError(Exception):
+    pass
+
+# The connection to the agent was lost, as opposed to an operation failing
+class AgentConnectionError(AgentError):
+    pass
+
+class AgentClient:
+    '''
+    Client for throttle_agent.py. Requests are sent in batches over a single
+    persistent connection. Every batch is signed with the token and the nonce
+    the agent greeted the connection with, so the token itself is never sent.
+    The agent only runs its own operations, so
+    exec_command goes over an SSH connection to the same VM, opened on first
+    use, and the existing command-based code keeps working unchanged.
+    '''
+    def __init__(self, ip, port, token='', timeout=None):
+        self.ip = ip
+        self.lock = threading.Lock()
+        self.token = token
+        self.sock = socket.create_connection((ip, port), timeout)
+        self.sock_file = self.sock.makefile('rb')
+        self.ssh_client = None
+        self.ssh_lock = threading.Lock()
+
+        greeting = self.sock_file.readline()
+        if not greeting:
+            raise AgentConnectionError('Connection to agent on {} closed'.format(ip))
+        self.nonce = json.loads(greeting.decode('utf-8'))['nonce']
+        self.seq = 0
+
+    # Sends a batch of operations and returns the list of results
+    def request(self, operations):
+        with self.lock:
+            self.seq += 1
+            payload = json.dumps({'seq': self.seq, 'requests': operations})
+            mac = hmac.new(self.token.encode('utf-8'), (self.nonce + payload).encode('utf-8'), hashlib.sha256).hexdigest()
+            batch = json.dumps({'payload': payload, 'mac': mac}) + '\n'
+            self.sock.sendall(batch.encode('utf-8'))
+            line = self.sock_file.readline()
+        if not line:
+            raise AgentConnectionError('Connection to agent on {} closed'.format(self.ip))
+        response = json.loads(line.decode('utf-8'))
+        if 'error' in response:
+            raise AgentError('Agent on {}: {}'.format(self.ip, response['error']))
+        return response['results']
+
+    # Like request, but raises if any operation in the batch failed
+    def request_checked(self, operations):
+        results = self.request(operations)
+        for operation, result in zip(operations, results):
+            if not result['ok']:
+                raise AgentError('{} failed on {}: {}'.format(operation['op'], self.ip, result['error']))
+        return results
+
+    def get_ssh_client(self):
+        with self.ssh_lock:
+            if self.ssh_client is None:
+                self.ssh_client = _open_ssh_client(self.ip)
+            return self.ssh_client
+
+    def exec_command(self, cmd):
+        return self.get_ssh_client().exec_command(cmd)
+
+    def ping(self):
+        self.request([{'op': 'ping'}])
+        with self.ssh_lock:
+            ssh_client = self.ssh_client
+        if ssh_client is not None and not _is_ssh_client_alive(ssh_client):
+            raise AgentConnectionError('SSH connection to {} closed'.format(self.ip))
+
+    def close(self):
+        self.sock_file.close()
+        self.sock.close()
+        with self.ssh_lock:
+            if self.ssh_client is not None:
+                self.ssh_client.close()
+                self.ssh_client = None
+
+def is_agent_client(client):
+    return isinstance(client, AgentClient)
+
+remote_backend = {'name': 'ssh', 'agent_port': 4545, 'agent_token': '', 'simulated_cluster': None}
+
+# Selects how Throttlebot reaches the VMs: 'ssh', 'agent' or 'simulated'
+# Already pooled connections are closed so that new ones use the backend
+def set_remote_backend(name, agent_port=4545, agent_token='', simulated_cluster=None):
+    if name not in ['ssh', 'agent', 'simulated']:
+        raise ValueError('Unknown remote backend {}'.format(name))
+    if name == 'simulated' and simulated_cluster is None:
+        raise ValueError('The simulated backend requires a SimulatedCluster')
+    remote_backend['name'] = name
+    remote_backend['agent_port'] = agent_port
+    remote_backend['agent_token'] = agent_token
+    remote_backend['simulated_cluster'] = simulated_cluster
+    close_all_clients()
+
+# Returns the SimulatedCluster in use, or None when running against real VMs
+def get_simulated_cluster():
+    if remote_backend['name'] == 'simulated':
+        return remote_backend['simulated_cluster']
+    return None
+
+def _open_client(ip):
+    if remote_backend['name'] == 'agent':
+        return AgentClient(ip, remote_backend['agent_port'], remote_backend['agent_token'])
+    elif remote_backend['name'] == 'simulated':
+        return remote_backend['simulated_cluster'].get_client(ip)
+    return _open_ssh_client(ip)
+
+def _is_client_alive(client):
+    if get_simulated_cluster() is not None:
+        return True
+    if is_agent_client(client):
+        try:
+            client.ping()
+        except Exception:
+            return False
+        return True
+    return _is_ssh_client_alive(client)
+
+def _is_ssh_client_alive(client):
+    transport = client.get_transport()
+    if transport is None or not transport.is_active():
+        return False
+    try:
+        transport.send_ignore()
+    except Exception:
+        return False
+    return True
+
+class ClientPool:
+    '''
+    Keep-alive pool of clients keyed by VM IP address.
+    Each VM has a single client, shared by every caller: paramiko multiplexes
+    concurrent exec_command calls as separate channels, and AgentClient
+    serializes its batches. A client found dead, or discarded after a
+    connection error, is replaced on the next get.
+    '''
+    def __init__(self, connect=_open_client, is_alive=_is_client_alive):
+        self.connect = connect
+        self.is_alive = is_alive
+        self.lock = threading.Lock()
+        # vm_ip -> client
+        self.clients = {}
+        # vm_ip -> lock held while a client to that VM is opened
+        self.host_locks = {}
+        self.stats = {'opened': 0, 'reused': 0, 'reconnected': 0, 'closed': 0}
+
+    def _host_lock(self, ip):
+        with self.lock:
+            if ip not in self.host_locks:
+                self.host_locks[ip] = threading.Lock()
+            return self.host_locks[ip]
+
+    def get(self, ip):
+        with self._host_lock(ip):
+            with self.lock:
+                client = self.clients.get(ip)
+            if client is not None:
+                if self.is_alive(client):
+                    with self.lock:
+                        self.stats['reused'] += 1
+                    return client
+                # The connection dropped, replace it
+                self.discard(ip, client)
+                with self.lock:
+                    self.stats['reconnected'] += 1
+            client = self.connect(ip)
+            with self.lock:
+                self.clients[ip] = client
+                self.stats['opened'] += 1
+            return client
+
+    # Closes client and forgets it, unless it was already replaced
+    def discard(self, ip, client=None):
+        with self.lock:
+            if client is None:
+                client = self.clients.get(ip)
+            if client is None or self.clients.get(ip) is not client:
+                return
+            del self.clients[ip]
+        self._close(client)
+
+    def _close(self, client):
+        try:
+            client.close()
+        except Exception:
+            pass
+        with self.lock:
+            self.stats['closed'] += 1
+
+    def close_all(self):
+        with self.lock:
+            clients = list(self.clients.values())
+            self.clients = {}
+        for client in clients:
+            self._close(client)
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+_client_pool = ClientPool()
+
+# Returns a live connection to ip, shared with the other callers
+def get_client(ip):
+    return _client_pool.get(ip)
+
+# Drops the pooled connection to ip, e.g. after it failed, so that the next get_client reconnects
+def discard_client(ip):
+    _client_pool.discard(ip)
+
+# Closes every pooled connection; should be called once Throttlebot finishes
+def close_all_clients():
+    _client_pool.close_all()
+
+# Returns a dict with the number of connections opened, reused, reconnected and closed
+def get_client_stats():
+    return _client_pool.get_stats()
+
+# Errors after which a connection cannot be trusted anymore
+def is_connection_error(error):
+    return isinstance(error, (socket.error, EOFError, paramiko.SSHException, AgentConnectionError))
+
+# Runs task_fn(vm_ip, task) for every task in host_to_tasks ({vm_ip -> [task]})
+# VMs are handled concurrently, but the tasks of one VM run in list order,
+# so at most one command per VM (and max_in_flight overall) is outstanding
+# Returns {(vm_ip, task) -> exception} for the tasks that failed
+def execute_per_host(host_to_tasks, task_fn, max_in_flight=MAX_INFLIGHT_COMMANDS):
+    def run_host_tasks(vm_ip):
+        errors = []
+        for task in host_to_tasks[vm_ip]:
+            try:
+                task_fn(vm_ip, task)
+            except Exception as e:
+                errors.append(((vm_ip, task), e))
+                if is_connection_error(e):
+                    discard_client(vm_ip)
+        return errors
+
+    vm_ips = list(host_to_tasks.keys())
+    if len(vm_ips) == 0:
+        return {}
+    if len(vm_ips) == 1 or max_in_flight <= 1:
+        host_errors = [run_host_tasks(vm_ip) for vm_ip in vm_ips]
+    else:
+        # Plain threads pulling VMs from a shared list, joined directly:
+        # under Python 2, joining a multiprocessing.dummy Pool waits ~100ms for its handler thread
+        host_errors = []
+        pending_vms = list(vm_ips)
+        results_lock = threading.Lock()
+        def run_pending_hosts():
+            while True:
+                with results_lock:
+                    if len(pending_vms) == 0:
+                        return
+                    vm_ip = pending_vms.pop()
+                errors = run_host_tasks(vm_ip)
+                with results_lock:
+                    host_errors.append(errors)
+
+        threads = [threading.Thread(target=run_pending_hosts) for _ in range(min(len(vm_ips), max_in_flight))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    task_errors = {}
+    for errors in host_errors:
+        for task_key, error in errors:
+            task_errors[task_key] = error
+    return task_errors
+
 def ssh_exec(ssh_client, cmd):
     _, _, stderr = ssh_client.exec_command(cmd)
     err = stderr.read()
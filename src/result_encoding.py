@@ -0,0 +1,64 @@
+import ast
+import base64
+import struct
+
+'''
+Compact binary encoding of experiment results (lists of per-trial values)
+and summary values, as stored in Redis and in the results CSV files.
+
+An encoded value is a small header followed by packed little-endian
+float64s, so its size and decode time are proportional to the number of
+trials and floats keep their full precision. Values written before this
+encoding existed are str() of a list or a number; decode_values and
+decode_values_text fall back to parsing those.
+'''
+
+# Layout of encode_values(): version, kind, number of values, then the values as float64
+ENCODING_VERSION = 1
+HEADER_FORMAT = '<BBI'
+VALUE_FORMAT = '<{}d'
+
+# A vector decodes to a list, a scalar to a single float
+KIND_VECTOR = 0
+KIND_SCALAR = 1
+
+def encode_values(values):
+    values = [float(value) for value in values]
+    return struct.pack(HEADER_FORMAT, ENCODING_VERSION, KIND_VECTOR, len(values)) + \
+        struct.pack(VALUE_FORMAT.format(len(values)), *values)
+
+def encode_value(value):
+    return struct.pack(HEADER_FORMAT, ENCODING_VERSION, KIND_SCALAR, 1) + \
+        struct.pack(VALUE_FORMAT.format(1), float(value))
+
+def is_encoded(data):
+    header_size = struct.calcsize(HEADER_FORMAT)
+    if len(data) < header_size:
+        return False
+    version, kind, num_values = struct.unpack(HEADER_FORMAT, data[:header_size])
+    return version == ENCODING_VERSION and kind in (KIND_VECTOR, KIND_SCALAR) and \
+        len(data) == header_size + struct.calcsize(VALUE_FORMAT.format(num_values))
+
+# Returns a list of floats for a vector, a float for a scalar and None for None
+# Legacy values are parsed from their str() form
+def decode_values(data):
+    if data is None:
+        return None
+    if not is_encoded(data):
+        return ast.literal_eval(data)
+    header_size = struct.calcsize(HEADER_FORMAT)
+    _, kind, num_values = struct.unpack(HEADER_FORMAT, data[:header_size])
+    values = list(struct.unpack(VALUE_FORMAT.format(num_values), data[header_size:]))
+    if kind == KIND_SCALAR:
+        return values[0]
+    return values
+
+# Text form of encode_values, for files such as the results CSV
+def encode_values_text(values):
+    return base64.b64encode(encode_values(values))
+
+def decode_values_text(text):
+    # Legacy files hold str() of the list
+    if text.startswith('['):
+        return ast.literal_eval(text)
+    return decode_values(base64.b64decode(text))
@@ -2,10 +2,17 @@
 '''Body of Running Experiments'''
 '''Can return multiple performance values, but MUST return as one entry in the dict to be latency' '''
 
+import json
+import os
+import pipes
+
 from remote_execution import *
 from modify_resources import *
 from measure_performance_MEAN_py3 import *
 from run_spark_streaming import *
+from ab_results import *
+from latency_histogram import LatencyHistogram, merge_histograms
+from trial_statistics import is_confident
 
 # Measure the performance of the application in term of latency
 # Note: Although unused in some experiments, container_id was included to maintain symmetry
@@ -23,10 +30,46 @@ def measure_runtime(workload_config, experiment_iterations):
         return measure_GET_response_time(workload_config, experiment_iterations)
     elif experiment_type == 'spark-streaming':
         return measure_spark_streaming(workload_config, experiment_iterations)
+    elif experiment_type == 'simulated':
+        return measure_simulated(workload_config, experiment_iterations)
+    elif experiment_type == 'open-loop':
+        return measure_open_loop(workload_config, experiment_iterations)
     else:
         print 'INVALID EXPERIMENT TYPE: {}'.format(experiment_type)
         exit()
 
+# Runs trials until the 95% confidence interval of metric is within
+# ci_tolerance (a fraction of its mean), with at least min_trials and at most max_trials
+# Returns the results of all trials, in the same format as measure_runtime
+# Trials that report no value of metric still count towards max_trials
+def measure_runtime_adaptive(workload_config, metric, min_trials, max_trials, ci_tolerance):
+    all_results = measure_runtime(workload_config, min_trials)
+    attempts = min_trials
+    while attempts < max_trials and not is_confident(all_results.get(metric, []), ci_tolerance):
+        trial_results = measure_runtime(workload_config, 1)
+        attempts += 1
+        for result_name in trial_results:
+            all_results.setdefault(result_name, []).extend(trial_results[result_name])
+    num_values = len(all_results.get(metric, []))
+    if num_values < attempts:
+        print 'WARNING: {} of {} trials returned a value for {}'.format(num_values, attempts, metric)
+    print 'Ran {} trials for {}'.format(attempts, metric)
+    return all_results
+
+# Summarizes the per-trial values of metric into a single number
+# Percentile metrics (latency_<p>) are read off the merged histograms of all trials
+# when the workload reports them, so they cover every request instead of averaging per-trial percentiles
+def summarize_performance(experiment_results, metric):
+    histograms = [histogram for histogram in experiment_results.get('histograms', []) if histogram is not None]
+    if metric.startswith('latency_') and len(histograms) > 0:
+        try:
+            percent = float(metric[len('latency_'):])
+        except ValueError:
+            percent = None
+        if percent is not None:
+            return merge_histograms(histograms).percentile(percent)
+    return float(sum(experiment_results[metric])) / len(experiment_results[metric])
+
 #Resets all parameters of the experiment to default values
 def reset_experiment(vm_ip, container_id):
     ssh_client = get_client(vm_ip)
@@ -36,6 +79,95 @@ def reset_experiment(vm_ip, container_id):
     except:
         print ("Couldn't reset VM {}".format(vm_ip))
 
+# Performance of the in-process simulated cluster (remote_backend = simulated)
+# The workload of an application only sees the services of that application
+def measure_simulated(workload_configuration, experiment_iterations):
+    simulated_cluster = get_simulated_cluster()
+    if simulated_cluster is None:
+        print 'The simulated workload requires remote_backend = simulated'
+        exit()
+    return simulated_cluster.measure(experiment_iterations, workload_configuration.get('services'))
+
+# Scripts copied to a request generator before the first open-loop trial
+OPEN_LOOP_SCRIPTS = ['load_generator_py3.py', 'latency_histogram.py']
+
+# Request generators the open-loop scripts have already been copied to
+open_loop_hosts = set()
+
+def upload_open_loop_scripts(vm_ip):
+    if vm_ip in open_loop_hosts:
+        return
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    sftp_client = get_client(vm_ip).open_sftp()
+    try:
+        for script in OPEN_LOOP_SCRIPTS:
+            sftp_client.put(os.path.join(script_dir, script), script)
+    finally:
+        sftp_client.close()
+    open_loop_hosts.add(vm_ip)
+
+# Drives the frontend at a fixed request rate with load_generator_py3.py
+# Optional additional_args: rate, duration, connections, path, method, body_file, headers
+# Besides the usual metrics, 'histograms' holds the LatencyHistogram of every trial
+def measure_open_loop(workload_configuration, experiment_iterations):
+    frontend_ip = workload_configuration['frontend'][0]
+    traffic_generate_machine = workload_configuration['request_generator'][0]
+    additional_args = workload_configuration['additional_args']
+
+    upload_open_loop_scripts(traffic_generate_machine)
+    ssh_client = get_client(traffic_generate_machine)
+
+    benchmark_cmd = 'python3 load_generator_py3.py http://{}{} --rate {} --duration {} --connections {} --method {}'.format(
+        frontend_ip, additional_args.get('path', '/'), additional_args.get('rate', 100),
+        additional_args.get('duration', 10), additional_args.get('connections', 32),
+        additional_args.get('method', 'GET'))
+    if 'body_file' in additional_args:
+        benchmark_cmd += ' --body_file {}'.format(additional_args['body_file'])
+    # headers holds several headers separated by semicolons, e.g. Content-Type: application/json;Accept: */*
+    for header in additional_args.get('headers', '').split(';'):
+        if header.strip():
+            benchmark_cmd += ' --header {}'.format(pipes.quote(header.strip()))
+
+    all_requests = {}
+    for metric in ['rps', 'latency', 'latency_50', 'latency_90', 'latency_99', 'latency_99.9', 'errors', 'histograms']:
+        all_requests[metric] = []
+
+    for x in range(experiment_iterations):
+        print benchmark_cmd
+        _, results, _ = ssh_client.exec_command(benchmark_cmd)
+        try:
+            summary = json.loads(results.read())
+        except ValueError:
+            print 'Open-loop load generator returned no results'
+            continue
+        histogram = LatencyHistogram.from_dict(summary['histogram'])
+        all_requests['rps'].append(summary['achieved_rps'])
+        all_requests['latency'].append(histogram.mean())
+        all_requests['latency_50'].append(histogram.percentile(50))
+        all_requests['latency_90'].append(histogram.percentile(90))
+        all_requests['latency_99'].append(histogram.percentile(99))
+        all_requests['latency_99.9'].append(histogram.percentile(99.9))
+        all_requests['errors'].append(summary['errors'] + summary['non_2xx'])
+        all_requests['histograms'].append(histogram)
+
+    return all_requests
+
+# Runs an ab benchmark and fetches all of its results in a single remote command
+def run_ab_benchmark(ssh_client, benchmark_cmd):
+    _, results, _ = ssh_client.exec_command(get_ab_command(benchmark_cmd))
+    return parse_ab_output(results.read())
+
+# Appends the metrics of one ab run to the per-trial lists in all_requests
+# Percentiles not reported before are added as new metrics
+def append_ab_results(all_requests, ab_results, num_requests):
+    all_requests['latency'].append(ab_results['time_per_request'] * num_requests)
+    all_requests['rps'].append(ab_results['rps'])
+    all_requests.setdefault('histograms', []).append(ab_results['histogram'])
+    # latency_curve is the list of points behind the percentiles, not a per-trial metric
+    for metric in ab_results:
+        if metric.startswith('latency_') and metric != 'latency_curve':
+            all_requests.setdefault(metric, []).append(ab_results[metric])
+
 def execute_parse_results(ssh_client, cmd):
     _, results, _ = ssh_client.exec_command(cmd)
     try:
@@ -70,24 +202,11 @@ def measure_nginx_single_machine(workload_configuration, experiment_iterations):
     all_requests[field_name] = []
 
     for x in range(experiment_iterations):
-        benchmark_cmd = 'ab -n {} -c {} -e results_file http://{}/ > output.txt'.format(NUM_REQUESTS, CONCURRENCY, nginx_public_ip)
+        benchmark_cmd = 'ab -n {} -c {} -e results_file -g requests_file http://{}/'.format(NUM_REQUESTS, CONCURRENCY, nginx_public_ip)
         print benchmark_cmd
-        _, results, _ = ssh_client.exec_command(benchmark_cmd)
-        results.read()
-
-        rps_cmd = 'cat output.txt | grep \'Requests per second\' | awk {{\'print $4\'}}'
-        latency_90_cmd = 'cat output.txt | grep \'90%\' | awk {\'print $2\'}'
-        latency_50_cmd = 'cat output.txt | grep \'50%\' | awk {\'print $2\'}'
-        latency_99_cmd = 'cat output.txt | grep \'99%\' | awk {\'print $2\'}'
-        requests_within_time_cmd = 'awk -F"," \'$2 > {} {{print $1}}\' results_file | sed -n \'2p\''.format(ACCEPTABLE_MS)
-        latency_overall_cmd = 'cat output.txt | grep \'Time per request\' | awk \'NR==1{{print $4}}\''
-
-        all_requests['latency_90'].append(execute_parse_results(ssh_client, latency_90_cmd))
-        all_requests['latency_99'].append(execute_parse_results(ssh_client, latency_99_cmd))
-        all_requests['latency'].append(execute_parse_results(ssh_client, latency_overall_cmd) * NUM_REQUESTS)
-        all_requests['latency_50'].append(execute_parse_results(ssh_client, latency_50_cmd))
-        all_requests['rps'].append(execute_parse_results(ssh_client, rps_cmd))
-        all_requests[field_name].append(execute_parse_results(ssh_client, requests_within_time_cmd))
+        ab_results = run_ab_benchmark(ssh_client, benchmark_cmd)
+        append_ab_results(all_requests, ab_results, NUM_REQUESTS)
+        all_requests[field_name].append(get_percent_within(ab_results['latency_curve'], ACCEPTABLE_MS))
 
     return all_requests
 
@@ -151,29 +270,16 @@ def measure_TODO_response_time(container_id, todo_args, iterations):
     CONCURRENCY = 200
     ACCEPTABLE_MS = 60
 
-    post_cmd = 'ab -p post.json -T application/json -n {} -c {} -e results_file http://{}/api/todos > output.txt'.format(NUM_REQUESTS, CONCURRENCY, REST_server_ip)
+    post_cmd = 'ab -p post.json -T application/json -n {} -c {} -e results_file -g requests_file http://{}/api/todos'.format(NUM_REQUESTS, CONCURRENCY, REST_server_ip)
 
     clear_cmd = 'python3 clear_entries.py {}'.format(REST_server_ip)
 
     print iterations
 
     for x in range(iterations):
-        _, results,_ = ssh_client.exec_command(post_cmd)
         print post_cmd
-        results.read()
-
-        rps_cmd = 'cat output.txt | grep \'Requests per second\' | awk {{\'print $4\'}}'
-        latency_90_cmd = 'cat output.txt | grep \'90%\' | awk {\'print $2\'}'
-        latency_50_cmd = 'cat output.txt | grep \'50%\' | awk {\'print $2\'}'
-        latency_99_cmd = 'cat output.txt | grep \'99%\' | awk {\'print $2\'}'
-        requests_within_time_cmd = 'awk -F"," \'$2 > {} {{print $1}}\' results_file | sed -n \'2p\''.format(ACCEPTABLE_MS)
-        latency_overall_cmd = 'cat output.txt | grep \'Time per request\' | awk \'NR==1{{print $4}}\''
-
-        all_requests['latency_90'].append(execute_parse_results(ssh_client, latency_90_cmd))
-        all_requests['latency_99'].append(execute_parse_results(ssh_client, latency_99_cmd))
-        all_requests['latency'].append(execute_parse_results(ssh_client, latency_overall_cmd) * NUM_REQUESTS)
-        all_requests['latency_50'].append(execute_parse_results(ssh_client, latency_50_cmd))
-        all_requests['rps'].append(execute_parse_results(ssh_client, rps_cmd))
+        ab_results = run_ab_benchmark(ssh_client, post_cmd)
+        append_ab_results(all_requests, ab_results, NUM_REQUESTS)
 
         _,cleared,_ = ssh_client.exec_command(clear_cmd)
         cleared.read()
@@ -212,23 +318,11 @@ def measure_GET_response_time(container_id, experiment_args, iterations):
     all_requests['latency_90'] = []
 
     for x in range(iterations):
-        benchmark_cmd = 'ab -n {} -c {} -s 999999 -e results_file http://{}/ > output.txt'.format(NUM_REQUESTS,
-                                                                                                   CONCURRENCY,
-                                                                                                   website_public_ip)
+        benchmark_cmd = 'ab -n {} -c {} -s 999999 -e results_file -g requests_file http://{}/'.format(NUM_REQUESTS,
+                                                                                      CONCURRENCY,
+                                                                                      website_public_ip)
         print benchmark_cmd
-        _, results, _ = traffic_client.exec_command(benchmark_cmd)
-        results.read()
-
-        rps_cmd = 'cat output.txt | grep \'Requests per second\' | awk {{\'print $4\'}}'
-        latency_90_cmd = 'cat output.txt | grep \'90%\' | awk {\'print $2\'}'
-        latency_50_cmd = 'cat output.txt | grep \'50%\' | awk {\'print $2\'}'
-        latency_99_cmd = 'cat output.txt | grep \'99%\' | awk {\'print $2\'}'
-        latency_overall_cmd = 'cat output.txt | grep \'Time per request\' | awk \'NR==1{{print $4}}\''
-
-        all_requests['latency_90'].append(execute_parse_results(traffic_client, latency_90_cmd))
-        all_requests['latency_99'].append(execute_parse_results(traffic_client, latency_99_cmd))
-        all_requests['latency'].append(execute_parse_results(traffic_client, latency_overall_cmd) * NUM_REQUESTS)
-        all_requests['latency_50'].append(execute_parse_results(traffic_client, latency_50_cmd))
-        all_requests['rps'].append(execute_parse_results(traffic_client, rps_cmd))
+        ab_results = run_ab_benchmark(traffic_client, benchmark_cmd)
+        append_ab_results(all_requests, ab_results, NUM_REQUESTS)
 
     return all_requests
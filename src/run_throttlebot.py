@@ -11,6 +11,9 @@ import ast
 import os
 import socket
 import ConfigParser
+import heapq
+import itertools
+import math
 from random import shuffle
 
 from time import sleep
@@ -26,10 +29,17 @@ from container_information import *
 from cluster_information import *
 
 from mr	import MR
+from simulated_cluster import load_cluster
+from experiment_scheduler import schedule_concurrent_batches, run_concurrent_batch
+from placement_watcher import PlacementWatcher
+from cluster_inventory import set_inventory, get_inventory
+from cluster_calibration import calibrate_cluster
+from utilization_sampler import UtilizationSampler, get_active_sampler, set_active_sampler, sum_deltas
 
 import redis.client
 import redis_client as tbot_datastore
 import redis_resource as resource_datastore
+import allocation_cache
 
 '''
 Functions that enable stressing resources and determining how much to stress
@@ -37,23 +47,95 @@ Stresses implemented in: modify_resources.py
 '''
 
 # Sets the resource provision for all containers in a service
+# Instances that already have new_mr_allocation are skipped.
 def set_mr_provision(mr, new_mr_allocation):
-    for vm_ip,container_id in mr.instances:
+    set_mr_config_provision({mr: new_mr_allocation})
+
+# Sets the resource provision of several MRs (MR -> raw allocation) in one batch
+# Instances on different VMs are provisioned concurrently. CPU limits of
+# all instances of an MR on one VM are applied in a single remote invocation.
+# Instances that already have their allocation are skipped.
+def set_mr_config_provision(mr_config):
+    # Each task is (MR, tuple of the container ids it provisions)
+    host_to_tasks = {}
+    mr_to_instances = {}
+    for mr in mr_config:
+        if mr.resource not in ['CPU-CORE', 'CPU-QUOTA', 'DISK', 'NET']:
+            print 'INVALID resource'
+            continue
+
+        instances_to_change = allocation_cache.get_instances_to_change(mr, mr_config[mr])
+        if len(instances_to_change) == 0:
+            print 'SKIPPING {}: already provisioned to {}'.format(mr.to_string(), mr_config[mr])
+            continue
+        mr_to_instances[mr] = instances_to_change
+
+        host_to_containers = {}
+        for vm_ip,container_id in instances_to_change:
+            host_to_containers.setdefault(vm_ip, []).append(container_id)
+        for vm_ip in host_to_containers:
+            if mr.resource in ['CPU-CORE', 'CPU-QUOTA']:
+                host_to_tasks.setdefault(vm_ip, []).append((mr, tuple(host_to_containers[vm_ip])))
+            else:
+                host_to_tasks.setdefault(vm_ip, []).extend((mr, (container_id,)) for container_id in host_to_containers[vm_ip])
+
+    if len(host_to_tasks) == 0:
+        return
+
+    def provision_instances(vm_ip, task):
+        mr,container_ids = task
+        new_mr_allocation = mr_config[mr]
         ssh_client = get_client(vm_ip)
-        print 'STRESSING VM_IP {} AND CONTAINER {}'.format(vm_ip, container_id)
+        print 'STRESSING VM_IP {} AND CONTAINER {}'.format(vm_ip, ','.join(container_ids))
         if mr.resource == 'CPU-CORE':
-            set_cpu_cores(ssh_client, container_id, new_mr_allocation)
+            set_cpu_cores_containers(ssh_client, container_ids, new_mr_allocation)
         elif mr.resource == 'CPU-QUOTA':
             #TODO: Period should not be hardcoded to 1 second
-            set_cpu_quota(ssh_client, container_id, 1000000, new_mr_allocation)
+            set_cpu_quota_containers(ssh_client, container_ids, 1000000, new_mr_allocation)
         elif mr.resource == 'DISK':
-            change_container_blkio(ssh_client, container_id, new_mr_allocation)
+            change_container_blkio(ssh_client, container_ids[0], new_mr_allocation)
         elif mr.resource == 'NET':
-            set_egress_network_bandwidth(ssh_client, container_id, new_mr_allocation)
-        else:
-            print 'INVALID resource'
-            return
-        
+            set_egress_network_bandwidth(ssh_client, container_ids[0], new_mr_allocation)
+
+    instance_errors = execute_per_host(host_to_tasks, provision_instances)
+    failed_instances = set((mr, vm_ip, container_id) for vm_ip,(mr,container_ids) in instance_errors for container_id in container_ids)
+    for mr in mr_to_instances:
+        allocation_cache.record_applied_allocation([(vm_ip, container_id) for vm_ip,container_id in mr_to_instances[mr]
+                                                    if (mr, vm_ip, container_id) not in failed_instances],
+                                                   mr.resource, mr_config[mr])
+    if len(instance_errors) != 0:
+        for vm_ip,(mr,container_ids) in instance_errors:
+            print 'ERROR: Provisioning {} on VM {} container {} failed: {}'.format(mr.to_string(), vm_ip, ','.join(container_ids), instance_errors[(vm_ip, (mr, container_ids))])
+        failed_mrs = set(mr.to_string() for mr,_,_ in failed_instances)
+        raise SystemError('Provisioning failed for {} instances of {}'.format(len(failed_instances), ', '.join(sorted(failed_mrs))))
+
+# Brings every MR back to its allocation in mr_config (MR -> raw allocation)
+# Only instances whose applied allocation differs are actuated, all in one batch
+def restore_mr_config(mr_config):
+    set_mr_config_provision(mr_config)
+
+# Seeds the allocation cache with the instances of the MRs in mr_config (MR -> raw allocation)
+# whose limits on the machines already are their allocation, so that provisioning skips them
+# The limits of all VMs are read concurrently; instances that cannot be read are left unknown
+def seed_allocation_cache(mr_config):
+    host_to_tasks = {}
+    for mr in mr_config:
+        host_to_containers = {}
+        for vm_ip,container_id in mr.instances:
+            host_to_containers.setdefault(vm_ip, []).append(container_id)
+        for vm_ip in host_to_containers:
+            host_to_tasks.setdefault(vm_ip, []).append((mr, tuple(host_to_containers[vm_ip])))
+
+    def read_provisioned_instances(vm_ip, task):
+        mr,container_ids = task
+        provisioned = get_containers_provisioned_to(get_client(vm_ip), mr.resource, list(container_ids), mr_config[mr])
+        allocation_cache.record_applied_allocation([(vm_ip, container_id) for container_id in provisioned],
+                                                   mr.resource, mr_config[mr])
+
+    read_errors = execute_per_host(host_to_tasks, read_provisioned_instances)
+    for vm_ip,task in read_errors:
+        print 'WARNING: Could not read the current limits of {} on {}: {}'.format(task[0].to_string(), vm_ip, read_errors[(vm_ip, task)])
+
 # Converts a change in resource provisioning to raw change
 # Example: 20% -> 24 Gbps
 def convert_percent_to_raw(mr, current_mr_allocation, weight_change=0):
@@ -85,38 +167,69 @@ def init_service_placement_r(redis_db, default_mr_configuration):
         else:
             continue
 
+# Converts a share of a machine's capacity, in percent, into a raw allocation
+# An MR always keeps at least one core
+def capacity_share_to_raw(mr, capacity, percentage):
+    share = capacity * percentage / 100.0
+    if mr.resource == 'CPU-CORE':
+        return max(1, int(share))
+    return int(share)
+
 # Set the current resource configurations within the actual containers
-# Data points in resource_config are expressed in percentage change
-def init_resource_config(redis_db, default_mr_config, machine_type):
+# Data points in resource_config are the percentage of the machine capacity given to each MR,
+# relative to the capacity of the smallest machine the MR is placed on
+def init_resource_config(redis_db, default_mr_config):
     print 'Initializing the Resource Configurations in the containers'
-    instance_specs = get_instance_specs(machine_type)
+    all_vms = get_actual_vms()
+    vm_to_capacity = resource_datastore.read_machine_capacities(redis_db, all_vms)
+    mr_to_provision = {}
     for mr in default_mr_config:
-        weight_change = default_mr_config[mr]
-        new_resource_provision = convert_percent_to_raw(mr, instance_specs[mr.resource], weight_change)
-        # Enact the change in resource provisioning
-        set_mr_provision(mr, new_resource_provision)
+        mr_capacity = min(vm_to_capacity[vm_ip][mr.resource] for vm_ip,_ in mr.instances)
+        mr_to_provision[mr] = capacity_share_to_raw(mr, mr_capacity, default_mr_config[mr])
+
+    # Enact the changes in resource provisioning, skipping the containers that already have them
+    seed_allocation_cache(mr_to_provision)
+    set_mr_config_provision(mr_to_provision)
 
-        # Reflect the change in Redis
-        resource_datastore.write_mr_alloc(redis_db, mr, new_resource_provision)
-        update_machine_consumption(redis_db, mr, new_resource_provision, 0)
+    # Reflect the changes in Redis
+    for mr in mr_to_provision:
+        resource_datastore.write_mr_alloc(redis_db, mr, mr_to_provision[mr])
+        update_machine_consumption(redis_db, mr, mr_to_provision[mr], 0)
+
+    # Improvements are only reserved within the capacity, which the initial allocations must leave room for
+    vm_to_consumption = resource_datastore.read_machine_consumptions(redis_db, all_vms)
+    for vm_ip in all_vms:
+        for resource in vm_to_consumption[vm_ip]:
+            assert vm_to_consumption[vm_ip][resource] <= vm_to_capacity[vm_ip][resource], \
+                'Initial consumption of {} on {} ({}) exceeds its capacity ({})'.format(resource, vm_ip, vm_to_consumption[vm_ip][resource], vm_to_capacity[vm_ip][resource])
 
 # Initializes the maximum capacity and current consumption of Quilt
+# Capacities are measured on every machine (see cluster_calibration.py)
 def init_cluster_capacities_r(redis_db, machine_type, quilt_overhead):
     print 'Initializing the per machine capacities'
-    resource_alloc = get_instance_specs(machine_type)
-    quilt_usage = {}
-
-    # Leave some resources available for Quilt containers to run (OVS, etc.)
-    # This is dictated by quilt overhead
-    for resource in resource_alloc:
-        max_cap = resource_alloc[resource]
-        quilt_usage[resource] = ((quilt_overhead)/100.0) * max_cap
-    
     all_vms = get_actual_vms()
+    vm_to_capacity = calibrate_cluster(redis_db, all_vms, machine_type)
 
+    pipe = redis_db.pipeline()
     for vm_ip in all_vms:
-        resource_datastore.write_machine_consumption(redis_db, vm_ip, quilt_usage)
-        resource_datastore.write_machine_capacity(redis_db, vm_ip, resource_alloc)
+        machine_cap = vm_to_capacity[vm_ip]
+        # Leave some resources available for Quilt containers to run (OVS, etc.)
+        # This is dictated by quilt overhead
+        quilt_usage = dict((resource, (quilt_overhead / 100.0) * machine_cap[resource]) for resource in machine_cap)
+        resource_datastore.write_machine_consumption(pipe, vm_ip, quilt_usage)
+        resource_datastore.write_machine_capacity(pipe, vm_ip, machine_cap)
+    pipe.execute()
+
+# Clears Redis for a new run, keeping the machine calibrations so that machines are not benchmarked again
+def reset_redis(redis_db):
+    vm_to_calibration = resource_datastore.read_machine_calibrations(redis_db, get_actual_vms())
+    redis_db.flushall()
+    pipe = redis_db.pipeline()
+    for vm_ip in vm_to_calibration:
+        fingerprint, machine_cap = vm_to_calibration[vm_ip]
+        if fingerprint is not None:
+            resource_datastore.write_machine_calibration(pipe, vm_ip, fingerprint, machine_cap)
+    pipe.execute()
 
 ''' 
 Tools that are used for experimental purposes in Throttlebot 
@@ -132,45 +245,307 @@ def measure_baseline(workload_config, baseline_trials=10):
     baseline_runtime_array = measure_runtime(workload_config, baseline_trials)
     return baseline_runtime_array
 
-# Checks if the current system can support improvements in a particular MR
+# Measures the workload with num_trials trials, or adaptively if adaptive_trials is set
+def measure_trials(system_config, workload_config, num_trials):
+    if system_config['adaptive_trials']:
+        return measure_runtime_adaptive(workload_config, workload_config['tbot_metric'], system_config['min_trials'],
+                                        system_config['max_trials'], system_config['ci_tolerance'])
+    return measure_runtime(workload_config, num_trials)
+
+# Checks if the current system can support improvements in a particular MR,
+# and if so reserves the improvement in the consumption of the MR's machines
 # Improvement amount is the raw amount a resource is being improved by
+# Returns None if the improvement was reserved, otherwise the VM that cannot support it
 # Always leave 10% of system resources available for Quilt
-def check_improve_mr_viability(redis_db, mr, improvement_amount):
+def reserve_mr_improvement(redis_db, mr, improvement_amount):
     print 'Checking MR viability'
 
-    # Check if available space on machines being tested
+    # A machine hosting several instances of the MR changes once per instance
+    vm_to_increment = {}
     for instance in mr.instances:
         vm_ip,container_id = instance
-        machine_consumption = resource_datastore.read_machine_consumption(redis_db, vm_ip)
-        machine_capacity = resource_datastore.read_machine_capacity(redis_db, vm_ip)
-
-        if machine_consumption[mr.resource] + improvement_amount > machine_capacity[mr.resource]:
-            return False
-    return True
+        vm_to_increment[vm_ip] = vm_to_increment.get(vm_ip, 0) + improvement_amount
+    return resource_datastore.reserve_machine_consumption(redis_db, vm_to_increment, mr.resource)
 
 # Update the resource consumption of a machine after an MIMR has been improved
 def update_machine_consumption(redis_db, mr, new_alloc, old_alloc):
+    # A machine hosting several instances of the MR changes once per instance
+    vm_to_increment = {}
     for instance in mr.instances:
         vm_ip,container_id = instance
-        prior_consumption = resource_datastore.read_machine_consumption(redis_db, vm_ip)
-        new_consumption = float(prior_consumption[mr.resource]) + new_alloc - old_alloc
+        vm_to_increment[vm_ip] = vm_to_increment.get(vm_ip, 0) + new_alloc - old_alloc
+    resource_datastore.increment_machine_consumption(redis_db, vm_to_increment, mr.resource)
 
-        utilization_dict = {}
-        utilization_dict[mr.resource] = new_consumption
-        resource_datastore.write_machine_consumption(redis_db, vm_ip,  utilization_dict)
+# Recomputes the consumption of every machine from the committed MR allocations, e.g. when resuming
+# An improvement reserved before a crash but never checkpointed is not in mr_config, so its reservation is released
+# Instances that were recorded as unreserved (see on_container_started) count for nothing
+def reconcile_machine_consumption(redis_db, mr_config, quilt_overhead):
+    all_vms = get_actual_vms()
+    vm_to_capacity = resource_datastore.read_machine_capacities(redis_db, all_vms)
+    vm_to_expected = dict((vm_ip, dict((resource, (quilt_overhead / 100.0) * vm_to_capacity[vm_ip][resource])
+                                       for resource in vm_to_capacity[vm_ip])) for vm_ip in all_vms)
+    unreserved_instances = resource_datastore.read_unreserved_instances(redis_db)
+    for mr in mr_config:
+        mr_key = resource_datastore.generate_mr_key(mr.service_name, mr.resource)
+        for vm_ip,container_id in mr.instances:
+            if (mr_key, (vm_ip, container_id)) in unreserved_instances:
+                continue
+            if vm_ip in vm_to_expected:
+                vm_to_expected[vm_ip][mr.resource] = vm_to_expected[vm_ip].get(mr.resource, 0) + mr_config[mr]
+
+    vm_to_consumption = resource_datastore.read_machine_consumptions(redis_db, all_vms)
+    pipe = redis_db.pipeline()
+    for vm_ip in all_vms:
+        for resource in vm_to_expected[vm_ip]:
+            consumption = vm_to_consumption[vm_ip].get(resource, 0)
+            if abs(consumption - vm_to_expected[vm_ip][resource]) > 1e-6 * max(1.0, abs(consumption)):
+                print 'Reconciling the {} consumption of {} from {} to {}'.format(resource, vm_ip, consumption, vm_to_expected[vm_ip][resource])
+        resource_datastore.write_machine_consumption(pipe, vm_ip, vm_to_expected[vm_ip])
+    pipe.execute()
 
 # Updates the MR configuration from resource datastore
+# MRs are rebuilt so that they carry the current locations of their service
 def update_mr_config(redis_db, mr_in_play):
     updated_configuration = {}
     for mr in mr_in_play:
-        updated_configuration[mr] = resource_datastore.read_mr_alloc(redis_db, mr)
+        current_mr = tbot_datastore.generate_mr(redis_db, mr.service_name, mr.resource)
+        updated_configuration[current_mr] = resource_datastore.read_mr_alloc(redis_db, mr)
     return updated_configuration
 
+# Brings a container that joined a service to the current allocations of the service's MRs
+# Only the new container is actuated, the others already have these allocations
+# The allocation is only applied if the container's machine has the capacity for it,
+# otherwise the instance is recorded as unreserved in Redis
+def on_container_started(redis_db, service, location):
+    vm_ip,_ = location
+    mr_to_allocation = resource_datastore.read_all_mr_alloc(redis_db)
+    for mr in mr_to_allocation:
+        if mr.service_name != service:
+            continue
+        failing_vm = resource_datastore.reserve_machine_consumption(redis_db, {vm_ip: mr_to_allocation[mr]}, mr.resource)
+        if failing_vm is not None:
+            print 'WARNING: Not enough capacity on {} to give the new container of {} its allocation of {}'.format(failing_vm, mr.to_string(), mr_to_allocation[mr])
+            resource_datastore.add_unreserved_instance(redis_db, mr, location)
+            continue
+        set_mr_provision(mr, mr_to_allocation[mr])
+
+# Gives back the machine consumption of a container that left a service
+def on_container_stopped(redis_db, service, location):
+    vm_ip,_ = location
+    mr_to_allocation = resource_datastore.read_all_mr_alloc(redis_db)
+    for mr in mr_to_allocation:
+        if mr.service_name != service:
+            continue
+        # Instances that were never given their allocation have nothing to release
+        if resource_datastore.remove_unreserved_instance(redis_db, mr, location):
+            continue
+        resource_datastore.increment_machine_consumption(redis_db, {vm_ip: -mr_to_allocation[mr]}, mr.resource)
+
+# Degradation of mean_result relative to baseline_result, positive when performance got worse
+def get_degradation(mean_result, baseline_result, optimize_for_lowest):
+    if optimize_for_lowest:
+        return mean_result - baseline_result
+    return baseline_result - mean_result
+
+# UCB stress policy: ranks the MRs that were not stressed in this iteration
+# by the performance their estimated sensitivity predicts at stress_weight
+def rank_unmeasured_mrs(redis_db, measured_mrs, baseline_result, experiment_count, perf_metric, stress_weight, optimize_for_lowest):
+    unmeasured_mrs = [mr for mr in resource_datastore.get_all_mrs(redis_db) if mr not in measured_mrs]
+    mr_to_estimate = get_estimated_sensitivities(redis_db, unmeasured_mrs)
+    direction = 1 if optimize_for_lowest else -1
+    for mr in mr_to_estimate:
+        estimated_result = baseline_result + direction * mr_to_estimate[mr] * abs(baseline_result)
+        tbot_datastore.write_redis_ranking(redis_db, experiment_count, perf_metric, estimated_result, mr, stress_weight)
+    print 'Ranked {} MRs that were not stressed by their estimated sensitivity'.format(len(mr_to_estimate))
+
+# Runs the trials of an experiment that stresses mrs
+# The experiment is bracketed by samples of the MRs' VMs, to record what their instances consumed
+# Returns the experiment results and the sum of what the instances consumed, None if utilization is not sampled
+def measure_stressed_mrs(system_config, workload_config, mrs):
+    sampler = get_active_sampler()
+    if sampler is None:
+        return measure_trials(system_config, workload_config, system_config['trials']), None
+    instances = list(set(instance for mr in mrs for instance in mr.instances))
+    mr_vms = list(set(vm_ip for vm_ip,_ in instances))
+    start_time = sampler.snapshot(mr_vms)
+    experiment_results = measure_trials(system_config, workload_config, system_config['trials'])
+    utilization = sum_deltas(sampler.get_deltas(start_time, sampler.snapshot(mr_vms), instances))
+    return experiment_results, utilization
+
+# Stresses a single MR by stress_weight, measures it, and ranks it in Redis
+# With relative_ranking, the MR is ranked by its result divided by baseline_result,
+# so that MRs measured by different applications can be compared
+# The MR is left stressed; callers restore it
+# Returns the experiment results and their summary for tbot_metric
+def stress_mr_at_weight(redis_db, system_config, workload_config, mr, current_mr_allocation, stress_weight, baseline_result, experiment_count, relative_ranking=False):
+    preferred_performance_metric = workload_config['tbot_metric']
+    new_alloc = convert_percent_to_raw(mr, current_mr_allocation, stress_weight)
+    set_mr_provision(mr, new_alloc)
+
+    experiment_results,utilization = measure_stressed_mrs(system_config, workload_config, [mr])
+    if utilization is not None:
+        print 'Utilization of {} at {}: {}'.format(mr.to_string(), stress_weight, utilization)
+        tbot_datastore.write_experiment_utilization(redis_db, experiment_count, mr, preferred_performance_metric, stress_weight, utilization)
+    tbot_datastore.write_trial_count(redis_db, experiment_count, mr, preferred_performance_metric, stress_weight, len(experiment_results[preferred_performance_metric]))
+
+    #Write results of experiment to Redis
+    mean_result = summarize_performance(experiment_results, preferred_performance_metric)
+    ranked_result = mean_result
+    if relative_ranking and baseline_result != 0:
+        ranked_result = mean_result / baseline_result
+    tbot_datastore.write_redis_ranking(redis_db, experiment_count, preferred_performance_metric, ranked_result, mr, stress_weight)
+    if system_config['stress_policy'] == 'UCB' and stress_weight == min(system_config['stress_weights']) and baseline_result != 0:
+        degradation = get_degradation(mean_result, baseline_result, workload_config['optimize_for_lowest'])
+        tbot_datastore.write_mr_sensitivity(redis_db, mr, degradation / abs(baseline_result))
+    return experiment_results, mean_result
+
+# Stresses mr at every stress weight, restores it and writes its results to Redis
+# Every completed stress weight is checkpointed, and weights completed before a resume are skipped
+def stress_mr_all_weights(redis_db, system_config, workload_config, mr, current_mr_config, baseline_result, experiment_count, relative_ranking=False):
+    increment_to_performance = tbot_datastore.read_partial_results(redis_db, experiment_count, mr)
+    for stress_weight in system_config['stress_weights']:
+        if stress_weight in increment_to_performance:
+            print 'Reusing the checkpointed results of {} at {}'.format(mr.to_string(), stress_weight)
+            continue
+        experiment_results,_ = stress_mr_at_weight(redis_db, system_config, workload_config, mr, current_mr_config[mr],
+                                                   stress_weight, baseline_result, experiment_count, relative_ranking)
+        tbot_datastore.write_partial_result(redis_db, experiment_count, mr, stress_weight, experiment_results)
+        increment_to_performance[stress_weight] = experiment_results
+
+    # Remove the effect of the resource stressing
+    # Consecutive stress weights overwrite each other, so restoring once per MR suffices
+    restore_mr_config({mr: current_mr_config[mr]})
+
+    # Write the results of the iteration to Redis
+    tbot_datastore.write_redis_results(redis_db, mr, increment_to_performance, experiment_count, workload_config['tbot_metric'])
+    tbot_datastore.mark_mr_completed(redis_db, experiment_count, mr)
+
+# Maps every MR to the application (see the Application sections of the config) whose workload measures it
+# MRs of services that belong to no application are left out, and are therefore never stressed
+def get_mr_to_app(mr_list, applications):
+    service_to_app = {}
+    for app in applications:
+        for service in applications[app]['services']:
+            service_to_app[service] = app
+
+    mr_to_app = {}
+    for mr in mr_list:
+        if mr.service_name in service_to_app:
+            mr_to_app[mr] = service_to_app[mr.service_name]
+        else:
+            print 'WARNING: {} belongs to no application and will not be stressed'.format(mr.to_string())
+    return mr_to_app
+
+# Measures the baseline performance of every application
+def measure_app_baselines(system_config, applications):
+    app_to_baseline = {}
+    for app in applications:
+        app_to_baseline[app] = measure_trials(system_config, applications[app], system_config['baseline_trials'])
+    return app_to_baseline
+
+# Stresses every MR at every stress weight, running the experiments of MRs
+# of different applications on disjoint VMs at the same time (see experiment_scheduler)
+# MRs are ranked relative to the baseline of their application
+def stress_mrs_concurrently(redis_db, system_config, applications, mr_list, mr_to_app, current_mr_config, app_to_baseline_result, experiment_count):
+    def stress_mr(mr):
+        app = mr_to_app[mr]
+        stress_mr_all_weights(redis_db, system_config, applications[app], mr, current_mr_config,
+                              app_to_baseline_result[app], experiment_count, relative_ranking=True)
+
+    # The workload of an application goes through every one of its services, not only the stressed one
+    app_to_vms = {}
+    for app in applications:
+        app_to_vms[app] = set(vm_ip for service in applications[app]['services']
+                              for vm_ip,_ in tbot_datastore.get_service_locations(redis_db, service))
+
+    for batch in schedule_concurrent_batches(mr_list, mr_to_app, applications, app_to_vms):
+        print 'Stressing {} MRs concurrently: {}'.format(len(batch), [mr.to_string() for mr in batch])
+        run_concurrent_batch(batch, mr_to_app, applications, app_to_vms, stress_mr)
+
+# Successive halving sweep: every MR is stressed at the strongest stress weight,
+# and each lighter weight is only spent on the halving_fraction of the previous
+# round's MRs that degraded performance the most
+def sweep_successive_halving(redis_db, system_config, workload_config, mr_list, current_mr_config, baseline_result, experiment_count):
+    mr_to_increment_results = dict((mr, {}) for mr in mr_list)
+    candidate_mrs = list(mr_list)
+    for stress_weight in sorted(system_config['stress_weights']):
+        print 'Stressing {} MRs by {}'.format(len(candidate_mrs), stress_weight)
+        mr_to_degradation = {}
+        for mr in candidate_mrs:
+            experiment_results,mean_result = stress_mr_at_weight(redis_db, system_config, workload_config, mr, current_mr_config[mr],
+                                                                 stress_weight, baseline_result, experiment_count)
+            restore_mr_config({mr: current_mr_config[mr]})
+            mr_to_increment_results[mr][stress_weight] = experiment_results
+            mr_to_degradation[mr] = get_degradation(mean_result, baseline_result, workload_config['optimize_for_lowest'])
+
+        num_kept = max(1, int(math.ceil(system_config['halving_fraction'] * len(candidate_mrs))))
+        candidate_mrs = sorted(candidate_mrs, key=lambda mr: -mr_to_degradation[mr])[:num_kept]
+
+    # Write the results of the iteration to Redis, only with the weights each MR was stressed at
+    for mr in mr_list:
+        tbot_datastore.write_redis_results(redis_db, mr, mr_to_increment_results[mr], experiment_count, workload_config['tbot_metric'])
+
+# Throttles every MR of mr_group by stress_weight at once, measures, and restores them
+def stress_mr_group(system_config, workload_config, mr_group, current_mr_config, stress_weight):
+    for mr in mr_group:
+        set_mr_provision(mr, convert_percent_to_raw(mr, current_mr_config[mr], stress_weight))
+    experiment_results,utilization = measure_stressed_mrs(system_config, workload_config, mr_group)
+    restore_mr_config(dict((mr, current_mr_config[mr]) for mr in mr_group))
+    return experiment_results, utilization
+
+# GROUP stress policy: finds the MRs whose stressing degrades performance the most
+# by stressing groups of MRs together and recursively splitting the most degrading group.
+# Isolating one MR among n takes about 2 * log2(n) experiments instead of n.
+# Single MRs are written to the usual Redis ranking, so get_top_n_mimr works unchanged.
+def group_test_mrs(redis_db, system_config, workload_config, mr_candidates, current_mr_config, baseline_performance, experiment_count):
+    stress_weight = min(system_config['stress_weights'])
+    preferred_performance_metric = workload_config['tbot_metric']
+    baseline_result = summarize_performance(baseline_performance, preferred_performance_metric)
+
+    # Returns (-degradation, order measured, group), so that heaps and sorts put the most degrading group first
+    measured_order = itertools.count()
+    def measure_group(mr_group):
+        print 'Stressing a group of {} MRs: {}'.format(len(mr_group), [mr.to_string() for mr in mr_group])
+        experiment_results,utilization = stress_mr_group(system_config, workload_config, mr_group, current_mr_config, stress_weight)
+        mean_result = summarize_performance(experiment_results, preferred_performance_metric)
+        if utilization is not None:
+            print 'Utilization of the group at {}: {}'.format(stress_weight, utilization)
+            tbot_datastore.write_group_utilization(redis_db, experiment_count, mr_group, preferred_performance_metric, stress_weight, utilization)
+        if len(mr_group) == 1:
+            tbot_datastore.write_redis_ranking(redis_db, experiment_count, preferred_performance_metric, mean_result, mr_group[0], stress_weight)
+            tbot_datastore.write_trial_count(redis_db, experiment_count, mr_group[0], preferred_performance_metric, stress_weight, len(experiment_results[preferred_performance_metric]))
+            tbot_datastore.write_redis_results(redis_db, mr_group[0], {stress_weight: experiment_results}, experiment_count, preferred_performance_metric)
+        else:
+            tbot_datastore.write_redis_group_ranking(redis_db, experiment_count, preferred_performance_metric, mean_result, mr_group, stress_weight)
+
+        degradation = get_degradation(mean_result, baseline_result, workload_config['optimize_for_lowest'])
+        return (-degradation, next(measured_order), mr_group)
+
+    def measure_halves(mr_group):
+        return sorted(measure_group(half) for half in split_mr_group(mr_group) if len(half) > 0)
+
+    # Groups that were measured but not split yet
+    group_heap = measure_halves(mr_candidates)
+    num_isolated = 0
+    while len(group_heap) > 0 and num_isolated < GROUP_TEST_RESULTS:
+        group_entry = heapq.heappop(group_heap)
+        # Descend into the more degrading half until a single MR is left
+        # The other halves stay in the heap for the next isolation
+        while len(group_entry[2]) > 1:
+            halves = measure_halves(group_entry[2])
+            group_entry = halves[0]
+            for other_half in halves[1:]:
+                heapq.heappush(group_heap, other_half)
+        num_isolated += 1
+
+    print 'Group testing isolated {} MRs out of {} in {} experiments'.format(num_isolated, len(mr_candidates), next(measured_order))
+
 # Prints all improvements attempted by Throttlebot
 def print_all_steps(redis_db, total_experiments):
     print 'Steps towards improving performance'
+    iteration_to_summary = tbot_datastore.read_summaries(redis_db, range(total_experiments))
     for experiment_count in range(total_experiments):
-        mimr,action_taken,perf_improvement = tbot_datastore.read_summary_redis(redis_db, experiment_count)
+        mimr,action_taken,perf_improvement = iteration_to_summary[experiment_count]
         print 'Iteration {}, Mimr = {}, New allocation = {}, Performance Improvement = {}'.format(experiment_count, mimr, action_taken, perf_improvement)
 
 '''
@@ -180,10 +555,9 @@ workload_config: Parameters about the workload in a dict
 default_mr_config: Filtered MRs that should be stress along with their default allocation
 '''
 
-def run(system_config, workload_config, default_mr_config):
+def run(system_config, workload_config, default_mr_config, resume=False):
     redis_host = system_config['redis_host']
     baseline_trials = system_config['baseline_trials']
-    experiment_trials = system_config['trials']
     stress_weights = system_config['stress_weights']
     stress_policy = system_config['stress_policy']
     resource_to_stress = system_config['stress_these_resources']
@@ -194,58 +568,141 @@ def run(system_config, workload_config, default_mr_config):
     
     preferred_performance_metric = workload_config['tbot_metric']
     optimize_for_lowest = workload_config['optimize_for_lowest']
+    applications = workload_config['applications']
 
     redis_db = redis.StrictRedis(host=redis_host, port=6379, db=0)
-    redis_db.flushall()
 
-    # Initialize Redis and Cluster based on the default resource configuration
-    init_cluster_capacities_r(redis_db, machine_type, quilt_overhead)
-    init_service_placement_r(redis_db, default_mr_config)
-    init_resource_config(redis_db, default_mr_config, machine_type)
+    # Container events are read from here on, so that MRs follow containers that are replaced
+    # Containers that changed before are caught up with by reconcile, once the locations are in Redis
+    placement_watcher = None
+    if system_config['watch_placements']:
+        placement_watcher = PlacementWatcher(redis_db, get_actual_vms(),
+                                             on_start=lambda service, location: on_container_started(redis_db, service, location),
+                                             on_stop=lambda service, location: on_container_stopped(redis_db, service, location))
+        placement_watcher.sync()
 
-    # Run the baseline experiment
-    experiment_count = 0
-    baseline_performance = measure_baseline(workload_config, baseline_trials)
+    if resume:
+        # Allocations, machine consumption, rankings and summaries are kept in Redis
+        experiment_count,baselines = tbot_datastore.read_iteration_checkpoint(redis_db)
+        if experiment_count is None:
+            print 'No checkpoint to resume from in Redis at {}'.format(redis_host)
+            exit()
+        print 'Resuming at iteration {}'.format(experiment_count)
+        if placement_watcher is not None:
+            placement_watcher.reconcile()
+        current_mr_config = resource_datastore.read_all_mr_alloc(redis_db)
+        # An experiment may have been interrupted with an MR still stressed
+        # Only the instances whose limits differ from their allocation are actuated
+        seed_allocation_cache(current_mr_config)
+        restore_mr_config(current_mr_config)
+        # or an improvement with capacity reserved but not written
+        reconcile_machine_consumption(redis_db, current_mr_config, quilt_overhead)
+    else:
+        reset_redis(redis_db)
+        tbot_datastore.invalidate_placement_index()
+
+        # Initialize Redis and Cluster based on the default resource configuration
+        init_cluster_capacities_r(redis_db, machine_type, quilt_overhead)
+        init_service_placement_r(redis_db, default_mr_config)
+        init_resource_config(redis_db, default_mr_config)
+        if placement_watcher is not None:
+            placement_watcher.reconcile()
 
-    # Initialize the current configurations
-    # Invariant: MR are the same between iterations
-    current_mr_config = resource_datastore.read_all_mr_alloc(redis_db)
+        # Run the baseline experiment
+        # With applications, every application has its own baseline instead
+        experiment_count = 0
+        if len(applications) > 0:
+            baselines = measure_app_baselines(system_config, applications)
+        else:
+            baselines = {'': measure_trials(system_config, workload_config, baseline_trials)}
+        tbot_datastore.write_iteration_checkpoint(redis_db, experiment_count, baselines)
+
+        # Initialize the current configurations
+        # Invariant: MR are the same between iterations
+        current_mr_config = resource_datastore.read_all_mr_alloc(redis_db)
+
+    # The containers are sampled in the background from here on, annotating every stress experiment
+    if system_config['sample_utilization']:
+        sampler = UtilizationSampler(get_actual_vms(), system_config['sample_interval'])
+        sampler.start()
+        set_active_sampler(sampler)
+
+    if len(applications) > 0:
+        mr_to_app = get_mr_to_app(resource_datastore.get_all_mrs(redis_db), applications)
+        app_to_baseline = baselines
+        baseline_performance = None
+    else:
+        baseline_performance = baselines['']
 
     while experiment_count < 10:
+        if placement_watcher is not None:
+            placement_watcher.sync()
+            current_mr_config = update_mr_config(redis_db, current_mr_config)
+
         # Get a list of MRs to stress in the form of a list of MRs
-        mr_to_stress = generate_mr_from_policy(redis_db, stress_policy)
+        # The list is checkpointed, so that a resumed iteration stresses the same MRs
+        mr_to_stress = tbot_datastore.read_stress_plan(redis_db, experiment_count)
+        if mr_to_stress is None:
+            mr_to_stress = generate_mr_from_policy(redis_db, stress_policy)
+            tbot_datastore.write_stress_plan(redis_db, experiment_count, mr_to_stress)
         print mr_to_stress
-        
-        for mr in mr_to_stress:
+        completed_mrs = tbot_datastore.read_completed_mrs(redis_db, experiment_count)
+
+        if stress_policy == 'GROUP':
+            group_test_mrs(redis_db, system_config, workload_config, mr_to_stress, current_mr_config, baseline_performance, experiment_count)
+            mr_to_stress = []
+
+        max_stress_weight = min(stress_weights)
+        if len(applications) > 0:
+            # MRs are ranked relative to the baseline of their application
+            baseline_result = 1.0
+            app_to_baseline_result = dict((app, summarize_performance(app_to_baseline[app], preferred_performance_metric)) for app in applications)
+            if len(completed_mrs) > 0:
+                print 'Skipping {} MRs completed before resuming'.format(len(completed_mrs))
+            stress_mrs_concurrently(redis_db, system_config, applications,
+                                    [mr for mr in mr_to_stress if mr in mr_to_app and mr.to_string() not in completed_mrs],
+                                    mr_to_app, current_mr_config, app_to_baseline_result, experiment_count)
+            mr_to_stress_individually = []
+        elif system_config['sweep_mode'] == 'halving' and len(mr_to_stress) > 0:
+            baseline_result = summarize_performance(baseline_performance, preferred_performance_metric)
+            sweep_successive_halving(redis_db, system_config, workload_config, mr_to_stress, current_mr_config, baseline_result, experiment_count)
+            mr_to_stress_individually = []
+        else:
+            baseline_result = summarize_performance(baseline_performance, preferred_performance_metric)
+            mr_to_stress_individually = mr_to_stress
+
+        for mr in mr_to_stress_individually:
+            if mr.to_string() in completed_mrs:
+                print 'Skipping {}, completed before resuming'.format(mr.to_string())
+                continue
+            # The stress plan may predate the latest container events
+            if placement_watcher is not None:
+                placement_watcher.sync()
+                mr = tbot_datastore.generate_mr(redis_db, mr.service_name, mr.resource)
             print 'Current MR is {}'.format(mr.to_string())
-            increment_to_performance = {}
-            current_mr_allocation = resource_datastore.read_mr_alloc(redis_db, mr)
-            print 'Current MR allocation is {}'.format(current_mr_allocation)
-            for stress_weight in stress_weights:
-                new_alloc = convert_percent_to_raw(mr, current_mr_allocation, stress_weight)
-                set_mr_provision(mr, new_alloc)
-                experiment_results = measure_runtime(workload_config, experiment_trials)
-
-                #Write results of experiment to Redis
-                mean_result = float(sum(experiment_results[preferred_performance_metric])) / len(experiment_results[preferred_performance_metric])
-                tbot_datastore.write_redis_ranking(redis_db, experiment_count, preferred_performance_metric, mean_result, mr, stress_weight)
-                
-                # Remove the effect of the resource stressing
-                new_alloc = convert_percent_to_raw(mr, current_mr_allocation, 0)
-                increment_to_performance[stress_weight] = experiment_results
+            print 'Current MR allocation is {}'.format(current_mr_config[mr])
+            stress_mr_all_weights(redis_db, system_config, workload_config, mr, current_mr_config, baseline_result, experiment_count)
+
+        if stress_policy == 'UCB':
+            rank_unmeasured_mrs(redis_db, mr_to_stress, baseline_result, experiment_count,
+                                preferred_performance_metric, max_stress_weight, optimize_for_lowest)
 
-            # Write the results of the iteration to Redis
-            tbot_datastore.write_redis_results(redis_db, mr, increment_to_performance, experiment_count, preferred_performance_metric)
-        
         # Recover the results of the experiment from Redis
-        max_stress_weight = min(stress_weights)
+        # The MIMRs are rebuilt with the locations of their services after the latest events
+        if placement_watcher is not None:
+            placement_watcher.sync()
         mimr_list = tbot_datastore.get_top_n_mimr(redis_db, experiment_count, preferred_performance_metric, max_stress_weight, 
                                    optimize_for_lowest=optimize_for_lowest, num_results_returned=10)
         
         # Try all the MIMRs in the list until a viable improvement is determined
         # Improvement Amount
-        mimr = None
-        action_taken = 0
+        # If the MIMR was improved before resuming, it must not be improved twice
+        mimr,action_taken = tbot_datastore.read_improvement_checkpoint(redis_db, experiment_count)
+        if mimr is not None:
+            print 'MIMR {} was improved before resuming'.format(mimr.to_string())
+            mimr_list = []
+        else:
+            action_taken = 0
         print 'The MR improvement is {}'.format(max_stress_weight)
         for mr_score in mimr_list:
             mr,score = mr_score
@@ -254,36 +711,58 @@ def run(system_config, workload_config, default_mr_config):
             new_alloc = convert_percent_to_raw(mr, current_mr_allocation, improvement_percent)
             improvement_amount = new_alloc - current_mr_allocation
             action_taken = improvement_amount
-            if check_improve_mr_viability(redis_db, mr, improvement_amount):
-                set_mr_provision(mr, new_alloc)
+            failing_vm = reserve_mr_improvement(redis_db, mr, improvement_amount)
+            if failing_vm is None:
+                try:
+                    set_mr_provision(mr, new_alloc)
+                except:
+                    # Give back the reservation, the MR keeps its old allocation
+                    update_machine_consumption(redis_db, mr, current_mr_allocation, new_alloc)
+                    raise
                 print 'Improvement Calculated: MR {} increase from {} to {}'.format(mr.to_string(), current_mr_allocation, new_alloc)
-                old_alloc = resource_datastore.read_mr_alloc(redis_db, mr)
-                resource_datastore.write_mr_alloc(redis_db, mr, new_alloc)
-                update_machine_consumption(redis_db, mr, new_alloc, old_alloc)
+                # The allocation and the checkpoint are written in one transaction, so a resumed
+                # iteration either sees both or neither (see reconcile_machine_consumption)
+                pipe = redis_db.pipeline()
+                resource_datastore.write_mr_alloc(pipe, mr, new_alloc)
+                # The sensitivity measured before the improvement no longer applies
+                tbot_datastore.reset_mr_sensitivity(pipe, mr)
+                tbot_datastore.write_improvement_checkpoint(pipe, experiment_count, mr, action_taken)
+                pipe.execute()
                 current_mr_config = update_mr_config(redis_db, current_mr_config)
                 mimr = mr
                 break
             else:
-                print 'Improvement Calculated: MR {} failed to improve from {} to {}'.format(mr.to_string(), current_mr_allocation, new_alloc)
+                print 'Improvement Calculated: MR {} failed to improve from {} to {}, not enough capacity on {}'.format(mr.to_string(), current_mr_allocation, new_alloc, failing_vm)
                 
         if mimr is None:
             print 'No viable improvement found'
             break
 
         #Compare against the baseline at the beginning of the program
-        improved_performance = measure_runtime(workload_config, baseline_trials)
+        #With applications, only the application of the MIMR is affected by the improvement
+        if len(applications) > 0:
+            mimr_app = mr_to_app[mimr]
+            improved_performance = measure_trials(system_config, applications[mimr_app], baseline_trials)
+            baseline_mean = summarize_performance(app_to_baseline[mimr_app], preferred_performance_metric)
+            app_to_baseline[mimr_app] = improved_performance
+        else:
+            improved_performance = measure_trials(system_config, workload_config, baseline_trials)
+            baseline_mean = summarize_performance(baseline_performance, preferred_performance_metric)
+            baseline_performance = improved_performance
         print improved_performance
-        improved_mean = sum(improved_performance[preferred_performance_metric]) / float(len(improved_performance[preferred_performance_metric]))
-        baseline_mean = sum(baseline_performance[preferred_performance_metric]) / float(len(baseline_performance[preferred_performance_metric]))                                                                           
+        improved_mean = summarize_performance(improved_performance, preferred_performance_metric)
         performance_improvement = improved_mean - baseline_mean
         
         # Write a summary of the experiment's iterations to Redis
         tbot_datastore.write_summary_redis(redis_db, experiment_count, mimr, performance_improvement, action_taken) 
-        baseline_performance = improved_performance
 
         results = tbot_datastore.read_summary_redis(redis_db, experiment_count)
         print 'Results from iteration {} are {}'.format(experiment_count, results)
         experiment_count += 1
+        if len(applications) > 0:
+            tbot_datastore.write_iteration_checkpoint(redis_db, experiment_count, app_to_baseline)
+        else:
+            tbot_datastore.write_iteration_checkpoint(redis_db, experiment_count, {'': baseline_performance})
         
         # TODO: Handle False Positive
         # TODO: Compare against performance condition -- for now only do some number of experiments
@@ -293,6 +772,26 @@ def run(system_config, workload_config, default_mr_config):
     for mr in current_mr_config:
         print '{} = {}'.format(mr.to_string(), current_mr_config[mr])
 
+    cache_stats = allocation_cache.get_cache_stats()
+    print 'Provisioning requests: {} total, {} skipped as no-ops; {} instances actuated, {} skipped'.format(cache_stats['requests'], cache_stats['skipped'], cache_stats['instances_applied'], cache_stats['instances_skipped'])
+    client_stats = get_client_stats()
+    print 'Remote connections: {} opened, {} reused, {} reconnected'.format(client_stats['opened'], client_stats['reused'], client_stats['reconnected'])
+    inventory_stats = get_inventory().get_stats()
+    print 'Cluster inventory: {} VM list loads, {} service list loads, {} VMs discovered, {} cache hits'.format(inventory_stats['vm_loads'], inventory_stats['service_loads'], inventory_stats['vms_discovered'], inventory_stats['hits'])
+    sampler = get_active_sampler()
+    if sampler is not None:
+        sampler.stop()
+        set_active_sampler(None)
+        sampler_stats = sampler.get_stats()
+        print 'Utilization samples: {} taken, {} failed'.format(sampler_stats['samples'], sampler_stats['errors'])
+    if placement_watcher is not None:
+        watcher_stats = placement_watcher.get_stats()
+        print 'Container events: {} applied over {} polls, {} locations added, {} removed'.format(watcher_stats['events'], watcher_stats['polls'], watcher_stats['added'], watcher_stats['removed'])
+    settle_stats = get_settle_stats()
+    for resource in settle_stats:
+        print 'Actuation settle time for {}: mean {:.3f}s, max {:.3f}s over {} changes ({} timed out)'.format(resource, settle_stats[resource]['mean'], settle_stats[resource]['max'], settle_stats[resource]['count'], settle_stats[resource]['timeouts'])
+    close_all_clients()
+
 '''
 Functions to parse configuration files
 Parses Throttlebot config file and the Resource Allocation Configuration File
@@ -318,6 +817,67 @@ def parse_config_file(config_file):
     sys_config['stress_policy'] = config.get('Basic', 'stress_policy')
     sys_config['machine_type'] = config.get('Basic', 'machine_type')
     sys_config['quilt_overhead'] = config.getint('Basic', 'quilt_overhead')
+
+    # Optional: how to reach the VMs (ssh or agent), defaults to ssh
+    sys_config['remote_backend'] = 'ssh'
+    sys_config['agent_port'] = 4545
+    sys_config['agent_token'] = ''
+    if config.has_option('Basic', 'remote_backend'):
+        sys_config['remote_backend'] = config.get('Basic', 'remote_backend')
+    if config.has_option('Basic', 'agent_port'):
+        sys_config['agent_port'] = config.getint('Basic', 'agent_port')
+    if config.has_option('Basic', 'agent_token'):
+        sys_config['agent_token'] = config.get('Basic', 'agent_token')
+    sys_config['simulation_spec'] = None
+    if config.has_option('Basic', 'simulation_spec'):
+        sys_config['simulation_spec'] = config.get('Basic', 'simulation_spec')
+
+    # Optional: where the VMs and services are listed (quilt or static), defaults to quilt
+    sys_config['inventory'] = 'quilt'
+    sys_config['inventory_file'] = None
+    sys_config['inventory_ttl'] = 60
+    if config.has_option('Basic', 'inventory'):
+        sys_config['inventory'] = config.get('Basic', 'inventory')
+    if config.has_option('Basic', 'inventory_file'):
+        sys_config['inventory_file'] = config.get('Basic', 'inventory_file')
+    if config.has_option('Basic', 'inventory_ttl'):
+        sys_config['inventory_ttl'] = config.getfloat('Basic', 'inventory_ttl')
+
+    # Optional: sample the resource consumption of the containers every sample_interval seconds
+    sys_config['sample_utilization'] = False
+    sys_config['sample_interval'] = 1.0
+    if config.has_option('Basic', 'sample_utilization'):
+        sys_config['sample_utilization'] = config.getboolean('Basic', 'sample_utilization')
+    if config.has_option('Basic', 'sample_interval'):
+        sys_config['sample_interval'] = config.getfloat('Basic', 'sample_interval')
+
+    # Optional: follow containers that are replaced, by reading the Docker events of every VM
+    sys_config['watch_placements'] = False
+    if config.has_option('Basic', 'watch_placements'):
+        sys_config['watch_placements'] = config.getboolean('Basic', 'watch_placements')
+
+    # Optional: how stress weights are swept (full or halving)
+    sys_config['sweep_mode'] = 'full'
+    sys_config['halving_fraction'] = 0.5
+    if config.has_option('Basic', 'sweep_mode'):
+        sys_config['sweep_mode'] = config.get('Basic', 'sweep_mode')
+    if config.has_option('Basic', 'halving_fraction'):
+        sys_config['halving_fraction'] = config.getfloat('Basic', 'halving_fraction')
+
+    # Optional: keep adding trials until the confidence interval of tbot_metric is
+    # within ci_tolerance of its mean (trials and baseline_trials are then unused)
+    sys_config['adaptive_trials'] = False
+    sys_config['min_trials'] = 3
+    sys_config['max_trials'] = max(sys_config['trials'], sys_config['baseline_trials'])
+    sys_config['ci_tolerance'] = 0.05
+    if config.has_option('Basic', 'adaptive_trials'):
+        sys_config['adaptive_trials'] = config.getboolean('Basic', 'adaptive_trials')
+    if config.has_option('Basic', 'min_trials'):
+        sys_config['min_trials'] = config.getint('Basic', 'min_trials')
+    if config.has_option('Basic', 'max_trials'):
+        sys_config['max_trials'] = config.getint('Basic', 'max_trials')
+    if config.has_option('Basic', 'ci_tolerance'):
+        sys_config['ci_tolerance'] = config.getfloat('Basic', 'ci_tolerance')
         
     #Configuration Parameters relating to workload
     workload_config['type'] = config.get('Workload', 'type')
@@ -335,6 +895,29 @@ def parse_config_file(config_file):
     for arg_index in range(len(workload_args)):
         additional_args_dict[workload_args[arg_index]] = workload_arg_vals[arg_index]
     workload_config['additional_args'] = additional_args_dict
+
+    # Optional: independent applications, each measured by its own workload in an [Application <name>] section
+    # An application section lists its services and overrides any of the [Workload] keys
+    # except tbot_metric and optimize_for_lowest, which are shared so that MRs can be ranked together
+    workload_config['applications'] = {}
+    if config.has_option('Basic', 'applications'):
+        for app in config.get('Basic', 'applications').split(','):
+            section = 'Application {}'.format(app)
+            app_workload_config = dict(workload_config)
+            app_workload_config['applications'] = {}
+            app_workload_config['services'] = config.get(section, 'services').split(',')
+            for option in ['type', 'performance_target']:
+                if config.has_option(section, option):
+                    app_workload_config[option] = config.get(section, option)
+            for option in ['request_generator', 'frontend']:
+                if config.has_option(section, option):
+                    app_workload_config[option] = config.get(section, option).split(',')
+            if config.has_option(section, 'additional_args'):
+                app_args = config.get(section, 'additional_args').split(',')
+                app_arg_vals = config.get(section, 'additional_arg_values').split(',')
+                assert len(app_args) == len(app_arg_vals)
+                app_workload_config['additional_args'] = dict(zip(app_args, app_arg_vals))
+            workload_config['applications'][app] = app_workload_config
     return sys_config, workload_config
 
 # Parse a default resource configuration
@@ -342,7 +925,7 @@ def parse_config_file(config_file):
 # This should be ONLY TIME the machines are queried directly -- remaining calls
 # should be conducted from Redis
 #
-# Returns a mapping of a MR to its current resource allocation (percentage amount)
+# Returns a mapping of a MR to its default allocation, in percent of the machine capacity
 def parse_resource_config_file(resource_config):
     vm_list = get_actual_vms()
     all_services = get_actual_services()
@@ -365,13 +948,23 @@ def parse_resource_config_file(resource_config):
         default_alloc_percentage = 50.0 / max_num_services
         mr_list = get_all_mrs_cluster(vm_list, all_services, all_resources)
         for mr in mr_list:
-            mr_allocation[mr] = -1 * default_alloc_percentage
+            mr_allocation[mr] = default_alloc_percentage
     else:
         # Manual Configuration possible here, to be implemented
         print 'Placeholder for a way to configure the resources'
 
     return mr_allocation
 
+# Selects how the VMs are reached, loading the simulated cluster if requested,
+# and where they are listed
+def init_remote_backend(sys_config):
+    simulated_cluster = None
+    if sys_config['remote_backend'] == 'simulated':
+        simulated_cluster = load_cluster(sys_config['simulation_spec'])
+    set_remote_backend(sys_config['remote_backend'], sys_config['agent_port'],
+                       sys_config['agent_token'], simulated_cluster)
+    set_inventory(sys_config['inventory'], sys_config['inventory_file'], sys_config['inventory_ttl'])
+
 # Throttlebot allows regex * to represent ALL
 def resolve_config_wildcards(sys_config, workload_config):
     if sys_config['stress_these_services'][0] == '*':
@@ -381,10 +974,39 @@ def resolve_config_wildcards(sys_config, workload_config):
 
 def validate_configs(sys_config, workload_config):
     #Validate Address related configuration arguments
-    validate_ip([sys_config['redis_host']])
+    #Redis may also be given as a hostname, such as localhost
+    validate_host(sys_config['redis_host'])
     validate_ip(workload_config['frontend'])
     validate_ip(workload_config['request_generator'])
 
+    if sys_config['remote_backend'] not in ['ssh', 'agent', 'simulated']:
+        print 'Invalid remote backend: {}'.format(sys_config['remote_backend'])
+        exit()
+
+    if sys_config['inventory'] not in ['quilt', 'static', 'simulated']:
+        print 'Invalid inventory: {}'.format(sys_config['inventory'])
+        exit()
+
+    if sys_config['inventory'] == 'static' and sys_config['inventory_file'] is None:
+        print 'The static inventory requires an inventory_file'
+        exit()
+
+    if sys_config['sweep_mode'] not in ['full', 'halving']:
+        print 'Invalid sweep mode: {}'.format(sys_config['sweep_mode'])
+        exit()
+
+    if len(workload_config['applications']) > 0:
+        if sys_config['stress_policy'] not in ['ALL', 'UCB'] or sys_config['sweep_mode'] != 'full':
+            print 'Applications can only be stressed with the ALL or UCB policies and the full sweep mode'
+            exit()
+        for app in workload_config['applications']:
+            validate_ip(workload_config['applications'][app]['frontend'])
+            validate_ip(workload_config['applications'][app]['request_generator'])
+
+    if sys_config['adaptive_trials'] and not 2 <= sys_config['min_trials'] <= sys_config['max_trials']:
+        print 'Adaptive trials need 2 <= min_trials <= max_trials'
+        exit()
+
     for resource in sys_config['stress_these_resources'] :
         if resource in ['CPU-CORE', 'CPU-QUOTA', 'DISK', 'NET', '*']:
             continue
@@ -397,9 +1019,16 @@ def validate_ip(ip_addresses):
         try:
             socket.inet_aton(ip)
         except:
-            print 'The IP Address is Invalid'.format(ip)
+            print 'The IP Address {} is Invalid'.format(ip)
             exit()
 
+def validate_host(host):
+    try:
+        socket.gethostbyname(host)
+    except socket.error:
+        print 'The host {} cannot be resolved'.format(host)
+        exit()
+
 # Filter out resources, services, and machines that shouldn't be stressed on this iteration
 # Automatically Filter out Quilt-specific modules
 def filter_mr(mr_allocation, acceptable_resources, acceptable_services, acceptable_machines):
@@ -429,9 +1058,12 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--config_file", help="Configuration File for Throttlebot Execution")
     parser.add_argument("--resource_config", help='Default Resource Allocation for Throttlebot')
+    parser.add_argument("--resume", action="store_true", help='Resume the run checkpointed in Redis instead of starting over')
     args = parser.parse_args()
     
     sys_config, workload_config = parse_config_file(args.config_file)
+    validate_configs(sys_config, workload_config)
+    init_remote_backend(sys_config)
     mr_allocation = parse_resource_config_file(args.resource_config)
     
     # While stress policies can further filter MRs, the first filter is applied here
@@ -442,5 +1074,5 @@ if __name__ == "__main__":
                               sys_config['stress_these_services'],
                               sys_config['stress_these_machines'])
 
-    run(sys_config, workload_config, mr_allocation)
+    run(sys_config, workload_config, mr_allocation, resume=args.resume)
 
@@ -0,0 +1,449 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+
+from latency_histogram import LatencyHistogram
+
+'''
+In-process simulation of a Quilt cluster, used to run and profile
+Throttlebot without real VMs.
+
+SimulatedClient answers the docker, cgroup and OVS commands that
+Throttlebot sends through exec_command and records the resulting
+allocation of every container. The performance of the simulated
+application is derived from those allocations with a configurable
+response curve per MR, plus multiplicative noise.
+
+A cluster is described by a JSON spec:
+{
+  "seed": 0,
+  "vms": ["10.0.0.1", "10.0.0.2"],
+  "services": {"nginx:1.10": ["10.0.0.1", "10.0.0.2"]},
+  "machines": {"10.0.0.2": {"cores": 8}},
+  "base_latency": 100.0,
+  "noise": 0.02,
+  "curves": {"nginx:1.10,CPU-QUOTA": {"weight": 50.0, "reference": 50.0, "exponent": 1.0}}
+}
+The latency contribution of an MR is weight * (reference / allocation) ** exponent,
+so an MR throttled to half its reference allocation adds twice its weight.
+MRs without a curve do not affect performance. VMs missing from machines
+have the hardware of DEFAULT_MACHINE.
+'''
+
+NUM_CORES = 4
+
+# Resource units follow the raw values set by run_throttlebot.set_mr_provision
+# Requests simulated per trial, and the spread of their latencies around the trial latency
+REQUESTS_PER_TRIAL = 200
+REQUEST_LATENCY_SIGMA = 0.35
+
+# disk_bps in bytes/sec, net_bps in bits/sec
+DEFAULT_MACHINE = {'cores': NUM_CORES, 'disk_bps': 200000000, 'net_bps': 1000000000}
+
+DEFAULT_REFERENCE = {'CPU-QUOTA': 50.0, 'CPU-CORE': 2.0, 'DISK': 50000000.0, 'NET': 300000000.0}
+
+docker_update_pattern = re.compile(r'docker update (.*) (\S+)$')
+blkio_pattern = re.compile(r'echo "\S+ (\d+)" \| sudo tee /sys/fs/cgroup/blkio/docker/(\w+)\*/blkio\.throttle\.(read|write)_bps_device')
+ovs_rate_pattern = re.compile(r'ovs-vsctl set interface (\S+) ingress_policing_rate=(\d+)')
+inspect_pattern = re.compile(r'docker inspect (\S+)')
+cpu_readback_pattern = re.compile(r'echo "(\w+) \$\(docker inspect --format \'\{\{\.HostConfig\.CpuQuota\}\} \{\{\.HostConfig\.CpusetCpus\}\}\'')
+blkio_readback_pattern = re.compile(r'grep \'\^202:0 \' /sys/fs/cgroup/blkio/docker/(\w+)\*/')
+disk_count_pattern = re.compile(r'bs=1M count=(\d+)')
+ovs_readback_pattern = re.compile(r'ovs-vsctl get interface (\S+) ingress_policing_rate')
+
+class SimulatedCluster:
+    def __init__(self, spec):
+        self.random = random.Random(spec.get('seed', 0))
+        self.base_latency = float(spec.get('base_latency', 100.0))
+        self.noise = float(spec.get('noise', 0.0))
+        self.curves = spec.get('curves', {})
+        self.vm_ips = list(spec['vms'])
+        # vm_ip -> hardware, for the VMs that differ from DEFAULT_MACHINE
+        self.machines = spec.get('machines', {})
+        self.lock = threading.Lock()
+        self.commands_executed = 0
+
+        # vm_ip -> [(container_id, service_name)]
+        self.containers = dict((vm_ip, []) for vm_ip in self.vm_ips)
+        # container_id -> service_name
+        self.container_service = {}
+        # container_id -> vm_ip
+        self.container_vm = {}
+        # service_name -> [container_id]
+        self.service_containers = {}
+        # veth interface name -> container_id
+        self.veth_to_container = {}
+        # (container_id, resource) -> raw allocation
+        self.allocations = {}
+        # (container_id, setting) -> value as written by the actuation commands
+        # Settings are cpu_quota, cpuset, blkio and ovs_rate
+        self.settings = {}
+
+        # container_id -> consumption counters, see record_usage
+        self.usage = {}
+
+        # vm_ip -> docker events not yet read, see restart_container
+        self.events = dict((vm_ip, []) for vm_ip in self.vm_ips)
+        self.event_clock = 0
+
+        self.container_count = 0
+        for service_name in sorted(spec['services']):
+            for vm_ip in spec['services'][service_name]:
+                self.add_container(vm_ip, service_name)
+
+    def add_container(self, vm_ip, service_name):
+        container_id = '{:012x}'.format(self.container_count)
+        self.container_count += 1
+        self.containers[vm_ip].append((container_id, service_name))
+        self.container_service[container_id] = service_name
+        self.container_vm[container_id] = vm_ip
+        self.service_containers.setdefault(service_name, []).append(container_id)
+        self.veth_to_container[self.get_veth(container_id)] = container_id
+        return container_id
+
+    def remove_container(self, container_id):
+        vm_ip = self.container_vm.pop(container_id)
+        service_name = self.container_service.pop(container_id)
+        self.containers[vm_ip].remove((container_id, service_name))
+        self.service_containers[service_name].remove(container_id)
+        self.veth_to_container.pop(self.get_veth(container_id), None)
+        for key in [key for key in self.allocations if key[0] == container_id]:
+            del self.allocations[key]
+        for key in [key for key in self.settings if key[0] == container_id]:
+            del self.settings[key]
+        self.usage.pop(container_id, None)
+        return service_name
+
+    def record_event(self, vm_ip, action, container_id, service_name):
+        self.event_clock += 1
+        self.events[vm_ip].append({'Type': 'container', 'Action': action, 'status': action,
+                                   'id': self.get_full_id(container_id), 'from': service_name,
+                                   'Actor': {'ID': self.get_full_id(container_id), 'Attributes': {'image': service_name}},
+                                   'time': self.event_clock, 'timeNano': self.event_clock})
+
+    # Replaces a container by a new, unthrottled one of the same service on the same VM,
+    # as an orchestrator would after a crash. Returns the id of the new container
+    def restart_container(self, container_id):
+        with self.lock:
+            vm_ip = self.container_vm[container_id]
+            service_name = self.remove_container(container_id)
+            self.record_event(vm_ip, 'die', container_id, service_name)
+            new_container_id = self.add_container(vm_ip, service_name)
+            self.record_event(vm_ip, 'start', new_container_id, service_name)
+        return new_container_id
+
+    # Returns and forgets the events of a VM not read yet
+    def read_events(self, vm_ip):
+        with self.lock:
+            events, self.events[vm_ip] = self.events[vm_ip], []
+            return events, self.event_clock
+
+    # Hardware of a VM: cores, disk_bps (bytes/sec) and net_bps (bits/sec)
+    def get_machine(self, vm_ip):
+        machine = dict(DEFAULT_MACHINE)
+        machine.update(self.machines.get(vm_ip, {}))
+        return machine
+
+    def get_services(self):
+        return sorted(self.service_containers.keys())
+
+    def get_client(self, vm_ip):
+        if vm_ip not in self.containers:
+            raise ValueError('No simulated VM with IP {}'.format(vm_ip))
+        return SimulatedClient(self, vm_ip)
+
+    # Interface names are at most 15 characters, the end of the ID tells containers apart
+    def get_veth(self, container_id):
+        return 'veth' + container_id[-11:]
+
+    # Untruncated ID, as shown by docker ps --no-trunc
+    def get_full_id(self, container_id):
+        return container_id.ljust(64, '0')
+
+    def set_allocation(self, container_id, resource, value):
+        with self.lock:
+            self.allocations[(container_id, resource)] = float(value)
+
+    def clear_allocation(self, container_id, resource):
+        with self.lock:
+            self.allocations.pop((container_id, resource), None)
+
+    def set_setting(self, container_id, setting, value):
+        with self.lock:
+            self.settings[(container_id, setting)] = value
+
+    def get_setting(self, container_id, setting, default):
+        with self.lock:
+            return self.settings.get((container_id, setting), default)
+
+    def get_allocation(self, container_id, resource):
+        with self.lock:
+            return self.allocations.get((container_id, resource))
+
+    # Mean allocation of an MR over all of its containers
+    # Unthrottled containers count as being at the reference allocation
+    def get_mr_allocation(self, service_name, resource, reference):
+        with self.lock:
+            values = [self.allocations.get((container_id, resource), reference)
+                      for container_id in self.service_containers.get(service_name, [])]
+        if len(values) == 0:
+            return reference
+        return sum(values) / len(values)
+
+    # Noise-free latency given the current allocations
+    # If services is given, only the MRs of those services contribute
+    def expected_latency(self, services=None):
+        latency = self.base_latency
+        for mr_key in self.curves:
+            service_name, resource = mr_key.split(',')
+            if services is not None and service_name not in services:
+                continue
+            curve = self.curves[mr_key]
+            reference = float(curve.get('reference', DEFAULT_REFERENCE[resource]))
+            allocation = self.get_mr_allocation(service_name, resource, reference)
+            if allocation <= 0:
+                allocation = reference / 1000.0
+            latency += float(curve['weight']) * (reference / allocation) ** float(curve.get('exponent', 1.0))
+        return latency
+
+    # Returns a dict of metric -> list of per-trial values, like run_experiment.measure_runtime
+    # Each trial simulates REQUESTS_PER_TRIAL requests whose latencies are
+    # log-normally distributed around the (noisy) latency of the trial
+    def measure(self, experiment_iterations, services=None):
+        all_requests = {'rps': [], 'latency': [], 'latency_50': [], 'latency_90': [], 'latency_99': [], 'histograms': []}
+        expected = self.expected_latency(services)
+        for x in range(experiment_iterations):
+            histogram = LatencyHistogram()
+            with self.lock:
+                latency = expected * max(0.01, self.random.gauss(1.0, self.noise))
+                for request in range(REQUESTS_PER_TRIAL):
+                    histogram.record(latency * self.random.lognormvariate(0, REQUEST_LATENCY_SIGMA))
+            all_requests['latency'].append(latency)
+            all_requests['latency_50'].append(histogram.percentile(50))
+            all_requests['latency_90'].append(histogram.percentile(90))
+            all_requests['latency_99'].append(histogram.percentile(99))
+            all_requests['rps'].append(1000.0 / latency)
+            all_requests['histograms'].append(histogram)
+        self.record_usage(experiment_iterations)
+        return all_requests
+
+    # Advances the consumption counters of every container by seconds of load,
+    # during which each container uses its allocation up to its reference allocation
+    # and is throttled for the CPU it would have used above its allocation
+    def record_usage(self, seconds):
+        with self.lock:
+            for container_id in self.container_service:
+                service_name = self.container_service[container_id]
+                used = {}
+                reference = {}
+                for resource in ['CPU-QUOTA', 'DISK', 'NET']:
+                    curve = self.curves.get('{},{}'.format(service_name, resource), {})
+                    reference[resource] = float(curve.get('reference', DEFAULT_REFERENCE[resource]))
+                    used[resource] = min(reference[resource], self.allocations.get((container_id, resource), reference[resource]))
+                # cpu usage ns, cpu throttled ns, disk bytes, net bytes out, net bytes in
+                usage = self.usage.setdefault(container_id, [0.0] * 5)
+                usage[0] += used['CPU-QUOTA'] / 100.0 * 10 ** 9 * seconds
+                usage[1] += (reference['CPU-QUOTA'] - used['CPU-QUOTA']) / 100.0 * 10 ** 9 * seconds
+                usage[2] += used['DISK'] * seconds
+                usage[3] += used['NET'] / 8.0 * seconds
+                usage[4] += used['NET'] / 8.0 * seconds
+
+class SimulatedStream:
+    def __init__(self, data):
+        self.data = data
+
+    def read(self):
+        data, self.data = self.data, ''
+        return data
+
+    def readlines(self):
+        return self.read().splitlines(True)
+
+class SimulatedClient:
+    '''
+    Stand-in for a paramiko SSHClient connected to one simulated VM
+    '''
+    def __init__(self, cluster, vm_ip):
+        self.cluster = cluster
+        self.vm_ip = vm_ip
+        # Size of the file written by the disk benchmark
+        self.disk_bytes = 0
+
+    def exec_command(self, cmd):
+        with self.cluster.lock:
+            self.cluster.commands_executed += 1
+        # The sampling script of utilization_sampler is answered as a whole
+        if cmd.startswith('echo "sample|'):
+            return None, SimulatedStream(self.sample_utilization()), SimulatedStream('')
+        # Batched invocations carry one command per line
+        stdout = ''.join(self.run(line.strip()) for line in cmd.splitlines())
+        return None, SimulatedStream(stdout), SimulatedStream('')
+
+    # Output of utilization_sampler.SAMPLE_CMD, from the consumption counters of the cluster
+    def sample_utilization(self):
+        cluster = self.cluster
+        output = 'sample|{}\n'.format(time.time())
+        with cluster.lock:
+            for container_id, _ in cluster.containers[self.vm_ip]:
+                cpu_usage, cpu_throttled, disk_bytes, net_out, net_in = cluster.usage.get(container_id, [0.0] * 5)
+                output += 'cpu|{}|{:d}|{:d}\n'.format(cluster.get_full_id(container_id), int(cpu_usage), int(cpu_throttled))
+                output += 'disk|{}|{:d}\n'.format(cluster.get_full_id(container_id), int(disk_bytes))
+                output += 'net|{}|{:d}|{:d}\n'.format(cluster.get_veth(container_id), int(net_out), int(net_in))
+        return output
+
+    def run(self, cmd):
+        cluster = self.cluster
+        containers = cluster.containers[self.vm_ip]
+
+        # Benchmarks of cluster_calibration, timed so that the measured capacities are those of the spec
+        machine = cluster.get_machine(self.vm_ip)
+        if cmd.startswith('echo "fingerprint|'):
+            return 'fingerprint|sim-{}-{}-{}\n'.format(machine['cores'], machine['disk_bps'], machine['net_bps'])
+        if cmd.startswith('cores='):
+            return 'cores|{}\n'.format(machine['cores'])
+        for benchmark in ['cpu_single', 'cpu_parallel']:
+            if 'echo "{}|'.format(benchmark) in cmd:
+                return '{}|0|1\n'.format(benchmark)
+        for benchmark in ['disk_write', 'disk_read']:
+            if 'echo "{}|'.format(benchmark) in cmd:
+                # Only the write states the size of the file
+                match = disk_count_pattern.search(cmd)
+                if match:
+                    self.disk_bytes = int(match.group(1)) * 1024 * 1024
+                return '{}|0|{}\n'.format(benchmark, self.disk_bytes / float(machine['disk_bps']))
+        if cmd.startswith('echo "link_speed|'):
+            return 'link_speed|\n'
+        if cmd.startswith('echo "net|'):
+            return 'net|{}\n'.format(machine['net_bps'] / 10.0 ** 6)
+        if cmd.startswith('iperf3 -s') or 'cpu_work()' in cmd or cmd.startswith('f=$(mktemp') or cmd.startswith('rm -f $f'):
+            return ''
+
+        if 'docker events' in cmd:
+            events, until = cluster.read_events(self.vm_ip)
+            return ''.join('{}\n'.format(json.dumps(event)) for event in events) + 'until|{}\n'.format(until)
+
+        if cmd.startswith('docker ps'):
+            # Batched docker inspect of cluster_discovery, endpoint ids are the veth names
+            if 'docker inspect' in cmd and '.EndpointID' in cmd:
+                return ''.join('inspect|{}|{} \n'.format(cluster.get_full_id(container_id), cluster.get_veth(container_id))
+                               for container_id, _ in containers)
+            if '{{json .}}' in cmd:
+                return ''.join('{}\n'.format(json.dumps({'ID': cluster.get_full_id(container_id), 'Image': service_name,
+                                                          'Names': service_name}))
+                               for container_id, service_name in containers)
+            if '{{.ID}} {{.Names}}' in cmd:
+                return ''.join('{} {}\n'.format(cluster.get_full_id(container_id), service_name) for container_id, service_name in containers)
+            if '.Names' in cmd or '-f2' in cmd:
+                return ''.join('{}\n'.format(service_name) for _, service_name in containers)
+            return ''.join('{}\n'.format(container_id) for container_id, _ in containers)
+
+        if cmd.startswith('nproc'):
+            return '{}\n'.format(NUM_CORES)
+
+        match = docker_update_pattern.search(cmd)
+        if match:
+            options = dict(option.lstrip('-').split('=') for option in match.group(1).split())
+            container_id = match.group(2)
+            if 'cpu-quota' in options:
+                quota = int(options['cpu-quota'])
+                period = int(options.get('cpu-period', 1000000))
+                cluster.set_setting(container_id, 'cpu_quota', max(quota, -1))
+                if quota < 0:
+                    cluster.clear_allocation(container_id, 'CPU-QUOTA')
+                else:
+                    cluster.set_allocation(container_id, 'CPU-QUOTA', 100.0 * quota / period)
+            if 'cpuset-cpus' in options:
+                last_core = int(options['cpuset-cpus'].split('-')[-1])
+                cluster.set_setting(container_id, 'cpuset', options['cpuset-cpus'])
+                cluster.set_allocation(container_id, 'CPU-CORE', last_core + 1)
+            return ''
+
+        match = blkio_pattern.search(cmd)
+        if match:
+            container_id = match.group(2)
+            bps = int(match.group(1))
+            cluster.set_setting(container_id, 'blkio', bps)
+            # A limit of 0 removes the throttle
+            if bps == 0:
+                cluster.clear_allocation(container_id, 'DISK')
+            else:
+                cluster.set_allocation(container_id, 'DISK', bps)
+            return ''
+
+        match = ovs_rate_pattern.search(cmd)
+        if match:
+            container_id = cluster.veth_to_container.get(match.group(1))
+            rate_kbps = int(match.group(2))
+            if container_id is not None:
+                cluster.set_setting(container_id, 'ovs_rate', rate_kbps)
+                if rate_kbps == 0:
+                    cluster.clear_allocation(container_id, 'NET')
+                else:
+                    cluster.set_allocation(container_id, 'NET', rate_kbps * (10 ** 3))
+            return ''
+
+        match = cpu_readback_pattern.search(cmd)
+        if match:
+            container_id = match.group(1)
+            quota = cluster.get_setting(container_id, 'cpu_quota', -1)
+            cpuset = cluster.get_setting(container_id, 'cpuset', '0-{}'.format(NUM_CORES - 1))
+            return '{} {} {}\n'.format(container_id, quota, cpuset)
+
+        match = blkio_readback_pattern.search(cmd)
+        if match:
+            bps = cluster.get_setting(match.group(1), 'blkio', 0)
+            if bps == 0:
+                return 'read\nwrite\n'
+            return 'read {}\nwrite {}\n'.format(bps, bps)
+
+        match = ovs_readback_pattern.search(cmd)
+        if match:
+            container_id = cluster.veth_to_container.get(match.group(1))
+            return '{}\n'.format(cluster.get_setting(container_id, 'ovs_rate', 0))
+
+        match = inspect_pattern.search(cmd)
+        if match and 'EndpointID' in cmd:
+            # Mimics the two EndpointID lines of docker inspect
+            veth = cluster.get_veth(match.group(1))
+            return '"EndpointID": "",\n"EndpointID": "{}",\n'.format(veth)
+
+        return ''
+
+    def close(self):
+        pass
+
+# Loads a cluster spec from a JSON file
+def load_cluster(spec_file):
+    with open(spec_file) as f:
+        return SimulatedCluster(json.load(f))
+
+# Generates a spec with num_services services spread over num_vms VMs
+# Every MR gets a response curve with a random weight
+def generate_cluster_spec(num_vms, num_services, replicas=2, seed=0, noise=0.02):
+    rand = random.Random(seed)
+    vm_ips = ['10.{}.{}.{}'.format(i // 65536, (i // 256) % 256, i % 256) for i in range(1, num_vms + 1)]
+    spec = {'seed': seed, 'vms': vm_ips, 'services': {}, 'curves': {},
+            'base_latency': 100.0, 'noise': noise}
+    for service_index in range(num_services):
+        service_name = 'service{}:latest'.format(service_index)
+        spec['services'][service_name] = rand.sample(vm_ips, min(replicas, num_vms))
+        for resource in DEFAULT_REFERENCE:
+            spec['curves']['{},{}'.format(service_name, resource)] = {'weight': rand.expovariate(1.0)}
+    return spec
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("spec_file", help="Where to write the generated cluster spec")
+    parser.add_argument("--vms", type=int, default=10, help="Number of simulated VMs")
+    parser.add_argument("--services", type=int, default=100, help="Number of simulated services")
+    parser.add_argument("--replicas", type=int, default=2, help="Containers per service")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--noise", type=float, default=0.02, help="Standard deviation of the multiplicative noise")
+    args = parser.parse_args()
+
+    spec = generate_cluster_spec(args.vms, args.services, args.replicas, args.seed, args.noise)
+    with open(args.spec_file, 'w') as f:
+        json.dump(spec, f, indent=2)
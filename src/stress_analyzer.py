@@ -1,25 +1,87 @@
 import argparse
+import math
 import numpy as np
 import remote_execution as remote_exec
 
 from cluster_information import *
 from random import shuffle
 import redis_resource as resource_datastore
+import redis_client as tbot_datastore
 
 from mr import MR
 
 ### Pre-defined blacklist (Temporary)
 blacklist = ['quilt/ovs', 'google/cadvisor:v0.24.1', 'quay.io/coreos/etcd:v3.0.2', 'mchang6137/quilt:latest']
 
+# Number of MRs the GROUP policy isolates on every iteration, best first
+# Single MRs measured along the way are ranked too, as fallbacks for get_top_n_mimr
+GROUP_TEST_RESULTS = 1
+
+# Fraction of the MRs the UCB policy stresses on every iteration
+UCB_ARMS_FRACTION = 0.25
+
+# Spread of the sensitivity assumed before any MR has been measured twice
+UCB_MIN_SPREAD = 0.01
+
 # Returns a list of MRs to stress in following iterations
+# Under GROUP, these are only the candidates: they are stressed in groups (see split_mr_group)
 def generate_mr_from_policy(redis_db, stress_policy):
     # Retrieves all MRs directly from Cluster information
     if stress_policy == 'ALL':
         return resource_datastore.get_all_mrs(redis_db)
+    elif stress_policy == 'GROUP':
+        return sorted(resource_datastore.get_all_mrs(redis_db), key=lambda mr: mr.to_string())
+    elif stress_policy == 'UCB':
+        return select_mrs_ucb(redis_db, resource_datastore.get_all_mrs(redis_db))
     else:
         print 'This stress policy does not exist; defaulting to ALL stress'
         return resource_datastore.get_all_mrs(redis_db)
 
+# UCB policy: treats every MR as an arm whose reward is its sensitivity
+# (see redis_client.write_mr_sensitivity) and selects the UCB_ARMS_FRACTION of
+# MRs with the highest upper confidence bound. MRs never measured are always
+# selected, so the first iteration stresses every MR.
+def select_mrs_ucb(redis_db, mr_list):
+    mr_to_sensitivity = tbot_datastore.read_mr_sensitivities(redis_db, mr_list)
+    total_measurements = sum(count for count,_,_ in mr_to_sensitivity.values())
+
+    # Pooled spread of repeated measurements of the same MR scales the exploration bonus
+    squared_deviations = 0.0
+    degrees_of_freedom = 0
+    for count,total,total_sq in mr_to_sensitivity.values():
+        if count > 1:
+            squared_deviations += max(total_sq - total ** 2 / count, 0.0)
+            degrees_of_freedom += count - 1
+    spread = UCB_MIN_SPREAD
+    if degrees_of_freedom > 0:
+        spread = max(spread, math.sqrt(squared_deviations / degrees_of_freedom))
+
+    mr_to_bound = {}
+    for mr in mr_list:
+        count,total,_ = mr_to_sensitivity[mr]
+        if count == 0:
+            mr_to_bound[mr] = float('inf')
+        else:
+            mr_to_bound[mr] = total / count + spread * math.sqrt(2 * math.log(total_measurements) / count)
+
+    num_unmeasured = len([mr for mr in mr_list if mr_to_sensitivity[mr][0] == 0])
+    num_arms = max(1, num_unmeasured, int(math.ceil(UCB_ARMS_FRACTION * len(mr_list))))
+    ranked_mrs = sorted(mr_list, key=lambda mr: (-mr_to_bound[mr], mr.to_string()))
+    return ranked_mrs[:num_arms]
+
+# Returns the MRs of mr_list that have been measured, with their mean sensitivity
+def get_estimated_sensitivities(redis_db, mr_list):
+    mr_to_estimate = {}
+    for mr,(count,total,_) in tbot_datastore.read_mr_sensitivities(redis_db, mr_list).items():
+        if count > 0:
+            mr_to_estimate[mr] = total / count
+    return mr_to_estimate
+
+# Splits a group of MRs into two halves for group testing
+# Halves are interleaved so that the resources of one service end up in different halves
+def split_mr_group(mr_group):
+    return mr_group[0::2], mr_group[1::2]
+
 # Policy that returns all MRs subject to restrictions on
 # VMs, service names, and resources
 def get_all_mrs_cluster(vm_list, services, resources):
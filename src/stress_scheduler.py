@@ -24,9 +24,7 @@ from run_experiment import *
 from container_information import *
 from present_results import *
 from run_spark_streaming import *
-
-#Amount of time to allow commands to propagate through system
-COMMAND_DELAY = 3
+from result_encoding import encode_values
 
 ### Throttle only a single resource at a time.
 def throttle_cpu_quota(ssh_client, container_id, cpu_period, cpu_quota):
@@ -56,10 +54,7 @@ def stop_throttle_cpu(ssh_client, container_id, cores):
 
 def stop_throttle_network(ssh_client, container_id):
     print 'RESETTING NETWORK THROTTLING'
-    # reset_egress_network_bandwidth(ssh_client, container_id)
-    container_to_network_capacity = get_container_network_capacity(ssh_client, container_id)
-    network_bandwith = weighting_to_bandwidth(ssh_client, 0, container_to_network_capacity)
-    throttle_network(ssh_client, container_id, network_bandwith)
+    reset_egress_network_bandwidth(ssh_client, container_id)
 
 def stop_throttle_disk(ssh_client, container_id):
     print 'RESETTING DISK THROTTLING'
@@ -70,8 +65,29 @@ def reset_all_stresses(ssh_client, container_id, cpu_cores):
     print 'RESETTING ALL STRESSES!'
     stop_throttle_cpu(ssh_client, container_id, cpu_cores)
     stop_throttle_disk(ssh_client, container_id)
+    # Each stop_throttle_* call returns once its change is visible on the machine
     stop_throttle_network(ssh_client, container_id)
-    sleep(COMMAND_DELAY)
+
+# Writes every metric of one experiment to the hash and sorted set of a service's resource
+# in a single transaction, so readers never see some metrics of the experiment without the others
+def write_experiment_data(redis_db, experiment_iteration_count, service_tag, resource, increment, results_data):
+    hash_name = '{},{},{}'.format(experiment_iteration_count, service_tag, resource)
+    sorted_set_name = '{},{}'.format(service_tag, resource)
+    print 'HashName: {}'.format(hash_name)
+    print 'SortedSetName: {}'.format(sorted_set_name)
+    pipe = redis_db.pipeline()
+    key_to_data = {}
+    for metric, data in results_data.iteritems():
+        # Histograms are not a list of values (see redis_client.write_redis_results)
+        if metric == 'histograms':
+            continue
+        key_name = '{},{}'.format(increment, metric)
+        sorted_key_name = '{},{}'.format(experiment_iteration_count, key_name)
+        key_to_data[key_name] = encode_values(data)
+        pipe.zadd(sorted_set_name, numpy.mean(data), sorted_key_name)
+    if len(key_to_data) > 0:
+        pipe.hmset(hash_name, key_to_data)
+    pipe.execute()
 
 def model_machine(ssh_clients, container_ids_dict, experiment_inc_args, experiment_iterations, experiment_type,
                   stress_policy, resources, only_baseline, resume_bool, prev_results,
@@ -133,37 +149,13 @@ def model_machine(ssh_clients, container_ids_dict, experiment_inc_args, experime
                                                          experiment_type)
 
             reduction_level_to_latency_network_service[0] = baseline_runtime_array
-            hash_name = '{},{},{}'.format(experiment_iteration_count, service_tag, 'NET')
-            sorted_set_name = '{},{}'.format(service_tag, 'NET')
-            print 'HashName: {}'.format(hash_name)
-            print 'SortedSetName: {}'.format(sorted_set_name)
-            for metric, data in baseline_runtime_array.iteritems():
-                key_name = '{},{}'.format(0, metric)
-                sorted_key_name = '{},{}'.format(experiment_iteration_count, key_name)
-                redis_db.hset(hash_name, key_name, '{}'.format(data))
-                redis_db.zadd(sorted_set_name, numpy.mean(data), sorted_key_name)
+            write_experiment_data(redis_db, experiment_iteration_count, service_tag, 'NET', 0, baseline_runtime_array)
 
             reduction_level_to_latency_disk_service[0] = baseline_runtime_array
-            hash_name = '{},{},{}'.format(experiment_iteration_count, service_tag, 'DISK')
-            sorted_set_name = '{},{}'.format(service_tag, 'DISK')
-            print 'HashName: {}'.format(hash_name)
-            print 'SortedSetName: {}'.format(sorted_set_name)
-            for metric, data in baseline_runtime_array.iteritems():
-                key_name = '{},{}'.format(0, metric)
-                sorted_key_name = '{},{}'.format(experiment_iteration_count, key_name)
-                redis_db.hset(hash_name, key_name, '{}'.format(data))
-                redis_db.zadd(sorted_set_name, numpy.mean(data), sorted_key_name)
+            write_experiment_data(redis_db, experiment_iteration_count, service_tag, 'DISK', 0, baseline_runtime_array)
 
             reduction_level_to_latency_cpu_service[0] = baseline_runtime_array
-            hash_name = '{},{},{}'.format(experiment_iteration_count, service_tag, 'CPU')
-            sorted_set_name = '{},{}'.format(service_tag, 'CPU')
-            print 'HashName: {}'.format(hash_name)
-            print 'SortedSetName: {}'.format(sorted_set_name)
-            for metric, data in baseline_runtime_array.iteritems():
-                key_name = '{},{}'.format(0, metric)
-                sorted_key_name = '{},{}'.format(experiment_iteration_count, key_name)
-                redis_db.hset(hash_name, key_name, '{}'.format(data))
-                redis_db.zadd(sorted_set_name, numpy.mean(data), sorted_key_name)
+            write_experiment_data(redis_db, experiment_iteration_count, service_tag, 'CPU', 0, baseline_runtime_array)
 
         if not only_baseline:
             for increment in increment_values:
@@ -194,15 +186,7 @@ def model_machine(ssh_clients, container_ids_dict, experiment_inc_args, experime
                         stop_throttle_cpu(ssh_client, container_id, cpu_cores)
 
                     reduction_level_to_latency_cpu_service[increment] = results_data_cpu
-                    hash_name = '{},{},{}'.format(experiment_iteration_count, service_tag, 'CPU')
-                    sorted_set_name = '{},{}'.format(service_tag, 'CPU')
-                    print 'HashName: {}'.format(hash_name)
-                    print 'SortedSetName: {}'.format(sorted_set_name)
-                    for metric, data in results_data_cpu.iteritems():
-                        key_name = '{},{}'.format(increment, metric)
-                        sorted_key_name = '{},{}'.format(experiment_iteration_count, key_name)
-                        redis_db.hset(hash_name, key_name, '{}'.format(data))
-                        redis_db.zadd(sorted_set_name, numpy.mean(data), sorted_key_name)
+                    write_experiment_data(redis_db, experiment_iteration_count, service_tag, 'CPU', increment, results_data_cpu)
 
                 if 'NET' in resources:
                     print '======================================'
@@ -211,9 +195,7 @@ def model_machine(ssh_clients, container_ids_dict, experiment_inc_args, experime
                         for vm_ip, container_id in ip_container_tuples:
                             print 'STRESSING VM_IP {} AND CONTAINER {}'.format(vm_ip, container_id)
                             ssh_client = ssh_clients[vm_ip]
-                            container_to_network_capacity = get_container_network_capacity(ssh_client, container_id)
-                            network_reduction_rate = weighting_to_bandwidth(ssh_client, increment,
-                                                                            container_to_network_capacity)
+                            network_reduction_rate = get_network_capabilities(redis_db, vm_ip, increment)
                             throttle_network(ssh_client, container_id, network_reduction_rate)
 
                         results_data_network = measure_runtime(container_id, experiment_args, experiment_iterations,
@@ -224,15 +206,7 @@ def model_machine(ssh_clients, container_ids_dict, experiment_inc_args, experime
                             stop_throttle_network(ssh_client, container_id)
 
                         reduction_level_to_latency_network_service[increment] = results_data_network
-                        hash_name = '{},{},{}'.format(experiment_iteration_count, service_tag, 'NET')
-                        sorted_set_name = '{},{}'.format(service_tag, 'NET')
-                        print 'HashName: {}'.format(hash_name)
-                        print 'SortedSetName: {}'.format(sorted_set_name)
-                        for metric, data in results_data_network.iteritems():
-                            key_name = '{},{}'.format(increment, metric)
-                            sorted_key_name = '{},{}'.format(experiment_iteration_count, key_name)
-                            redis_db.hset(hash_name, key_name, '{}'.format(data))
-                            redis_db.zadd(sorted_set_name, numpy.mean(data), sorted_key_name)
+                        write_experiment_data(redis_db, experiment_iteration_count, service_tag, 'NET', increment, results_data_network)
                     except:
                         print 'Passed NET'
                         reduction_level_to_latency_network_service[increment] = \
@@ -254,15 +228,7 @@ def model_machine(ssh_clients, container_ids_dict, experiment_inc_args, experime
                         stop_throttle_disk(ssh_client, container_id)
 
                     reduction_level_to_latency_disk_service[increment] = results_data_disk
-                    hash_name = '{},{},{}'.format(experiment_iteration_count, service_tag, 'DISK')
-                    sorted_set_name = '{},{}'.format(service_tag, 'DISK')
-                    print 'HashName: {}'.format(hash_name)
-                    print 'SortedSetName: {}'.format(sorted_set_name)
-                    for metric, data in results_data_disk.iteritems():
-                        key_name = '{},{}'.format(increment, metric)
-                        sorted_key_name = '{},{}'.format(experiment_iteration_count, key_name)
-                        redis_db.hset(hash_name, key_name, '{}'.format(data))
-                        redis_db.zadd(sorted_set_name, numpy.mean(data), sorted_key_name)
+                    write_experiment_data(redis_db, experiment_iteration_count, service_tag, 'DISK', increment, results_data_disk)
 
                 # Saving results
                 reduction_level_to_latency_network[service_tag] = reduction_level_to_latency_network_service
@@ -0,0 +1,333 @@
+import argparse
+import binascii
+import glob
+import hashlib
+import hmac
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+
+try:
+    import SocketServer as socketserver
+except ImportError:
+    import socketserver
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+'''
+Lightweight throttling agent that runs on every VM of the cluster.
+
+Throttlebot keeps one long-lived TCP connection to the agent and sends
+batched requests as newline-delimited JSON. The agent greets every new
+connection with a random nonce:
+  {"nonce": ...}
+and every batch is then signed with the shared token, which never goes over the wire:
+  {"payload": <JSON of {"seq": n, "requests": [{"op": "set_cpu_quota", "container_id": ..., ...}, ...]}>,
+   "mac": <HMAC-SHA256 of nonce + payload, keyed by the token>}
+seq must increase within a connection, so a captured batch cannot be replayed.
+The agent answers with one line per batch:
+  {"results": [{"ok": true, ...}, {"ok": false, "error": ...}, ...]}
+Batches and results are not encrypted, so the agent should only be reachable
+from the private network of the cluster.
+
+Allocations are written straight into the container's cgroup (v1 or the
+unified v2 hierarchy) so no remote shell or docker CLI process is started.
+Network policing still goes through OVS. The agent only runs the operations
+below, never arbitrary commands: everything else Throttlebot runs on the
+VMs goes over SSH.
+
+Start it on a VM with:
+$ sudo python throttle_agent.py --port 4545 --token <secret>
+It listens on 127.0.0.1 unless --host is given, and refuses to start without a token.
+--cgroup_root points the agent at another cgroup hierarchy (see check_throttle_agent.py).
+'''
+
+DEFAULT_AGENT_PORT = 4545
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+
+# Major:minor number of the block device that containers write to
+DEFAULT_BLOCK_DEVICE = '202:0'
+
+# Full or abbreviated Docker container IDs
+CONTAINER_ID_PATTERN = re.compile(r'^[0-9a-f]{1,64}$')
+
+def is_cgroup_v2():
+    return os.path.exists(os.path.join(CGROUP_ROOT, 'cgroup.controllers'))
+
+# Cache of (container_id, controller) -> cgroup directory
+cgroup_dir_cache = {}
+veth_cache = {}
+cache_lock = threading.Lock()
+
+# Finds the cgroup directory of a container for a v1 controller
+# (cpu, cpuset, blkio) or the unified directory in v2 (controller ignored)
+def find_cgroup_dir(container_id, controller):
+    check_container_id(container_id)
+    key = (container_id, controller)
+    with cache_lock:
+        if key in cgroup_dir_cache:
+            return cgroup_dir_cache[key]
+
+    if is_cgroup_v2():
+        base_dirs = [CGROUP_ROOT]
+    else:
+        base_dirs = [os.path.join(CGROUP_ROOT, controller)]
+        if controller == 'cpu':
+            base_dirs.append(os.path.join(CGROUP_ROOT, 'cpu,cpuacct'))
+
+    candidates = []
+    for base_dir in base_dirs:
+        candidates += glob.glob(os.path.join(base_dir, 'docker', container_id + '*'))
+        candidates += glob.glob(os.path.join(base_dir, 'system.slice', 'docker-' + container_id + '*.scope'))
+    if len(candidates) == 0:
+        raise ValueError('No cgroup found for container {}'.format(container_id))
+
+    with cache_lock:
+        cgroup_dir_cache[key] = candidates[0]
+    return candidates[0]
+
+# Container IDs end up in paths and command arguments, so anything else is rejected
+def check_container_id(container_id):
+    if not CONTAINER_ID_PATTERN.match(str(container_id)):
+        raise ValueError('Invalid container id {}'.format(container_id))
+
+def write_cgroup_file(container_id, controller, file_name, value):
+    path = os.path.join(find_cgroup_dir(container_id, controller), file_name)
+    with open(path, 'w') as f:
+        f.write(str(value))
+
+def read_cgroup_file(container_id, controller, file_name):
+    path = os.path.join(find_cgroup_dir(container_id, controller), file_name)
+    with open(path) as f:
+        return f.read()
+
+# args is a list, which is never interpreted by a shell
+def run_command(args):
+    p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = p.communicate()
+    return {'stdout': stdout.decode('utf-8', 'replace'),
+            'stderr': stderr.decode('utf-8', 'replace'),
+            'exit_status': p.returncode}
+
+'''Operations understood by the agent'''
+
+def op_ping(request):
+    return {}
+
+# quota is in microseconds per period; -1 removes the limit
+def op_set_cpu_quota(request):
+    container_id = request['container_id']
+    period = int(request.get('period', 1000000))
+    quota = int(request['quota'])
+    if is_cgroup_v2():
+        quota_str = 'max' if quota < 0 else str(quota)
+        write_cgroup_file(container_id, 'cpu', 'cpu.max', '{} {}'.format(quota_str, period))
+    else:
+        # Quota must be removed before the period can be changed safely
+        write_cgroup_file(container_id, 'cpu', 'cpu.cfs_quota_us', -1)
+        write_cgroup_file(container_id, 'cpu', 'cpu.cfs_period_us', period)
+        write_cgroup_file(container_id, 'cpu', 'cpu.cfs_quota_us', quota)
+    return {}
+
+def op_reset_cpu_quota(request):
+    request = dict(request, quota=-1)
+    return op_set_cpu_quota(request)
+
+# cpus is a cpuset string such as '0-3'
+def op_set_cpu_cores(request):
+    container_id = request['container_id']
+    write_cgroup_file(container_id, 'cpuset', 'cpuset.cpus', request['cpus'])
+    return {}
+
+def op_reset_cpu_cores(request):
+    num_cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.sysconf('SC_NPROCESSORS_ONLN')
+    request = dict(request, cpus='0-{}'.format(num_cores - 1))
+    return op_set_cpu_cores(request)
+
+# bps of 0 removes the limit
+def op_set_blkio(request):
+    container_id = request['container_id']
+    device = request.get('device', DEFAULT_BLOCK_DEVICE)
+    bps = int(request['bps'])
+    if is_cgroup_v2():
+        limit = 'max' if bps == 0 else str(bps)
+        write_cgroup_file(container_id, 'io', 'io.max', '{} rbps={} wbps={}'.format(device, limit, limit))
+    else:
+        write_cgroup_file(container_id, 'blkio', 'blkio.throttle.write_bps_device', '{} {}'.format(device, bps))
+        write_cgroup_file(container_id, 'blkio', 'blkio.throttle.read_bps_device', '{} {}'.format(device, bps))
+    return {}
+
+def resolve_veth(container_id):
+    with cache_lock:
+        if container_id in veth_cache:
+            return veth_cache[container_id]
+    check_container_id(container_id)
+    result = run_command(['docker', 'inspect', '--format', '{{range .NetworkSettings.Networks}}{{.EndpointID}} {{end}}', container_id])
+    endpoint_ids = result['stdout'].split()
+    if result['exit_status'] != 0 or len(endpoint_ids) == 0:
+        raise ValueError('No network endpoint for container {}'.format(container_id))
+    # OVS interface names are the first 15 characters of the endpoint id
+    interface_name = endpoint_ids[0][:15]
+    with cache_lock:
+        veth_cache[container_id] = interface_name
+    return interface_name
+
+def op_resolve_veth(request):
+    return {'interface': resolve_veth(request['container_id'])}
+
+# kbps of 0 removes the limit
+def op_set_net_bandwidth(request):
+    interface_name = resolve_veth(request['container_id'])
+    kbps = int(request['kbps'])
+    result = run_command(['docker', 'exec', 'ovs-vswitchd', 'ovs-vsctl',
+                          'set', 'interface', interface_name, 'ingress_policing_rate={}'.format(kbps),
+                          '--', 'set', 'interface', interface_name, 'ingress_policing_burst=0'])
+    if result['exit_status'] != 0 or result['stderr']:
+        raise SystemError('Network Set Error: {}'.format(result['stderr']))
+    return {}
+
+def op_reset_net_bandwidth(request):
+    request = dict(request, kbps=0)
+    return op_set_net_bandwidth(request)
+
+# Returns cumulative counters: CPU throttled time (ns), disk bytes serviced,
+# and network bytes sent/received on the container's interface
+def op_read_cgroup_stats(request):
+    container_id = request['container_id']
+    stats = {}
+
+    cpu_stat = dict(line.split() for line in read_cgroup_file(container_id, 'cpu', 'cpu.stat').splitlines())
+    if 'throttled_time' in cpu_stat:
+        stats['cpu_throttled_ns'] = int(cpu_stat['throttled_time'])
+    else:
+        stats['cpu_throttled_ns'] = int(cpu_stat.get('throttled_usec', 0)) * 1000
+
+    disk_bytes = 0
+    if is_cgroup_v2():
+        for line in read_cgroup_file(container_id, 'io', 'io.stat').splitlines():
+            for field in line.split()[1:]:
+                name, value = field.split('=')
+                if name in ['rbytes', 'wbytes']:
+                    disk_bytes += int(value)
+    else:
+        for line in read_cgroup_file(container_id, 'blkio', 'blkio.throttle.io_service_bytes').splitlines():
+            fields = line.split()
+            if len(fields) == 2 and fields[0] == 'Total':
+                disk_bytes = int(fields[1])
+    stats['disk_bytes'] = disk_bytes
+
+    stats['net_rx_bytes'] = 0
+    stats['net_tx_bytes'] = 0
+    try:
+        interface_name = resolve_veth(container_id)
+    except ValueError:
+        interface_name = None
+    if interface_name is not None:
+        with open('/proc/net/dev') as f:
+            for line in f.readlines()[2:]:
+                name, counters = line.split(':', 1)
+                if name.strip() == interface_name:
+                    counters = counters.split()
+                    stats['net_rx_bytes'] = int(counters[0])
+                    stats['net_tx_bytes'] = int(counters[8])
+    return stats
+
+def op_invalidate(request):
+    with cache_lock:
+        cgroup_dir_cache.clear()
+        veth_cache.clear()
+    return {}
+
+OPERATIONS = {
+    'ping': op_ping,
+    'set_cpu_quota': op_set_cpu_quota,
+    'reset_cpu_quota': op_reset_cpu_quota,
+    'set_cpu_cores': op_set_cpu_cores,
+    'reset_cpu_cores': op_reset_cpu_cores,
+    'set_blkio': op_set_blkio,
+    'set_net_bandwidth': op_set_net_bandwidth,
+    'reset_net_bandwidth': op_reset_net_bandwidth,
+    'resolve_veth': op_resolve_veth,
+    'read_cgroup_stats': op_read_cgroup_stats,
+    'invalidate': op_invalidate,
+}
+
+# Signature of a batch payload, as computed by remote_execution.AgentClient
+def sign_payload(token, nonce, payload):
+    return hmac.new(token.encode('utf-8'), (nonce + payload).encode('utf-8'), hashlib.sha256).hexdigest()
+
+# connection is the per-connection state: {'nonce': ..., 'seq': last accepted seq}
+def handle_batch(batch, token, connection):
+    payload = batch.get('payload')
+    if not isinstance(payload, string_types):
+        return {'error': 'Missing payload'}
+    if not hmac.compare_digest(str(batch.get('mac', '')), sign_payload(token, connection['nonce'], payload)):
+        return {'error': 'Invalid signature'}
+    payload = json.loads(payload)
+    if not isinstance(payload, dict):
+        return {'error': 'Malformed payload'}
+    seq = payload.get('seq')
+    if not isinstance(seq, int) or seq <= connection['seq']:
+        return {'error': 'Replayed batch'}
+    connection['seq'] = seq
+
+    results = []
+    for request in payload.get('requests', []):
+        op = OPERATIONS.get(request.get('op'))
+        if op is None:
+            results.append({'ok': False, 'error': 'Unknown op {}'.format(request.get('op'))})
+            continue
+        try:
+            result = op(request)
+            result['ok'] = True
+        except Exception as e:
+            result = {'ok': False, 'error': '{}: {}'.format(type(e).__name__, e)}
+        results.append(result)
+    return {'results': results}
+
+class AgentRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        connection = {'nonce': binascii.hexlify(os.urandom(16)).decode('ascii'), 'seq': 0}
+        self.wfile.write((json.dumps({'nonce': connection['nonce']}) + '\n').encode('utf-8'))
+        self.wfile.flush()
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            try:
+                response = handle_batch(json.loads(line.decode('utf-8')), self.server.token, connection)
+            except ValueError as e:
+                response = {'error': 'Malformed request: {}'.format(e)}
+            self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+            self.wfile.flush()
+
+class AgentServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, token):
+        socketserver.TCPServer.__init__(self, address, AgentRequestHandler)
+        self.token = token
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default='127.0.0.1', help="Address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_AGENT_PORT, help="Port to listen on")
+    parser.add_argument("--token", required=True, help="Shared secret that every batch of Throttlebot must be signed with")
+    parser.add_argument("--cgroup_root", default=CGROUP_ROOT, help="Root of the cgroup hierarchy")
+    args = parser.parse_args()
+    if not args.token.strip():
+        print('A non-empty --token is required')
+        sys.exit(1)
+    CGROUP_ROOT = args.cgroup_root
+
+    server = AgentServer((args.host, args.port), args.token)
+    print('Throttle agent listening on {}:{}'.format(args.host, args.port))
+    server.serve_forever()
@@ -0,0 +1,46 @@
+import math
+
+'''
+Confidence intervals over the per-trial values of a metric, used to
+decide when enough trials of an experiment have been run.
+
+Two-sided 95% intervals use Student's t distribution, read from a table
+so that no statistics package is needed.
+'''
+
+# Degrees of freedom -> two-sided 95% critical value of Student's t
+T_TABLE_95 = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365,
+              8: 2.306, 9: 2.262, 10: 2.228, 11: 2.201, 12: 2.179, 13: 2.160, 14: 2.145,
+              15: 2.131, 16: 2.120, 17: 2.110, 18: 2.101, 19: 2.093, 20: 2.086, 21: 2.080,
+              22: 2.074, 23: 2.069, 24: 2.064, 25: 2.060, 26: 2.056, 27: 2.052, 28: 2.048,
+              29: 2.045, 30: 2.042, 40: 2.021, 60: 2.000, 120: 1.980}
+
+# Critical value for a large number of degrees of freedom (normal distribution)
+Z_95 = 1.960
+
+# Uses the closest tabulated degrees of freedom at or below the requested one,
+# which errs on the side of a wider interval
+def t_critical_value(degrees_of_freedom):
+    if degrees_of_freedom > max(T_TABLE_95):
+        return Z_95
+    tabulated = max(df for df in T_TABLE_95 if df <= degrees_of_freedom)
+    return T_TABLE_95[tabulated]
+
+# Returns (mean, half width of the 95% confidence interval of the mean)
+# The half width is infinite with fewer than two values
+def confidence_interval(values):
+    num_values = len(values)
+    if num_values == 0:
+        return 0.0, float('inf')
+    mean = float(sum(values)) / num_values
+    if num_values < 2:
+        return mean, float('inf')
+    variance = sum((value - mean) ** 2 for value in values) / (num_values - 1)
+    return mean, t_critical_value(num_values - 1) * math.sqrt(variance / num_values)
+
+# True if the confidence interval is within tolerance (a fraction of the mean) of the mean
+def is_confident(values, tolerance):
+    mean, half_width = confidence_interval(values)
+    if mean == 0:
+        return half_width == 0
+    return half_width <= tolerance * abs(mean)
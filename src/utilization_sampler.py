@@ -0,0 +1,248 @@
+import threading
+import time
+from array import array
+
+import remote_execution as remote_exec
+import container_information
+
+'''
+Samples the resource consumption of every container in the background.
+
+One thread per VM reads, every interval seconds and in a single remote
+invocation, the CPU usage and throttling (cpu.stat), the bytes read and
+written (blkio or io.stat) of all Docker containers on the VM, along with
+/proc/net/dev. The counters of each container are appended to a ring
+buffer of fixed size backed by arrays of doubles, so memory does not grow
+with the length of a run.
+
+get_deltas returns what each container consumed between two points in
+time, which run_throttlebot uses to annotate every stress experiment with
+the resources the stressed MR actually used. snapshot samples the VMs
+immediately, so that an experiment is bracketed by samples taken right
+before it starts and right after it ends.
+'''
+
+# Counters kept for every container, in the order of the ring buffer fields
+# net_out_bytes/net_in_bytes are read on the host side of the container's veth,
+# where the bytes received are those the container sent
+FIELDS = ['cpu_usage_ns', 'cpu_throttled_ns', 'disk_bytes', 'net_out_bytes', 'net_in_bytes']
+
+DEFAULT_INTERVAL = 1.0
+# Samples kept per container, 10 minutes at the default interval
+DEFAULT_CAPACITY = 600
+
+# Prints sample|<time>, then cpu|<full id>|<usage ns>|<throttled ns> and disk|<full id>|<bytes>
+# for every container, then net|<interface>|<bytes received>|<bytes sent> for every interface
+SAMPLE_CMD = '''echo "sample|$(date +%s.%N)"
+if [ -f /sys/fs/cgroup/cgroup.controllers ]; then
+  for d in /sys/fs/cgroup/system.slice/docker-*.scope; do
+    [ -d $d ] || continue
+    id=${d##*/docker-}; id=${id%.scope}
+    echo "cpu|$id|$(awk '/^usage_usec/ {u=$2*1000} /^throttled_usec/ {t=$2*1000} END {printf "%d|%d", u, t}' $d/cpu.stat)"
+    echo "disk|$id|$(awk '{for (i=2; i<=NF; i++) {split($i, kv, "="); if (kv[1] == "rbytes" || kv[1] == "wbytes") s += kv[2]}} END {printf "%d", s}' $d/io.stat 2>/dev/null)"
+  done
+else
+  for d in /sys/fs/cgroup/cpu/docker/*/; do
+    [ -d $d ] || continue
+    id=$(basename $d)
+    echo "cpu|$id|$(cat /sys/fs/cgroup/cpuacct/docker/$id/cpuacct.usage 2>/dev/null)|$(awk '/^throttled_time/ {print $2}' $d/cpu.stat)"
+    echo "disk|$id|$(awk '/^Total/ {t=$2} END {printf "%d", t}' /sys/fs/cgroup/blkio/docker/$id/blkio.throttle.io_service_bytes 2>/dev/null)"
+  done
+fi
+awk 'NR > 2 {sub(":", " "); print "net|" $1 "|" $2 "|" $10}' /proc/net/dev'''
+
+# Container IDs are kept in their short form, as shown by docker ps
+SHORT_ID_LENGTH = 12
+
+class RingBuffer:
+    '''
+    The last capacity samples of num_fields counters, with the time of each sample.
+    Samples must be appended in time order.
+    '''
+    def __init__(self, capacity, num_fields):
+        self.capacity = capacity
+        self.num_fields = num_fields
+        self.times = array('d', [0.0]) * capacity
+        self.values = array('d', [0.0]) * (capacity * num_fields)
+        # Number of samples ever appended, the oldest ones being overwritten
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, timestamp, values):
+        slot = self.count % self.capacity
+        self.times[slot] = timestamp
+        offset = slot * self.num_fields
+        for field in range(self.num_fields):
+            self.values[offset + field] = values[field]
+        self.count += 1
+
+    # Slot of the i-th oldest sample still kept
+    def get_slot(self, i):
+        return (self.count - len(self) + i) % self.capacity
+
+    # Returns (time, [values]) of the latest sample taken at or before timestamp,
+    # or of the oldest sample kept if all are later, None if there are no samples
+    def sample_at(self, timestamp):
+        if len(self) == 0:
+            return None
+        low, high = 0, len(self) - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.times[self.get_slot(middle)] <= timestamp:
+                low = middle
+            else:
+                high = middle - 1
+        slot = self.get_slot(low)
+        offset = slot * self.num_fields
+        return self.times[slot], list(self.values[offset:offset + self.num_fields])
+
+# Parses the output of SAMPLE_CMD into {container_id -> [values of FIELDS]}
+# veth_to_container maps host interfaces to the containers they belong to
+def parse_sample(output, veth_to_container):
+    container_to_values = {}
+    def get_values(container_id):
+        return container_to_values.setdefault(container_id, [0.0] * len(FIELDS))
+
+    for line in output.splitlines():
+        fields = line.strip().split('|')
+        try:
+            if fields[0] == 'cpu' and len(fields) == 4:
+                values = get_values(fields[1][:SHORT_ID_LENGTH])
+                values[0] = float(fields[2] or 0)
+                values[1] = float(fields[3] or 0)
+            elif fields[0] == 'disk' and len(fields) == 3:
+                get_values(fields[1][:SHORT_ID_LENGTH])[2] = float(fields[2] or 0)
+            elif fields[0] == 'net' and len(fields) == 4 and fields[1] in veth_to_container:
+                values = get_values(veth_to_container[fields[1]])
+                values[3] = float(fields[2])
+                values[4] = float(fields[3])
+        except ValueError:
+            continue
+    return container_to_values
+
+# Reads the counters of all containers of the VM of ssh_client in one remote invocation
+# Returns {container_id -> {field -> value}}
+def read_vm_utilization(ssh_client):
+    _, stdout, _ = ssh_client.exec_command(SAMPLE_CMD)
+    container_to_values = parse_sample(stdout.read(), get_veth_to_container())
+    return dict((container_id, dict(zip(FIELDS, container_to_values[container_id]))) for container_id in container_to_values)
+
+def get_veth_to_container():
+    with container_information.veth_cache_lock:
+        return dict((veth, container_id) for container_id, veth in container_information.veth_cache.items())
+
+class UtilizationSampler:
+    '''
+    Samples the containers of vm_ips every interval seconds once started,
+    keeping the last capacity samples of every container
+    '''
+    def __init__(self, vm_ips, interval=DEFAULT_INTERVAL, capacity=DEFAULT_CAPACITY):
+        self.vm_ips = list(vm_ips)
+        self.interval = interval
+        self.capacity = capacity
+        # vm_ip -> {container_id -> RingBuffer}
+        self.buffers = dict((vm_ip, {}) for vm_ip in self.vm_ips)
+        # Held while a VM is sampled, so that the samples of a VM are appended in time order
+        self.vm_locks = dict((vm_ip, threading.Lock()) for vm_ip in self.vm_ips)
+        self.stop_event = threading.Event()
+        self.threads = []
+        self.stats_lock = threading.Lock()
+        self.stats = {'samples': 0, 'errors': 0}
+
+    def sample_vm(self, vm_ip):
+        with self.vm_locks[vm_ip]:
+            ssh_client = remote_exec.get_client(vm_ip)
+            _, stdout, _ = ssh_client.exec_command(SAMPLE_CMD)
+            output = stdout.read()
+            timestamp = time.time()
+            container_to_values = parse_sample(output, get_veth_to_container())
+            vm_buffers = self.buffers[vm_ip]
+            for container_id in container_to_values:
+                if container_id not in vm_buffers:
+                    vm_buffers[container_id] = RingBuffer(self.capacity, len(FIELDS))
+                vm_buffers[container_id].append(timestamp, container_to_values[container_id])
+        with self.stats_lock:
+            self.stats['samples'] += 1
+
+    def sample_periodically(self, vm_ip):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.sample_vm(vm_ip)
+            except Exception as e:
+                with self.stats_lock:
+                    self.stats['errors'] += 1
+                print 'WARNING: Sampling the utilization of {} failed: {}'.format(vm_ip, e)
+
+    def start(self):
+        for vm_ip in self.vm_ips:
+            thread = threading.Thread(target=self.sample_periodically, args=(vm_ip,))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    # Samples vm_ips (all VMs if None) concurrently, right now
+    # Returns a time at or after which the samples were taken, to be passed to get_deltas
+    def snapshot(self, vm_ips=None):
+        if vm_ips is None:
+            vm_ips = self.vm_ips
+        task_errors = remote_exec.execute_per_host(dict((vm_ip, [None]) for vm_ip in set(vm_ips)),
+                                                   lambda vm_ip, task: self.sample_vm(vm_ip))
+        for vm_ip,_ in task_errors:
+            with self.stats_lock:
+                self.stats['errors'] += 1
+            print 'WARNING: Sampling the utilization of {} failed: {}'.format(vm_ip, task_errors[(vm_ip, None)])
+        return time.time()
+
+    # Returns what the instances [(vm_ip, container_id)] (all containers if None) consumed
+    # between start_time and end_time, as {(vm_ip, container_id) -> {field -> amount, 'seconds' -> duration}}
+    # The samples closest to (and not after) start_time and end_time are used
+    def get_deltas(self, start_time, end_time, instances=None):
+        if instances is None:
+            instances = [(vm_ip, container_id) for vm_ip in self.buffers for container_id in self.buffers[vm_ip]]
+        deltas = {}
+        for vm_ip, container_id in instances:
+            if vm_ip not in self.vm_locks:
+                continue
+            with self.vm_locks[vm_ip]:
+                ring_buffer = self.buffers[vm_ip].get(container_id)
+                if ring_buffer is None:
+                    continue
+                start_sample = ring_buffer.sample_at(start_time)
+                end_sample = ring_buffer.sample_at(end_time)
+            delta = dict((field, end_value - start_value)
+                         for field, start_value, end_value in zip(FIELDS, start_sample[1], end_sample[1]))
+            delta['seconds'] = end_sample[0] - start_sample[0]
+            deltas[(vm_ip, container_id)] = delta
+        return deltas
+
+    def get_stats(self):
+        with self.stats_lock:
+            return dict(self.stats)
+
+# Adds up the deltas of several containers (see UtilizationSampler.get_deltas)
+# The duration is the longest of the containers'
+def sum_deltas(deltas):
+    total = dict((field, 0.0) for field in FIELDS)
+    total['seconds'] = 0.0
+    for instance in deltas:
+        for field in FIELDS:
+            total[field] += deltas[instance][field]
+        total['seconds'] = max(total['seconds'], deltas[instance]['seconds'])
+    return total
+
+# The sampler used to annotate experiments, None when utilization is not sampled
+active_sampler = {'sampler': None}
+
+def set_active_sampler(sampler):
+    active_sampler['sampler'] = sampler
+
+def get_active_sampler():
+    return active_sampler['sampler']